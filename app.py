@@ -1,14 +1,37 @@
 import os
+from time import sleep
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, Response, render_template, request, flash, redirect, session, g, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, LoginForm, MessageForm, ProfileForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Likes, Follows, TimelineEntry
+from pagination import Page, page_args, paginate
+from search import TYPEAHEAD_RESULTS, create_search_indexes, search_users
+from identity import forget_identity, load_identity
+from passwords import DEFAULT_LOG_ROUNDS, DEFAULT_WORKERS, hasher
+from loader import DEFAULT_CHUNK_SIZE, load_csvs
+from instrumentation import sql_instrumentation
+from fragments import forget_card, init_fragment_cache
+from profiles import forget_profile, init_profile_cache, load_profile
+from assets import ASSET_ENDPOINT, assets, build_assets
+from replicas import reads_from_replica
+from pooling import DEFAULT_MAX_OVERFLOW, DEFAULT_POOL_SIZE
+from deletion import DEFAULT_BATCH_SIZE, purge_deleted_users
+from live import live_timeline
+from trending import trending
+from suggestions import MAX_SUGGESTIONS, suggested_users, who_to_follow
+from conditional import (add_validators, follows_version, is_following,
+                         likes_version, messages_version, not_modified,
+                         profiles_epoch, timeline_version, user_version)
 
 CURR_USER_KEY = "curr_user"
 
+# Most users /api/follows will follow or unfollow in one request.
+MAX_BULK_FOLLOWS = 100
+
 app = Flask(__name__)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -16,13 +39,63 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
+# Read replicas for pages that only read (comma-separated URLs); none by
+# default. See replicas.py.
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Plain /static files keep their names when they change (unlike built
+# assets, see assets.py), so browsers may only cache them this long
+# before revalidating them.
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.environ.get('STATIC_MAX_AGE', 300))
+
+# gunicorn worker processes (gunicorn reads WEB_CONCURRENCY too).
+app.config['WEB_WORKERS'] = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# bcrypt work factor, and how many processes do the hashing across all
+# web workers (0 = inline).
+app.config['BCRYPT_LOG_ROUNDS'] = int(
+    os.environ.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS))
+
+# Database connections per worker (see pooling.py); set DB_PGBOUNCER=1
+# when connecting through PgBouncer in transaction pooling mode.
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE))
+app.config['DB_MAX_OVERFLOW'] = int(
+    os.environ.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW))
+app.config['DB_PGBOUNCER'] = os.environ.get('DB_PGBOUNCER', '') not in ('', '0')
+
+# Warn when a request runs more SQL queries than this (likely an N+1).
+app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', 20))
+
+# Report per-request SQL stats in X-DB-* headers and at /metrics/sql,
+# and pool stats at /metrics/pool. They're public, so leave this off in
+# production.
+app.config['SQL_METRICS_HEADERS'] = app.config['SQL_METRICS_ENDPOINT'] = (
+    os.environ.get('SQL_METRICS', '') not in ('', '0'))
+app.config['POOL_METRICS_ENDPOINT'] = app.config['SQL_METRICS_ENDPOINT']
+
+# Push new messages to open homepages over server-sent events. Each open
+# page holds a request thread, so only turn this on when gunicorn runs
+# threaded or gevent workers (see live.py).
+app.config['LIVE_TIMELINE_ENABLED'] = os.environ.get('LIVE_TIMELINE', '') not in ('', '0')
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+hasher.init_app(app)
+sql_instrumentation.init_app(app)
+init_fragment_cache(app)
+init_profile_cache(app)
+assets.init_app(app)
+who_to_follow.init_app(app)
+live_timeline.init_app(app)
+trending.init_app(app)
 
 
 ##############################################################################
@@ -31,10 +104,13 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    Static files never need the user, so don't look it up for them.
+    """
+
+    if CURR_USER_KEY in session and request.endpoint not in ('static', ASSET_ENDPOINT):
+        g.user = load_identity(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -130,6 +206,7 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@reads_from_replica
 def list_users():
     """Page with listing of users.
 
@@ -139,33 +216,80 @@ def list_users():
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        users = User.active().all()
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = search_users(search)
+
+    following = set()
+    if g.user:
+        following = Follows.followees_among(g.user.id, [user.id for user in users])
+
+    return render_template('users/index.html', users=users, following=following)
+
+
+@app.route('/api/users/search')
+@reads_from_replica
+def api_search_users():
+    """Typeahead: JSON list of users matching the 'q' param, best first."""
 
-    return render_template('users/index.html', users=users)
+    limit = request.args.get('limit', TYPEAHEAD_RESULTS, type=int)
+    users = search_users(request.args.get('q'), limit=limit)
+
+    return jsonify(users=[{"id": user.id,
+                           "username": user.username,
+                           "image_url": user.image_url} for user in users])
 
 
 @app.route('/users/<int:user_id>')
+@reads_from_replica
 def users_show(user_id):
-    """Show user profile."""
-
-    user = User.query.get_or_404(user_id)
-    likes = [like.message_id for like in Likes.query.filter_by(user_id=g.user.id).all()]
-
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    
-    return render_template('users/show.html', user=user, messages=messages, likes=likes)
+    """Show user profile.
+
+    The first page comes from the profile cache (see profiles.py).
+    """
+
+    if request.args.get('cursor') or request.args.get('limit'):
+        return users_show_page(user_id)
+
+    profile = load_profile(user_id, fresh=g.user is not None and g.user.id == user_id)
+    if profile is None:
+        abort(404)
+
+    latest_id, latest_at = profile.latest
+    cached = not_modified(profile.version, latest_id,
+                          g.user and is_following(g.user.id, user_id),
+                          last_modified=latest_at)
+    if cached:
+        return cached
+
+    return render_template('users/show.html', user=profile.user,
+                           messages=profile.messages,
+                           next_cursor=profile.next_cursor)
+
+
+def users_show_page(user_id):
+    """A later page of a user's profile, straight from the database."""
+
+    version = user_version(user_id)
+    if version is None:
+        abort(404)
+
+    latest_id, latest_at = messages_version(user_id)
+    cached = not_modified(version, latest_id,
+                          g.user and is_following(g.user.id, user_id),
+                          last_modified=latest_at)
+    if cached:
+        return cached
+
+    user = User.get_active_or_404(user_id)
+    page = user_messages_page(user_id)
+
+    return render_template('users/show.html', user=user, messages=page.items,
+                           next_cursor=page.next_cursor)
 
 
 @app.route('/users/<int:user_id>/following')
+@reads_from_replica
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -173,12 +297,21 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    likes = [like.message_id for like in Likes.query.filter_by(user_id=user_id).all()]
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user, likes=likes)
+    version = user_version(user_id)
+    if version is None:
+        abort(404)
+
+    cached = not_modified(version, profiles_epoch(),
+                          follows_version(g.user.id))
+    if cached:
+        return cached
+
+    user = User.get_active_or_404(user_id)
+    return render_template('users/following.html', user=user)
 
 
 @app.route('/users/<int:user_id>/followers')
+@reads_from_replica
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -186,9 +319,17 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    likes = [like.message_id for like in Likes.query.filter_by(user_id=user_id).all()]
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user, likes=likes)
+    version = user_version(user_id)
+    if version is None:
+        abort(404)
+
+    cached = not_modified(version, profiles_epoch(),
+                          follows_version(g.user.id))
+    if cached:
+        return cached
+
+    user = User.get_active_or_404(user_id)
+    return render_template('users/followers.html', user=user)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -199,9 +340,9 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed = Follows.follow(g.user.id, [follow_id])
     db.session.commit()
+    follows_changed(followed=followed)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -214,13 +355,128 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    unfollowed = Follows.unfollow(g.user.id, [follow_id])
     db.session.commit()
+    follows_changed(unfollowed=unfollowed)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
+@app.route('/api/users/<int:follow_id>/follow', methods=["PUT", "DELETE"])
+def api_follow(follow_id):
+    """Follow (PUT) or unfollow (DELETE) a user; both are idempotent.
+
+    Returns the new follow state and both users' counts.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    if follow_id == g.user.id:
+        return jsonify(error="You can't follow yourself."), 400
+
+    if request.method == 'PUT':
+        changed = {'followed': Follows.follow(g.user.id, [follow_id])}
+    else:
+        changed = {'unfollowed': Follows.unfollow(g.user.id, [follow_id])}
+
+    counts = follow_counts([g.user.id, follow_id])
+    if follow_id not in counts:
+        db.session.rollback()
+        return jsonify(error="No such user."), 404
+
+    db.session.commit()
+    follows_changed(**changed)
+
+    return jsonify(user_id=follow_id,
+                   following=request.method == 'PUT',
+                   followers_count=counts[follow_id]['followers_count'],
+                   following_count=counts[g.user.id]['following_count'])
+
+
+@app.route('/api/follows', methods=["POST"])
+def api_bulk_follow():
+    """Follow and/or unfollow many users at once, in one transaction.
+
+    Takes JSON like {"follow": [1, 2], "unfollow": [3]}, at most
+    MAX_BULK_FOLLOWS ids in all. Unknown ids, and ones already in the
+    asked-for state, are skipped. Returns the ids that changed and the
+    user's new following count.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error="Expected a JSON object."), 400
+
+    to_follow = data.get('follow', [])
+    to_unfollow = data.get('unfollow', [])
+
+    for ids in (to_follow, to_unfollow):
+        if not (isinstance(ids, list) and
+                all(isinstance(id, int) and not isinstance(id, bool) for id in ids)):
+            return jsonify(error="'follow' and 'unfollow' must be lists of user ids."), 400
+
+    if len(to_follow) + len(to_unfollow) > MAX_BULK_FOLLOWS:
+        return jsonify(error=f"At most {MAX_BULK_FOLLOWS} users at a time."), 400
+
+    if set(to_follow) & set(to_unfollow):
+        return jsonify(error="Can't follow and unfollow the same user."), 400
+
+    followed = Follows.follow(g.user.id, to_follow)
+    unfollowed = Follows.unfollow(g.user.id, to_unfollow)
+    counts = follow_counts([g.user.id])
+    db.session.commit()
+    follows_changed(followed=followed, unfollowed=unfollowed)
+
+    return jsonify(followed=sorted(followed),
+                   unfollowed=sorted(unfollowed),
+                   following_count=counts[g.user.id]['following_count'])
+
+
+def follows_changed(followed=(), unfollowed=()):
+    """Update caches after g.user's follows change (and are committed)."""
+
+    Follows.forget_followees(g.user.id)
+    forget_profile(g.user.id, *followed, *unfollowed)
+    who_to_follow.note_follows(g.user.id, followed=followed, unfollowed=unfollowed)
+
+
+@app.route('/api/users/suggestions')
+@reads_from_replica
+def api_suggestions():
+    """JSON list of users the logged-in user might follow, best first."""
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    limit = min(request.args.get('limit', MAX_SUGGESTIONS, type=int), MAX_SUGGESTIONS)
+    suggested = who_to_follow.suggest(g.user.id, limit)
+
+    cached = not_modified(tuple(suggested))
+    if cached:
+        return cached
+
+    return jsonify(users=[{"id": user.id,
+                           "username": user.username,
+                           "image_url": user.image_url,
+                           "followers_count": user.followers_count}
+                          for user in suggested_users(suggested)])
+
+
+def follow_counts(user_ids):
+    """{user id: {following_count, followers_count}} for existing users."""
+
+    rows = (db.session
+            .query(User.id, User.following_count, User.followers_count)
+            .filter(User.id.in_(user_ids), User.deleted_at.is_(None)))
+
+    return {id: {'following_count': following, 'followers_count': followers}
+            for id, following, followers in rows}
+
+
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Handle profile editing."""
@@ -234,14 +490,14 @@ def profile():
     
 # gathers user object
     user_id = g.user.id
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
 
 # validates the edit form
     if form.validate_on_submit():
         try:
             
 # ensures the user entered correct password to edit that specific profile 
-            if User.authenticate(user.username, form.password.data):
+            if user.check_password(form.password.data):
 
 # uses @classmethod 'edit_profile' to update profile
 # or uses previous user data
@@ -261,6 +517,8 @@ def profile():
                         or user.location,
                     )
 
+                forget_profile(user_id)
+
                 flash("Profile updated!", "success")
                 return redirect(f'{user_id}')
             else:
@@ -279,17 +537,37 @@ def add_remove_like(msg_id):
     """Adds or remove a message like."""
 
     user_id = g.user.id
-    likes = [like.message_id for like in Likes.query.filter_by(user_id=user_id).all()]
 
-    if msg_id not in likes:
+    if msg_id not in Likes.liked_ids(user_id, [msg_id]):
         Likes.add_like(msg_id, user_id)
-
-        return redirect('/')
-    
     else:
         Likes.remove_like(msg_id, user_id)
 
-        return redirect('/')
+    forget_profile(user_id)
+    return redirect(request.referrer or '/')
+
+
+@app.route('/api/messages/<int:msg_id>/like', methods=["PUT", "DELETE"])
+def api_like(msg_id):
+    """Like (PUT) or unlike (DELETE) a message.
+
+    Both are idempotent, so retries are safe. Returns the new like state
+    and the message's like count.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    if request.method == 'PUT':
+        count = Likes.add_like(msg_id, g.user.id)
+    else:
+        count = Likes.remove_like(msg_id, g.user.id)
+
+    if count is None:
+        return jsonify(error="No such message."), 404
+
+    forget_profile(g.user.id)
+    return jsonify(message_id=msg_id, liked=request.method == 'PUT', likes=count)
 
 
 @app.route('/users/delete', methods=["POST"])
@@ -302,8 +580,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # Hidden at once; `flask purge-deleted-users` removes the rows later.
+    User.mark_deleted(g.user.id)
     db.session.commit()
+    forget_identity(g.user.id)
+    forget_profile(g.user.id)
 
     return redirect("/signup")
 
@@ -325,9 +606,14 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.fan_out(msg)
+        User.adjust_counts(g.user.id, messages_count=1)
+        live_timeline.publish(msg)
         db.session.commit()
+        forget_profile(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -335,27 +621,32 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET", "POST"])
+@reads_from_replica
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', messages=msg)
+    msg = Message.query.get_or_404(message_id)
+    if msg.user.deleted_at is not None:
+        abort(404)
+
+    return render_template('messages/show.html', message=msg)
 
 
 @app.route('/messages/<int:user_id>/liked')
+@reads_from_replica
 def liked_messages_show(user_id):
     """Show a users liked messages."""
 
-    user_id = g.user.id
-    liked_msgs = []
-    liked_msg_id = [like.message_id for like in Likes.query.filter_by(user_id=user_id).all()]
-
-    for msg_id in liked_msg_id:
-        new_msg = Message.query.get(msg_id)
-        liked_msgs.append(new_msg)
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
+    User.get_active_or_404(user_id)
+    page = liked_messages_page(user_id)
+    likes = Likes.liked_ids(g.user.id, [msg.id for msg in page.items])
 
-    return render_template('messages/liked.html', messages=liked_msgs)
+    return render_template('messages/liked.html', messages=page.items,
+                           next_cursor=page.next_cursor, likes=likes)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -366,9 +657,16 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
+    msg = Message.query.get_or_404(message_id)
+    User.adjust_counts(msg.user_id, messages_count=-1)
+    User.adjust_counts(
+        db.session.query(Likes.user_id).filter_by(message_id=msg.id),
+        likes_count=-1)
+    forget_card(msg)
     db.session.delete(msg)
     db.session.commit()
+    # Likers' likes counts are left to expire.
+    forget_profile(msg.user_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -378,34 +676,272 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@reads_from_replica
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time
     """
 
     if g.user:
-        user = User.query.get_or_404(g.user.id)
-        messages = []
-
-        for followee in user.following:
-            if followee.messages:
-                message = (Message
-                            .query
-                            .filter_by(user_id=followee.id)
-                            .order_by(Message.timestamp.desc())
-                            .limit(100)
-                            .first())
-                messages.append(message)
-
-        likes = [like.message_id for like in Likes.query.filter_by(user_id=g.user.id).all()]
-
-        return render_template('home.html', messages=messages, likes=likes)
+        cursor, limit = page_args()
+        entries = timeline_version(g.user.id, cursor, limit)
+        cached = not_modified(user_version(g.user.id),
+                              entries,
+                              likes_version(g.user.id),
+                              profiles_epoch(),
+                              last_modified=entries[0][1] if entries else None)
+        if cached:
+            return cached
+
+        page = home_timeline_page(g.user.id)
+        likes = Likes.liked_ids(g.user.id, [msg.id for msg in page.items])
+        suggested = who_to_follow.suggest(g.user.id)
+
+        # Only the first page gets new messages live.
+        live = live_timeline.enabled() and cursor is None
+        stream_since = max((msg.id for msg in page.items), default=0) if live else None
+
+        return render_template('home.html', messages=page.items,
+                               next_cursor=page.next_cursor, likes=likes,
+                               suggestions=suggested_users(suggested),
+                               stream_since=stream_since)
     else:
+        cached = not_modified()
+        if cached:
+            return cached
+
         return render_template('home-anon.html')
 
 
+@app.route('/trending')
+@reads_from_replica
+def trending_page():
+    """Show the most liked messages of the last hour (see trending.py)."""
+
+    top = trending.top()
+    cached = not_modified(tuple(top), g.user and likes_version(g.user.id))
+    if cached:
+        return cached
+
+    ids = [message_id for message_id, _ in top]
+    found = {msg.id: msg for msg in (Message
+                                     .query
+                                     .join(Message.user)
+                                     .filter(Message.id.in_(ids), User.deleted_at.is_(None))
+                                     .options(db.contains_eager(Message.user)))}
+
+    messages = [(found[message_id], recent_likes) for message_id, recent_likes in top
+                if message_id in found]
+    likes = Likes.liked_ids(g.user.id, list(found)) if g.user else set()
+
+    return render_template('messages/trending.html', messages=messages, likes=likes)
+
+
+##############################################################################
+# Paginated feeds (shared by the HTML pages and the JSON API)
+
+
+def home_timeline_page(user_id):
+    """One page of a user's home timeline, per the request's cursor."""
+
+    cursor, limit = page_args()
+    return paginate(TimelineEntry.feed(user_id),
+                    TimelineEntry.timestamp, TimelineEntry.message_id,
+                    cursor, limit)
+
+
+def user_messages_page(user_id):
+    """One page of the messages a user has posted."""
+
+    cursor, limit = page_args()
+    return paginate(Message.query.filter(Message.user_id == user_id),
+                    Message.timestamp, Message.id,
+                    cursor, limit)
+
+
+def liked_messages_page(user_id):
+    """One page of the messages a user has liked, most recently liked first.
+
+    Messages and their authors come back in the same query as the likes.
+    """
+
+    cursor, limit = page_args()
+    query = (Likes
+             .query
+             .join(Likes.message)
+             .join(Message.user)
+             .filter(Likes.user_id == user_id, User.deleted_at.is_(None))
+             .options(db.contains_eager(Likes.message).contains_eager(Message.user)))
+    page = paginate(query, Likes.timestamp, Likes.id, cursor, limit,
+                    key=lambda like: (like.timestamp, like.id))
+
+    return Page([like.message for like in page.items], page.next_cursor)
+
+
+def page_json(page):
+    """Serialize a Page of messages for the API."""
+
+    return jsonify(messages=[msg.serialize() for msg in page.items],
+                   next_cursor=page.next_cursor)
+
+
+@app.route('/api/timeline')
+@reads_from_replica
+def api_home_timeline():
+    """JSON page of the logged-in user's home timeline."""
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    return page_json(home_timeline_page(g.user.id))
+
+
+@app.route('/api/timeline/stream')
+def timeline_stream():
+    """Server-sent events: new messages on the logged-in user's timeline.
+
+    Starts with any messages newer than the Last-Event-ID header (sent
+    when the browser reconnects) or the 'since' param.
+    """
+
+    if not live_timeline.enabled():
+        abort(404)
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    since = request.headers.get('Last-Event-ID', request.args.get('since'))
+    since = int(since) if since and since.isdigit() else None
+
+    # Subscribe first, so nothing is missed between the two.
+    queue = live_timeline.subscribe(g.user.id)
+    replay = live_timeline.missed(g.user.id, since) if since is not None else []
+
+    response = Response(live_timeline.stream(g.user.id, queue, replay),
+                        mimetype='text/event-stream')
+    # Don't let nginx hold events back in its buffer.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/users/<int:user_id>/messages')
+@reads_from_replica
+def api_user_messages(user_id):
+    """JSON page of a user's messages."""
+
+    User.get_active_or_404(user_id)
+    return page_json(user_messages_page(user_id))
+
+
+@app.route('/api/users/<int:user_id>/liked')
+@reads_from_replica
+def api_liked_messages(user_id):
+    """JSON page of the messages a user has liked."""
+
+    User.get_active_or_404(user_id)
+    return page_json(liked_messages_page(user_id))
+
+
+@app.cli.command('load-csvs')
+@click.option('--directory', default='generator',
+              help="Directory holding users.csv, messages.csv, ...")
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE,
+              help="Rows per COPY/INSERT transaction.")
+@click.option('--rebuild-indexes', is_flag=True,
+              help="Drop secondary indexes during the load, rebuild after.")
+@click.option('--resume', is_flag=True,
+              help="Continue an interrupted load from its checkpoint.")
+def load_csvs_command(directory, chunk_size, rebuild_indexes, resume):
+    """Stream the CSV data files into the database."""
+
+    load_csvs(directory, chunk_size=chunk_size,
+              rebuild_indexes=rebuild_indexes, resume=resume)
+
+
+@app.cli.command('purge-deleted-users')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE,
+              help="Rows removed per transaction.")
+@click.option('--pause', default=0.0,
+              help="Seconds to sleep between batches.")
+@click.option('--watch', default=0.0,
+              help="Keep running, checking this often (seconds).")
+def purge_deleted_users_command(batch_size, pause, watch):
+    """Remove deleted accounts' data, a small batch at a time."""
+
+    while True:
+        purge_deleted_users(batch_size=batch_size, pause=pause)
+
+        if not watch:
+            break
+        sleep(watch)
+
+
+@app.cli.command('check-connection-budget')
+@click.option('--workers', type=int,
+              default=lambda: app.config['WEB_WORKERS'],
+              help="gunicorn workers (default: $WEB_CONCURRENCY or 1).")
+@click.option('--reserved', type=int, default=10,
+              help="Connections to leave for admin, cron jobs and the like.")
+def check_connection_budget(workers, reserved):
+    """Will this many workers' pools fit in max_connections?"""
+
+    per_worker = app.config['DB_POOL_SIZE'] + app.config['DB_MAX_OVERFLOW']
+    needed = workers * per_worker
+
+    if app.config['DB_PGBOUNCER']:
+        print(f"Connecting through PgBouncer: up to {needed} client connections; "
+              "size PgBouncer's default_pool_size against max_connections.")
+        return
+
+    max_connections = int(db.session.execute("SHOW max_connections").scalar())
+    available = max_connections - reserved
+
+    print(f"{workers} worker(s) x {per_worker} connections = {needed}; "
+          f"max_connections {max_connections}, {reserved} reserved.")
+
+    if needed > available:
+        raise click.ClickException(
+            f"Too many connections: use at most {available // per_worker} worker(s), "
+            f"or a smaller DB_POOL_SIZE/DB_MAX_OVERFLOW.")
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every materialized home timeline from the follows table."""
+
+    TimelineEntry.rebuild()
+    db.session.commit()
+
+
+@app.cli.command('create-search-indexes')
+def create_search_indexes_command():
+    """Add the username search indexes to an existing database."""
+
+    with db.engine.begin() as connection:
+        create_search_indexes(connection)
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Build fingerprinted, compressed copies of the static files."""
+
+    build_assets(app.static_folder)
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recount user stats and message like counts from the DB."""
+
+    repaired = User.reconcile_counts()
+    repaired_messages = Message.reconcile_counts()
+    db.session.commit()
+
+    print(f"Repaired counters for {repaired} user(s) "
+          f"and {repaired_messages} message(s).")
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -415,7 +951,16 @@ def homepage():
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers on every request.
+
+    Pages that set up an ETag (see conditional.py) may instead be cached,
+    as long as the browser revalidates them; built assets (see assets.py)
+    never change, so may be cached for good; and plain static files are
+    cached for SEND_FILE_MAX_AGE_DEFAULT, then revalidated.
+    """
+
+    if add_validators(req) or request.endpoint in ('static', ASSET_ENDPOINT):
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
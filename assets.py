@@ -0,0 +1,225 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies everything under static/ into static/build/
+with a hash of its contents in the name (style.css becomes something
+like style.3b9f0c1d2e4a.css), writes gzip -- and, if the optional
+brotli package is installed, brotli -- versions of text files beside
+them, and records the names in static/build/manifest.json.
+
+Templates link to assets with `asset_url('stylesheets/style.css')`, and
+stored URLs such as a user's header_image_url go through the `asset`
+filter. A changed file gets a new name, so built files are served with
+a one-year immutable Cache-Control and repeat visits never re-fetch
+them. Old builds are left in place for pages (or cached fragments)
+that still link to them.
+
+Without a manifest -- in development, before building -- URLs fall back
+to the plain /static files.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+
+from flask import abort, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+
+ASSET_ENDPOINT = 'hashed_static'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Images are already compressed; squeezing them again gains nothing.
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.ico', '.txt', '.map'}
+
+# Content-Encoding: file suffix, best first
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+CSS_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+
+
+def build_assets(static_dir, out=sys.stdout):
+    """Build hashed, compressed copies of `static_dir`; return the manifest."""
+
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+
+    # Stylesheets go last, so their url()s can point at hashed images.
+    sources = sorted(source_files(static_dir),
+                     key=lambda name: (name.endswith('.css'), name))
+    manifest = {}
+
+    if brotli is None:
+        print("brotli isn't installed: writing gzip versions only", file=out)
+
+    for name in sources:
+        with open(os.path.join(static_dir, name), 'rb') as source:
+            data = source.read()
+
+        if name.endswith('.css'):
+            data = rewrite_css(data, manifest)
+
+        hashed = hashed_name(name, data)
+        path = os.path.join(build_dir, hashed)
+        write_file(path, data)
+
+        if os.path.splitext(name)[1] in COMPRESSIBLE:
+            for encoding, suffix in ENCODINGS.items():
+                compressed = compress(data, encoding)
+                if compressed is not None and len(compressed) < len(data):
+                    write_file(path + suffix, compressed)
+
+        manifest[name] = hashed
+        print(f"{name} -> {hashed}", file=out)
+
+    write_file(os.path.join(build_dir, MANIFEST),
+               json.dumps(manifest, indent=2, sort_keys=True).encode('UTF-8'))
+
+    return manifest
+
+
+def source_files(static_dir):
+    """Paths (relative, with /) of every file in `static_dir` but the build."""
+
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+
+        for filename in files:
+            path = os.path.relpath(os.path.join(root, filename), static_dir)
+            yield path.replace(os.sep, '/')
+
+
+def hashed_name(name, data):
+    """`name` with a hash of `data` before its extension."""
+
+    stem, ext = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return f"{stem}.{digest}{ext}"
+
+
+def rewrite_css(data, manifest):
+    """Point a stylesheet's url(/static/...) references at built files."""
+
+    def hashed_url(match):
+        quote, name = match.groups()
+        if name not in manifest:
+            return match.group(0)
+        return f"url({quote}/static/{BUILD_DIR}/{manifest[name]}{quote})"
+
+    return CSS_URL.sub(hashed_url, data.decode('UTF-8')).encode('UTF-8')
+
+
+def compress(data, encoding):
+    """`data` compressed as `encoding`, or None if we can't."""
+
+    if encoding == 'gzip':
+        # mtime=0 so the same input always builds the same file
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11)
+
+    return None
+
+
+def write_file(path, data):
+    """Write `path` atomically, so a running app never serves half a file."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.tmp{os.getpid()}"
+
+    with open(partial, 'wb') as out:
+        out.write(data)
+
+    os.replace(partial, path)
+
+
+class Assets:
+    """Flask extension serving built assets and linking to them."""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.encodings = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.build_dir = os.path.join(app.static_folder, BUILD_DIR)
+        self.url_path = app.static_url_path
+        self.load()
+
+        app.add_url_rule(f"{self.url_path}/{BUILD_DIR}/<path:filename>",
+                         ASSET_ENDPOINT, self.send)
+        app.add_template_global(self.url, 'asset_url')
+        app.add_template_filter(self.rewrite, 'asset')
+
+    def load(self):
+        """(Re)read the manifest and see which compressed versions exist."""
+
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST)) as manifest:
+                self.manifest = json.load(manifest)
+        except FileNotFoundError:
+            self.manifest = {}
+
+        self.encodings = {
+            hashed: [encoding for encoding, suffix in ENCODINGS.items()
+                     if os.path.isfile(os.path.join(self.build_dir, hashed + suffix))]
+            for hashed in self.manifest.values()
+        }
+
+    def url(self, name):
+        """URL of the static file `name` (e.g. 'images/warbler-logo.png')."""
+
+        hashed = self.manifest.get(name)
+        if hashed is None:
+            return f"{self.url_path}/{name}"
+
+        return f"{self.url_path}/{BUILD_DIR}/{hashed}"
+
+    def rewrite(self, url):
+        """Swap a stored /static/... URL for its built version."""
+
+        prefix = f"{self.url_path}/"
+        if url and url.startswith(prefix):
+            return self.url(url[len(prefix):])
+
+        return url
+
+    def send(self, filename):
+        """Serve a built file, precompressed if the browser accepts it."""
+
+        if filename not in self.encodings:
+            abort(404)
+
+        encoding = next((encoding for encoding in self.encodings[filename]
+                         if request.accept_encodings[encoding]), None)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        response = send_from_directory(
+            self.build_dir, filename + ENCODINGS.get(encoding, ''),
+            mimetype=mimetype)
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            # it's still the stylesheet (say), not a .gz download
+            response.headers.pop('Content-Disposition', None)
+        if self.encodings[filename]:
+            response.vary.add('Accept-Encoding')
+
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+
+assets = Assets()
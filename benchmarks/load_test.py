@@ -0,0 +1,397 @@
+"""HTTP load test for Warbler.
+
+Seeds a database with a generated dataset, starts the app under gunicorn
+and drives a weighted mix of home, profile, like, follow, post and search
+requests from concurrent logged-in clients. Reports throughput and
+p50/p95/p99 latency per route, and saves the numbers as JSON so runs can
+be compared. Run it from the project root like:
+
+    python -m benchmarks.load_test --users 2000 --duration 30 \\
+        --concurrency 16 --out before.json
+    python -m benchmarks.load_test --compare before.json after.json
+
+By default it uses a throwaway SQLite file behind a single gunicorn
+worker, since SQLite fails concurrent writes with "database is locked".
+Pass --database-url to run against a local PostgreSQL (it will be dropped
+and re-seeded) with several workers.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from http.cookiejar import Cookie, CookieJar
+from random import Random
+from string import ascii_lowercase
+from time import monotonic, sleep
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler, Request,
+                            build_opener)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# route name: relative weight in the request mix
+WORKLOAD = {
+    'home': 40,
+    'profile': 20,
+    'search': 10,
+    'like': 15,
+    'follow': 10,
+    'post': 5,
+}
+
+# Routes that POST a form. They redirect when they work; anything else
+# (such as a 200 re-rendering the form with errors) counts as a failure.
+WRITES = {'like', 'follow', 'post'}
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def seed(args, workdir):
+    """Generate CSVs for the requested dataset and load them."""
+
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+
+    subprocess.run([
+        sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+        '--users', str(args.users),
+        '--messages', str(args.messages),
+        '--follows', str(args.follows),
+        '--likes', str(args.likes),
+        '--seed', str(args.seed),
+        '--out-dir', data_dir,
+    ], check=True, stdout=subprocess.DEVNULL)
+
+    from app import db
+    from loader import load_csvs
+
+    db.drop_all()
+    db.create_all()
+    load_csvs(data_dir, out=open(os.devnull, 'w'))
+
+
+def session_cookies(user_ids):
+    """Signed Flask session cookies logging in each of `user_ids`.
+
+    Forging the cookie keeps bcrypt out of the measurements; logins are
+    benchmarked separately (benchmarks/password_hashing.py).
+    """
+
+    from app import app, CURR_USER_KEY
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    name = app.config['SESSION_COOKIE_NAME']
+
+    return {user_id: (name, serializer.dumps({CURR_USER_KEY: user_id}))
+            for user_id in user_ids}
+
+
+def cookie_jar(host, name, value):
+    """A cookie jar holding one session cookie for `host`.
+
+    The session goes in the jar rather than a Cookie header so that when
+    the app updates it (say, adding a CSRF token) the new one is sent back.
+    """
+
+    jar = CookieJar()
+    jar.set_cookie(Cookie(
+        version=0, name=name, value=value, port=None, port_specified=False,
+        domain=host, domain_specified=False, domain_initial_dot=False,
+        path='/', path_specified=True, secure=False, expires=None,
+        discard=True, comment=None, comment_url=None, rest={}))
+
+    return jar
+
+
+def start_server(args, env):
+    """Run the app under gunicorn; return the process once it answers."""
+
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '--workers', str(args.workers),
+        '--bind', f"127.0.0.1:{args.port}",
+        '--log-level', 'warning',
+        'app:app',
+    ], cwd=ROOT, env=env)
+
+    opener = build_opener()
+    deadline = monotonic() + 30
+
+    while monotonic() < deadline:
+        try:
+            opener.open(f"http://127.0.0.1:{args.port}/login", timeout=1)
+            return server
+        except OSError:         # refused, or not answering yet
+            sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError("gunicorn didn't start")
+
+
+class NoRedirect(HTTPRedirectHandler):
+    """Time each request on its own rather than following redirects."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    """One logged-in user hammering the app."""
+
+    def __init__(self, base_url, cookie, args, rng):
+        self.base_url = base_url
+        self.args = args
+        self.rng = rng
+        self.opener = build_opener(
+            NoRedirect, HTTPCookieProcessor(cookie_jar('127.0.0.1', *cookie)))
+        self.csrf_token = None
+
+    def request(self, path, data=None):
+        """Make a request; return (status, body)."""
+
+        body = urlencode(data).encode() if data is not None else None
+
+        try:
+            with self.opener.open(Request(self.base_url + path, data=body),
+                                  timeout=30) as resp:
+                return resp.status, resp.read()
+        except HTTPError as err:
+            return err.code, err.read()
+
+    def random_user(self):
+        return self.rng.randint(1, self.args.users)
+
+    def random_message(self):
+        return self.rng.randint(1, max(1, self.args.messages))
+
+    def home(self):
+        return self.request('/')
+
+    def profile(self):
+        return self.request(f"/users/{self.random_user()}")
+
+    def search(self):
+        q = ''.join(self.rng.choice(ascii_lowercase)
+                    for _ in range(self.rng.randint(2, 4)))
+        return self.request('/users?' + urlencode({'q': q}))
+
+    def like(self):
+        return self.request(f"/users/add_like/{self.random_message()}", data={})
+
+    def follow(self):
+        action = self.rng.choice(['follow', 'stop-following'])
+        return self.request(f"/users/{action}/{self.random_user()}", data={})
+
+    def post(self):
+        if self.csrf_token is None:
+            status, body = self.request('/messages/new')
+            match = CSRF_TOKEN.search(body.decode('UTF-8', 'replace'))
+            self.csrf_token = match.group(1) if match else ''
+
+        status, body = self.request('/messages/new', data={
+            'csrf_token': self.csrf_token,
+            'text': f"Load test warble {self.rng.random()}",
+        })
+
+        if status != 302:
+            # Probably a stale token: fetch a fresh one next time.
+            self.csrf_token = None
+
+        return status, body
+
+
+def run_workload(args, cookies):
+    """Drive the mix for args.duration seconds; return raw samples."""
+
+    routes = list(WORKLOAD)
+    weights = [WORKLOAD[route] for route in routes]
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    warmup_ends = monotonic() + args.warmup
+    stop_at = warmup_ends + args.duration
+
+    def worker(number):
+        rng = Random(f"{args.seed}-client-{number}")
+        cookie = cookies[rng.choice(list(cookies))]
+        client = Client(base_url, cookie, args, rng)
+
+        while monotonic() < stop_at:
+            route = rng.choices(routes, weights)[0]
+            started = monotonic()
+            status, _ = getattr(client, route)()
+            elapsed = monotonic() - started
+
+            if started < warmup_ends:
+                continue
+
+            with lock:
+                samples[route].append(elapsed)
+                if status >= 400 or (route in WRITES and status != 302):
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return samples, errors
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already-sorted list."""
+
+    if not ordered:
+        return None
+
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples, errors, duration):
+    """Per-route throughput and latency percentiles (in ms)."""
+
+    report = {}
+
+    for route, times in sorted(samples.items()):
+        ordered = sorted(times)
+        report[route] = {
+            'requests': len(ordered),
+            'errors': errors.get(route, 0),
+            'rps': len(ordered) / duration,
+            'p50_ms': 1000 * percentile(ordered, 50),
+            'p95_ms': 1000 * percentile(ordered, 95),
+            'p99_ms': 1000 * percentile(ordered, 99),
+        }
+
+    total = sum(route['requests'] for route in report.values())
+    report['total'] = {
+        'requests': total,
+        'errors': sum(errors.values()),
+        'rps': total / duration,
+    }
+
+    return report
+
+
+def print_report(report):
+    print(f"{'route':<10}{'reqs':>8}{'errs':>6}{'rps':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+
+    for route, stats in report.items():
+        if route == 'total':
+            continue
+        print(f"{route:<10}{stats['requests']:>8}{stats['errors']:>6}"
+              f"{stats['rps']:>9.1f}{stats['p50_ms']:>9.1f}"
+              f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+
+    total = report['total']
+    print(f"{'total':<10}{total['requests']:>8}{total['errors']:>6}"
+          f"{total['rps']:>9.1f}")
+
+
+def compare(before_path, after_path):
+    """Print the change in throughput and latency between two runs."""
+
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before = json.load(before_file)['report']
+        after = json.load(after_file)['report']
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+    print(f"{'route':<10}{'rps':>16}{'p50':>16}{'p95':>16}{'p99':>16}")
+
+    for route in sorted(set(before) & set(after) - {'total'}):
+        old, new = before[route], after[route]
+        print(f"{route:<10}" + "".join(
+            f"{new[key]:>9.1f}{change(old[key], new[key]):>7}"
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms')))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test Warbler.")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="compare two saved runs instead of running")
+    parser.add_argument('--database-url',
+                        help="database to seed and test (default: temp SQLite)")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=50000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seed', action='store_true',
+                        help="reuse the data already in --database-url")
+    parser.add_argument('--clients', type=int, default=50,
+                        help="distinct logged-in users to act as")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int,
+                        help="gunicorn worker processes "
+                             "(default: 4 on PostgreSQL, 1 on SQLite)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--out', help="save results as JSON here")
+    args = parser.parse_args()
+
+    sqlite = (args.database_url or 'sqlite').startswith('sqlite')
+
+    if args.workers is None:
+        args.workers = 1 if sqlite else 4
+    elif args.workers > 1 and sqlite and not args.compare:
+        parser.error("SQLite can't take writes from several workers at once; "
+                     "pass a PostgreSQL --database-url or use --workers 1")
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = (args.database_url or
+                        f"sqlite:///{os.path.join(workdir, 'warbler.db')}")
+        os.environ['DATABASE_URL'] = database_url
+
+        if not args.no_seed:
+            seed(args, workdir)
+
+        rng = Random(args.seed)
+        cookies = session_cookies(
+            rng.sample(range(1, args.users + 1), min(args.clients, args.users)))
+
+        server = start_server(args, dict(os.environ))
+        try:
+            samples, errors = run_workload(args, cookies)
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = summarize(samples, errors, args.duration)
+    print_report(report)
+
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump({'settings': {key: value for key, value in vars(args).items()
+                                    if key not in ('compare', 'out')},
+                       'report': report}, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
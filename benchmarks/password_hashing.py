@@ -0,0 +1,64 @@
+"""Benchmark password hashing throughput.
+
+Reports bcrypt hashes/sec, overall and per core, for a work factor and
+pool size, so BCRYPT_LOG_ROUNDS and PASSWORD_HASH_WORKERS can be sized
+for the hardware. Run it from the project root like:
+
+    python -m benchmarks.password_hashing --rounds 12 --workers 4
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import wait
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import DEFAULT_LOG_ROUNDS, DEFAULT_WORKERS, PasswordHasher, _hash
+
+
+def run(rounds, workers, count):
+    """Hash `count` passwords; return elapsed seconds."""
+
+    hasher = PasswordHasher(rounds=rounds, workers=workers)
+
+    if workers:
+        # Warm the pool up so process start-up isn't timed.
+        hasher.generate_password_hash("warm-up")
+        pool = hasher._get_pool()
+        start = perf_counter()
+        wait([pool.submit(_hash, f"password-{i}", rounds) for i in range(count)])
+    else:
+        start = perf_counter()
+        for i in range(count):
+            hasher.generate_password_hash(f"password-{i}")
+
+    elapsed = perf_counter() - start
+    hasher.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=DEFAULT_LOG_ROUNDS,
+                        help="bcrypt work factor")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="pool size (0 = hash inline)")
+    parser.add_argument('--count', type=int, default=None,
+                        help="hashes to compute (default: 4 per core used)")
+    args = parser.parse_args()
+
+    cores = max(1, min(args.workers, os.cpu_count() or 1))
+    count = args.count or 4 * cores
+
+    elapsed = run(args.rounds, args.workers, count)
+    rate = count / elapsed
+
+    print(f"rounds={args.rounds} workers={args.workers} hashes={count}")
+    print(f"{rate:.1f} hashes/sec, {rate / cores:.1f} hashes/sec/core, "
+          f"{1000 * elapsed / count * cores:.0f} ms per hash")
+
+
+if __name__ == '__main__':
+    main()
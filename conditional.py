@@ -0,0 +1,180 @@
+"""Conditional GET for Warbler's pages.
+
+A view calls `not_modified(...)` with a few cheap values that change
+whenever its page would (latest message, counters, profile versions,
+what the viewer follows and likes). Each is a lookup by primary key or
+index -- never a scan of someone's follows -- so checking costs far less
+than rendering. We hash them into an ETag; if the
+browser already has that version we answer 304 Not Modified without
+running the page's real queries or rendering its template. Otherwise
+the view renders as usual and `add_validators` stamps the ETag (and a
+Last-Modified, if given) on the response.
+
+Other users' names and pictures shown on a page (timeline cards, follow
+lists) would take a query over everyone shown to check; instead pages
+showing them include `profiles_epoch()`, so they may be up to
+PROFILES_STALE_SECONDS out of date. So may the homepage's who-to-follow
+sidebar, except that following someone (which changes the viewer's
+follows_version) shows fresh suggestions at once.
+
+Only the ETag decides whether we send a 304: Last-Modified is the time
+of the newest message, which doesn't move when, say, the viewer likes
+something, so If-Modified-Since alone isn't enough to go on.
+"""
+
+from hashlib import sha1
+from time import time
+
+from flask import current_app, g, request, session
+from sqlalchemy import func, tuple_
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+DEFAULT_PROFILES_STALE_SECONDS = 60
+
+
+def etag_for(*parts):
+    """A strong ETag for a page built from `parts`."""
+
+    return sha1(repr(parts).encode('UTF-8')).hexdigest()
+
+
+def not_modified(*parts, last_modified=None):
+    """Set this request's validators; 304 response if the client is current.
+
+    The viewer and the full URL (so each page of a feed is separate) are
+    always part of the ETag. Returns None when the page must be rendered.
+    """
+
+    # Pending flash messages show on the next page rendered, so it mustn't
+    # come from the browser's cache.
+    if session.get('_flashes'):
+        return None
+
+    g.etag = etag_for(request.full_path, viewer_version(), *parts)
+    g.last_modified = last_modified
+
+    if request.if_none_match.contains(g.etag):
+        return current_app.response_class(status=304)
+
+    return None
+
+
+def add_validators(response):
+    """Add the ETag/Last-Modified set up by `not_modified`, if any.
+
+    Returns True if it did: the response may then be cached, but must be
+    revalidated every time, and only by this browser (it depends on who
+    is logged in).
+    """
+
+    etag = g.get('etag')
+    if etag is None or response.status_code not in (200, 304):
+        return False
+
+    response.set_etag(etag)
+    if g.last_modified is not None:
+        response.last_modified = g.last_modified
+
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return True
+
+
+##############################################################################
+# Versions: cheap values that change when a page's content does
+
+
+def viewer_version():
+    """Who is looking: their identity, as shown in the navbar."""
+
+    if not g.user:
+        return None
+
+    return (g.user.id, g.user.username, g.user.image_url)
+
+
+def user_version(user_id):
+    """A user's profile and follows versions and counters (None if no such user)."""
+
+    row = (db.session
+           .query(User.profile_version,
+                  User.follows_version,
+                  User.messages_count,
+                  User.following_count,
+                  User.followers_count,
+                  User.likes_count)
+           .filter(User.id == user_id, User.deleted_at.is_(None))
+           .first())
+
+    return tuple(row) if row is not None else None
+
+
+def follows_version(user_id):
+    """Changes whenever a user follows or unfollows anyone."""
+
+    return (db.session
+            .query(User.follows_version)
+            .filter(User.id == user_id)
+            .scalar())
+
+
+def is_following(user_id, other_id):
+    """Does `user_id` follow `other_id`? (For one Follow button.)"""
+
+    return other_id in Follows.followees_among(user_id, [other_id])
+
+
+def profiles_epoch():
+    """Changes every PROFILES_STALE_SECONDS (see above)."""
+
+    seconds = current_app.config.get('PROFILES_STALE_SECONDS',
+                                     DEFAULT_PROFILES_STALE_SECONDS)
+    return int(time() // seconds)
+
+
+def likes_version(user_id):
+    """The newest like; with likes_count, changes on every like/unlike."""
+
+    return (db.session
+            .query(func.max(Likes.id))
+            .filter(Likes.user_id == user_id)
+            .scalar())
+
+
+def messages_version(user_id):
+    """(newest message id, its time) of a user's own messages."""
+
+    return tuple(db.session
+                 .query(func.max(Message.id), func.max(Message.timestamp))
+                 .filter(Message.user_id == user_id)
+                 .one())
+
+
+def timeline_version(user_id, cursor, limit):
+    """(message id, time, likes) of each entry on a page of a home timeline.
+
+    Reads just the page's entries (and one more, which decides whether
+    there's an older page) from the timeline index, with their messages by
+    primary key: a message posted, deleted or liked elsewhere in the
+    timeline doesn't change this page. Entries appear or go away when a
+    followee posts or deletes, or the viewer follows or unfollows someone
+    (user_version's follows_version).
+    """
+
+    entries = (db.session
+               .query(TimelineEntry.message_id,
+                      TimelineEntry.timestamp,
+                      Message.likes_count)
+               .join(Message, Message.id == TimelineEntry.message_id)
+               .filter(TimelineEntry.user_id == user_id))
+
+    if cursor is not None:
+        entries = entries.filter(
+            tuple_(TimelineEntry.timestamp, TimelineEntry.message_id) < tuple_(*cursor))
+
+    return tuple(tuple(entry) for entry in (entries
+                                            .order_by(TimelineEntry.timestamp.desc(),
+                                                      TimelineEntry.message_id.desc())
+                                            .limit(limit + 1)))
+
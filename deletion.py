@@ -0,0 +1,193 @@
+"""Purging deleted accounts.
+
+Deleting an account used to delete the user inline, and the ORM then
+loaded and cascaded every message, like and follow they had -- seconds
+of work, holding row locks, for a prolific account. Now deleting just
+marks the user (User.mark_deleted), which hides them everywhere, and
+this worker removes their rows later, a bounded batch at a time. Each
+batch is its own short transaction and fixes up everyone else's
+counters as it goes. Run it alongside the app:
+
+    flask purge-deleted-users --watch 10
+"""
+
+import sys
+from collections import Counter
+from itertools import groupby
+from time import sleep
+
+from sqlalchemy import tuple_
+
+from models import db, Follows, FOLLOWS_TOUCHED, Likes, Message, TimelineEntry, User
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def purge_deleted_users(batch_size=DEFAULT_BATCH_SIZE, pause=0, out=sys.stdout):
+    """Remove all rows belonging to deleted users; return how many were purged.
+
+    Sleeps `pause` seconds between batches to go easy on the database.
+    """
+
+    deleted = [user_id for (user_id,) in (db.session
+                                          .query(User.id)
+                                          .filter(User.deleted_at.isnot(None))
+                                          .order_by(User.deleted_at))]
+
+    for user_id in deleted:
+        while purge_batch(user_id, batch_size):
+            db.session.commit()
+            sleep(pause)
+
+        User.query.filter(User.id == user_id).delete(synchronize_session=False)
+        db.session.commit()
+        print(f"Purged user {user_id}", file=out, flush=True)
+
+    return len(deleted)
+
+
+def purge_batch(user_id, batch_size):
+    """Remove the next batch of a deleted user's rows; return how many.
+
+    Follows go first, so the user drops out of other people's lists and
+    timelines soonest; the user row itself is left for the caller.
+    """
+
+    for step in (purge_following, purge_followers, purge_likes,
+                 purge_timeline, purge_likes_received, purge_messages):
+        removed = step(user_id, batch_size)
+        if removed:
+            return removed
+
+    return 0
+
+
+def purge_following(user_id, batch_size):
+    """Unfollow a batch of the people `user_id` follows."""
+
+    followee_ids = [followee_id for (followee_id,) in (
+        db.session
+        .query(Follows.user_being_followed_id)
+        .filter(Follows.user_following_id == user_id)
+        .limit(batch_size))]
+
+    if followee_ids:
+        (Follows.query
+         .filter(Follows.user_following_id == user_id,
+                 Follows.user_being_followed_id.in_(followee_ids))
+         .delete(synchronize_session=False))
+        User.adjust_counts(followee_ids, followers_count=-1, follows_version=1,
+                           touch=FOLLOWS_TOUCHED)
+
+    return len(followee_ids)
+
+
+def purge_followers(user_id, batch_size):
+    """Drop a batch of `user_id`'s followers, and their messages from those timelines."""
+
+    follower_ids = [follower_id for (follower_id,) in (
+        db.session
+        .query(Follows.user_following_id)
+        .filter(Follows.user_being_followed_id == user_id)
+        .limit(batch_size))]
+
+    if follower_ids:
+        (Follows.query
+         .filter(Follows.user_being_followed_id == user_id,
+                 Follows.user_following_id.in_(follower_ids))
+         .delete(synchronize_session=False))
+        User.adjust_counts(follower_ids, following_count=-1, follows_version=1,
+                           touch=FOLLOWS_TOUCHED)
+
+        (TimelineEntry.query
+         .filter(TimelineEntry.user_id.in_(follower_ids),
+                 TimelineEntry.author_id == user_id)
+         .delete(synchronize_session=False))
+
+    return len(follower_ids)
+
+
+def purge_likes(user_id, batch_size):
+    """Remove a batch of `user_id`'s likes."""
+
+    likes = (db.session
+             .query(Likes.id, Likes.message_id)
+             .filter(Likes.user_id == user_id)
+             .limit(batch_size)
+             .all())
+
+    if likes:
+        (Likes.query
+         .filter(Likes.id.in_([like_id for like_id, _ in likes]))
+         .delete(synchronize_session=False))
+        Message.adjust_counts([message_id for _, message_id in likes],
+                              likes_count=-1)
+
+    return len(likes)
+
+
+def purge_timeline(user_id, batch_size):
+    """Remove a batch of `user_id`'s own home timeline."""
+
+    entries = (db.session
+               .query(TimelineEntry.user_id, TimelineEntry.message_id)
+               .filter(TimelineEntry.user_id == user_id)
+               .limit(batch_size)
+               .all())
+
+    if entries:
+        (TimelineEntry.query
+         .filter(tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+                 .in_(entries))
+         .delete(synchronize_session=False))
+
+    return len(entries)
+
+
+def purge_likes_received(user_id, batch_size):
+    """Remove a batch of other users' likes of `user_id`'s messages.
+
+    Batched by like, not by message: a popular message may have any
+    number of likes.
+    """
+
+    likes = (db.session
+             .query(Likes.id, Likes.user_id)
+             .join(Message, Message.id == Likes.message_id)
+             .filter(Message.user_id == user_id)
+             .limit(batch_size)
+             .all())
+
+    if likes:
+        (Likes.query
+         .filter(Likes.id.in_([like_id for like_id, _ in likes]))
+         .delete(synchronize_session=False))
+
+        # One UPDATE per distinct number of likes lost, not per liker.
+        lost_by_liker = sorted(Counter(liker_id for _, liker_id in likes).items(),
+                               key=lambda liker: liker[1])
+        for lost, group in groupby(lost_by_liker, key=lambda liker: liker[1]):
+            User.adjust_counts([liker_id for liker_id, _ in group], likes_count=-lost)
+
+    return len(likes)
+
+
+def purge_messages(user_id, batch_size):
+    """Remove a batch of `user_id`'s messages (their likes are already gone)."""
+
+    message_ids = [message_id for (message_id,) in (
+        db.session
+        .query(Message.id)
+        .filter(Message.user_id == user_id)
+        .limit(batch_size))]
+
+    if not message_ids:
+        return 0
+
+    # Timeline entries for these messages go with them (FK cascade); the
+    # followers' ones are already gone.
+    (Message.query
+     .filter(Message.id.in_(message_ids))
+     .delete(synchronize_session=False))
+
+    return len(message_ids)
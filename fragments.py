@@ -0,0 +1,53 @@
+"""Rendered-fragment cache for message cards.
+
+The same message shows up on the timelines of thousands of followers,
+so the HTML for its card (author, picture, date, text) is rendered once
+and reused. Cards are keyed by message id *and* the author's
+profile_version, so an author editing their profile makes every old card
+of theirs unreachable (they age out of the LRU). Deleting a message drops
+its card. Per-viewer bits -- the like button -- stay outside the cached
+fragment and are rendered live.
+
+Templates call `{{ message_card(msg) }}`. Set FRAGMENT_CACHE_SHARED in
+app.config to a shared cache (see cache.TieredCache) to share cards
+between workers.
+"""
+
+from flask import render_template
+from markupsafe import Markup
+
+from cache import LRUCache, TieredCache
+
+FRAGMENT_CACHE_SIZE = 10000
+
+fragments = TieredCache(LRUCache(maxsize=FRAGMENT_CACHE_SIZE))
+
+
+def init_fragment_cache(app):
+    """Register message_card() with Jinja and hook up any shared cache."""
+
+    fragments.shared = app.config.setdefault('FRAGMENT_CACHE_SHARED', None)
+    app.add_template_global(message_card)
+
+
+def card_key(msg):
+    return f"message-card:{msg.id}:{msg.user.profile_version}"
+
+
+def message_card(msg):
+    """HTML for a message's card, from the cache when possible."""
+
+    key = card_key(msg)
+    html = fragments.get(key)
+
+    if html is None:
+        html = render_template('messages/card.html', msg=msg)
+        fragments.set(key, html)
+
+    return Markup(html)
+
+
+def forget_card(msg):
+    """Drop a message's cached card (call when deleting it)."""
+
+    fragments.delete(card_key(msg))
@@ -3,28 +3,56 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Everything is generated offline from a seed (the same arguments give the
+same files) and streamed to disk a chunk at a time by a pool of worker
+processes, so it scales to millions of users and hundreds of millions of
+follows and likes. Who gets followed, who posts and which messages get
+liked all follow power-law (Zipf) popularity, like a real social network.
+
+Run it from the project root, e.g.:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 100000000 --likes 100000000 --workers 8
+
+and load the result with `flask load-csvs`.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import shutil
+from datetime import datetime
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import (Shuffle, get_keyed_datetime, get_random_datetime,
+                     pareto_count, zipf_rank)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id', 'timestamp']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 2000
 
-fake = Faker()
+CHUNK_SIZE = 10000
+
+# Zipf exponents: how concentrated popularity is (higher = more skewed).
+FOLLOW_EXPONENT = 1.1
+AUTHOR_EXPONENT = 0.8
+LIKE_EXPONENT = 1.1
 
-# Generate random profile image URLs to use for users
+# Every generated user's password is "password".
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Random profile image URLs to use for users
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +60,177 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header images ship with the app, so generating needs no network access
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+fake = Faker()
+
+
+def users_rows(settings, rng, start, stop):
+    for id in range(start, stop):
+        username = f"{fake.user_name()}{id}"
+        yield [
+            id,
+            f"{username}@{fake.free_email_domain()}",
+            username,
+            rng.choice(image_urls),
+            PASSWORD,
+            fake.sentence(),
+            rng.choice(header_image_urls),
+            fake.city(),
+        ]
+
+
+def messages_rows(settings, rng, start, stop):
+    authors = Shuffle(settings.users, settings.seed)
+
+    for id in range(start, stop):
+        yield [
+            id,
+            fake.paragraph()[:MAX_WARBLER_LENGTH],
+            message_timestamp(settings, id),
+            authors(zipf_rank(rng, settings.users, AUTHOR_EXPONENT)),
+        ]
+
+
+def follows_rows(settings, rng, start, stop):
+    """Each follower follows a heavy-tailed number of popular users."""
+
+    popular = Shuffle(settings.users, settings.seed)
+    mean = settings.follows / settings.users
+
+    for follower in range(start, stop):
+        wanted = pareto_count(rng, mean, settings.users - 1)
+        for followed in sample_distinct(
+                rng, wanted, lambda: popular(zipf_rank(rng, settings.users, FOLLOW_EXPONENT)),
+                exclude=follower):
+            yield [followed, follower]
+
+
+def likes_rows(settings, rng, start, stop):
+    """Each user likes a heavy-tailed number of popular messages."""
+
+    if not settings.messages:
+        return
+
+    popular = Shuffle(settings.messages, settings.seed + 1)
+    mean = settings.likes / settings.users
+
+    for user_id in range(start, stop):
+        wanted = pareto_count(rng, mean, settings.messages)
+        for message_id in sample_distinct(
+                rng, wanted, lambda: popular(zipf_rank(rng, settings.messages, LIKE_EXPONENT))):
+            posted = message_timestamp(settings, message_id)
+            yield [user_id, message_id,
+                   get_random_datetime(now=settings.as_of, rng=rng, after=posted)]
+
+
+def message_timestamp(settings, message_id):
+    """When message `message_id` was posted (likes must come after it)."""
+
+    return get_keyed_datetime(message_id, settings.seed, now=settings.as_of)
+
+
+def sample_distinct(rng, wanted, draw, exclude=None):
+    """Up to `wanted` distinct values from `draw()`, in sorted order.
+
+    Gives up after a bounded number of draws, since popular values get
+    picked again and again when `wanted` is close to the population.
+    """
+
+    chosen = set()
+    attempts = 4 * wanted + 10
+
+    while len(chosen) < wanted and attempts:
+        attempts -= 1
+        value = draw()
+        if value != exclude:
+            chosen.add(value)
+
+    return sorted(chosen)
+
+
+# kind: (headers, row generator, what the rows are sharded over)
+TABLES = {
+    'users': (USERS_CSV_HEADERS, users_rows, 'users'),
+    'messages': (MESSAGES_CSV_HEADERS, messages_rows, 'messages'),
+    'follows': (FOLLOWS_CSV_HEADERS, follows_rows, 'users'),
+    'likes': (LIKES_CSV_HEADERS, likes_rows, 'users'),
+}
+
+
+def write_chunk(job):
+    """Write one chunk of a table to its own part file; return the path."""
+
+    kind, chunk, start, stop, settings = job
+    row_fn = TABLES[kind][1]
+
+    seed = f"{settings.seed}-{kind}-{chunk}"
+    rng = Random(seed)
+    fake.seed_instance(seed)
+
+    path = os.path.join(settings.out_dir, f"{kind}.csv.part{chunk:06d}")
+    with open(path, 'w', newline='') as part:
+        csv.writer(part).writerows(row_fn(settings, rng, start, stop))
+
+    return path
+
+
+def generate(kind, settings, imap):
+    """Write `<kind>.csv`, generating its chunks in parallel."""
+
+    headers, _, sharded_over = TABLES[kind]
+    total = getattr(settings, sharded_over)
+
+    jobs = [(kind, chunk, start, min(start + settings.chunk_size, total + 1), settings)
+            for chunk, start in enumerate(range(1, total + 1, settings.chunk_size))]
+
+    with open(os.path.join(settings.out_dir, f"{kind}.csv"), 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+        out.flush()
+
+        # Chunks come back in order, so the file is the same every run.
+        for done, path in enumerate(imap(write_chunk, jobs), 1):
+            with open(path, newline='') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+            print(f"{kind}: chunk {done}/{len(jobs)}", flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSV data.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS,
+                        help="approximate number of follows")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="approximate number of likes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', type=datetime.fromisoformat,
+                        default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
+                        help="latest message timestamp (YYYY-MM-DD); default today")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="rows (or users, for follows/likes) per chunk")
+    parser.add_argument('--out-dir', default='generator')
+    return parser.parse_args()
+
+
+def main():
+    settings = parse_args()
+
+    if settings.workers > 1:
+        with Pool(settings.workers) as pool:
+            for kind in TABLES:
+                generate(kind, settings, pool.imap)
+    else:
+        for kind in TABLES:
+            generate(kind, settings, map)
+
+
+if __name__ == '__main__':
+    main()
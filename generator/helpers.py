@@ -1,14 +1,87 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import datetime, timedelta
+from math import gcd
+from random import random
 
+MASK_64 = 2 ** 64 - 1
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+def get_random_datetime(year_gap=2, now=None, rng=None, after=None):
+    """Get a random datetime within the last few years (or since `after`).
 
-    return datetime.fromtimestamp(random_timestamp)
+    Pass `now` and a seeded `rng` (random.Random) for repeatable output.
+    """
+
+    now = now or datetime.now()
+    then = after or now - timedelta(days=365 * year_gap)
+    fraction = (rng.random if rng else random)()
+
+    return then + (now - then) * fraction
+
+
+def get_keyed_datetime(key, seed, year_gap=2, now=None):
+    """Like get_random_datetime, but always the same for the same `key`.
+
+    Lets the likes generator work out when a message was posted from its
+    id alone, without reading messages.csv back.
+    """
+
+    now = now or datetime.now()
+    then = now - timedelta(days=365 * year_gap)
+
+    return then + (now - then) * keyed_fraction(key, seed)
+
+
+def keyed_fraction(key, seed):
+    """Repeatable, well-spread fraction in [0, 1) for an integer key (splitmix64)."""
+
+    x = (key * 0x9E3779B97F4A7C15 + seed) & MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+    x ^= x >> 31
+
+    return x / 2 ** 64
+
+
+def zipf_rank(rng, n, exponent):
+    """Random rank in 1..n, with P(rank) roughly proportional to rank**-exponent.
+
+    Uses the inverse CDF of the continuous power law, so it's O(1) per
+    draw however large n is.
+    """
+
+    u = rng.random()
+
+    if abs(exponent - 1) < 1e-9:
+        x = n ** u
+    else:
+        x = ((n ** (1 - exponent) - 1) * u + 1) ** (1 / (1 - exponent))
+
+    return min(n, max(1, int(x)))
+
+
+def pareto_count(rng, mean, limit, shape=2.0):
+    """Heavy-tailed random count averaging about `mean`, capped at `limit`."""
+
+    scale = mean * (shape - 1) / shape
+    return min(limit, round(scale * rng.paretovariate(shape)))
+
+
+class Shuffle:
+    """Cheap, repeatable bijection from ranks 1..n onto ids 1..n.
+
+    Lets us say "the k-th most popular user" without storing a permutation
+    of millions of ids: rank -> (rank * step + offset) mod n.
+    """
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.offset = seed % n
+        self.step = 2654435761 % n or 1
+
+        while gcd(self.step, n) != 1:
+            self.step += 1
+
+    def __call__(self, rank):
+        return ((rank - 1) * self.step + self.offset) % self.n + 1
@@ -0,0 +1,120 @@
+"""Cached identity of the logged-in user.
+
+`add_user_to_g` runs on every request, so rather than loading the full
+User row each time we keep the handful of fields the templates need in
+a short-lived cache -- including the counters the homepage shows, which
+are dropped whenever adjust_counts changes them. Views that need the
+real ORM user (to change it) call `g.user.load()`; reading any other
+attribute loads it too.
+"""
+
+from sqlalchemy import event
+
+from cache import LRUCache
+from models import counts_changed, db, Follows, User
+
+IDENTITY_TTL = 30
+IDENTITY_CACHE_SIZE = 10000
+
+identities = LRUCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_TTL)
+
+
+class CurrentUser:
+    """Lightweight stand-in for the logged-in User."""
+
+    FIELDS = ('id', 'username', 'image_url', 'header_image_url',
+              'messages_count', 'following_count', 'followers_count')
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+        self._user = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def __getattr__(self, name):
+        # Only called for attributes we don't cache: fall back to the
+        # full User row.
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+    def load(self):
+        """Load (once) and return the full ORM User."""
+
+        if self._user is None:
+            self._user = User.query.get(self.id)
+
+        return self._user
+
+    def is_followed_by(self, other_user):
+        """Is this user followed by `other_user`?"""
+
+        return self.id in Follows.followee_ids(other_user.id)
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return other_user.id in Follows.followee_ids(self.id)
+
+
+def load_identity(user_id):
+    """CurrentUser for `user_id`, or None if there's no such (live) user."""
+
+    fields = identities.get(user_id)
+
+    if fields is None:
+        row = (db.session
+               .query(*[getattr(User, field) for field in CurrentUser.FIELDS])
+               .filter(User.id == user_id, User.deleted_at.is_(None))
+               .first())
+        if row is None:
+            return None
+
+        fields = dict(zip(CurrentUser.FIELDS, row))
+        identities.set(user_id, fields)
+
+    return CurrentUser(fields)
+
+
+def forget_identity(user_id):
+    """Drop a user's cached identity."""
+
+    identities.delete(user_id)
+
+
+def forget_after_commit(*user_ids):
+    """Drop users' cached identities once this transaction commits.
+
+    Not before: until then a concurrent request could read the old row
+    and cache it again for the full TTL.
+    """
+
+    db.session.info.setdefault('changed_identities', set()).update(user_ids)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, user):
+    """Invalidate on any ORM write to a User (User.edit_profile, deletes)."""
+
+    forget_after_commit(user.id)
+
+
+@counts_changed.connect_via(User)
+def user_counts_changed(sender, ids):
+    """Invalidate users whose counters User.adjust_counts changed."""
+
+    forget_after_commit(*ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def forget_changed(session):
+    for user_id in session.info.pop('changed_identities', ()):
+        forget_identity(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def keep_unchanged(session):
+    session.info.pop('changed_identities', None)
@@ -0,0 +1,188 @@
+"""Per-request SQL instrumentation for Warbler.
+
+Hooks SQLAlchemy's engine events to count the queries each request runs
+and how long they take, fingerprinting statements (literals and IN-list
+lengths stripped) so a statement repeated over and over -- the classic
+N+1 -- stands out. Results are
+
+- added to each response as X-DB-Query-Count / X-DB-Time-Ms headers,
+- aggregated per route and served as JSON from /metrics/sql, and
+- logged as a warning when a request goes over its query budget.
+
+Settings (app.config):
+
+- SQL_QUERY_BUDGET: queries a request may run before we warn (20)
+- SQL_REPEAT_BUDGET: times one fingerprint may repeat before we warn (5)
+- SQL_METRICS_HEADERS: add the response headers (False)
+- SQL_METRICS_ENDPOINT: serve /metrics/sql (False)
+
+The headers and endpoint show anyone our SQL and how long it takes, so
+they're off unless turned on (e.g. in development or behind a proxy that
+keeps them private).
+"""
+
+import logging
+import re
+from collections import Counter, defaultdict
+from threading import Lock
+from time import perf_counter
+
+from flask import abort, g, has_app_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+TOP_FINGERPRINTS = 5
+
+_IN_LIST = re.compile(r"\(\s*(?:%\(\w+\)s|\?|:\w+)(?:\s*,\s*(?:%\(\w+\)s|\?|:\w+))*\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|:\w+")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """Normalize a SQL statement so repeats of it compare equal."""
+
+    statement = _STRING.sub('?', statement)
+    statement = _PARAM.sub('?', statement)
+    statement = _IN_LIST.sub('(?)', statement)
+    statement = _NUMBER.sub('?', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+class RouteStats:
+    """Running totals of SQL activity for one route."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.over_budget = 0
+        self.fingerprints = Counter()
+
+    def add(self, queries, db_time, fingerprints, over_budget):
+        self.requests += 1
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.db_time += db_time
+        self.over_budget += over_budget
+        self.fingerprints.update(fingerprints)
+
+    def serialize(self):
+        return {
+            "requests": self.requests,
+            "queries": self.queries,
+            "avg_queries": self.queries / self.requests,
+            "max_queries": self.max_queries,
+            "db_time_ms": 1000 * self.db_time,
+            "avg_db_time_ms": 1000 * self.db_time / self.requests,
+            "over_budget": self.over_budget,
+            "top_statements": [
+                {"statement": statement, "count": count}
+                for statement, count in self.fingerprints.most_common(TOP_FINGERPRINTS)
+            ],
+        }
+
+
+class SQLInstrumentation:
+    """Flask extension collecting per-request and per-route SQL stats."""
+
+    def __init__(self, app=None):
+        self.routes = defaultdict(RouteStats)
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_QUERY_BUDGET', 20)
+        app.config.setdefault('SQL_REPEAT_BUDGET', 5)
+        app.config.setdefault('SQL_METRICS_HEADERS', False)
+        app.config.setdefault('SQL_METRICS_ENDPOINT', False)
+
+        self.app = app
+
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        app.before_request(start_request_stats)
+        app.after_request(self.finish_request_stats)
+
+        app.add_url_rule('/metrics/sql', 'sql_metrics', self.metrics)
+
+    def finish_request_stats(self, response):
+        """Record this request's SQL stats, warn if over budget."""
+
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+
+        config = self.app.config
+        route = request.endpoint or '<unmatched>'
+        queries = sum(stats['fingerprints'].values())
+        repeated = [(statement, count)
+                    for statement, count in stats['fingerprints'].most_common()
+                    if count > config['SQL_REPEAT_BUDGET']]
+        over_budget = queries > config['SQL_QUERY_BUDGET'] or bool(repeated)
+
+        if over_budget:
+            logger.warning(
+                "%s %s ran %d queries in %.1f ms (budget %d)%s",
+                request.method, request.path, queries, 1000 * stats['time'],
+                config['SQL_QUERY_BUDGET'],
+                "".join(f"\n  {count}x {statement}" for statement, count in repeated))
+
+        with self._lock:
+            self.routes[route].add(queries, stats['time'],
+                                   stats['fingerprints'], over_budget)
+
+        if config['SQL_METRICS_HEADERS']:
+            response.headers['X-DB-Query-Count'] = str(queries)
+            response.headers['X-DB-Time-Ms'] = f"{1000 * stats['time']:.2f}"
+
+        return response
+
+    def metrics(self):
+        """JSON of SQL stats per route since the process started."""
+
+        if not self.app.config['SQL_METRICS_ENDPOINT']:
+            abort(404)
+
+        with self._lock:
+            routes = {route: stats.serialize()
+                      for route, stats in sorted(self.routes.items())}
+
+        return jsonify(routes=routes)
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+
+
+def start_request_stats():
+    g.sql_stats = {'time': 0.0, 'fingerprints': Counter()}
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # A connection runs one statement at a time, so one start time will
+    # do; one left by a statement that raised is just overwritten.
+    conn.info['query_started'] = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started')
+
+    if not has_app_context():
+        return
+
+    stats = g.get('sql_stats')
+    if stats is not None:
+        stats['time'] += perf_counter() - started
+        stats['fingerprints'][fingerprint(statement)] += 1
+
+
+sql_instrumentation = SQLInstrumentation()
@@ -0,0 +1,283 @@
+"""Live home timeline updates over server-sent events.
+
+A logged-in user's homepage opens an EventSource on
+/api/timeline/stream, and new messages from the people they follow are
+pushed down it as they're posted, ready-rendered, for
+static/js/timeline.js to put at the top of #messages. One idle HTTP
+connection per open homepage replaces reloading the whole page.
+
+`messages_add` calls `live_timeline.publish(msg)` in the transaction
+that posts a message. On Postgres that's a NOTIFY, which is delivered
+at commit -- and never, if the transaction rolls back -- to every
+worker, each of which LISTENs on one dedicated connection in a
+background thread. Without Postgres, or through PgBouncer (which can't
+pass LISTEN on in transaction pooling mode), messages are handed over
+in-process after commit instead, so only subscribers on the posting
+worker hear about them.
+
+For each new message, a worker with subscribers asks which of them have
+it on their timeline -- the fan-out has already worked that out -- and
+renders its HTML once for all of them. Streams send nothing to the
+database themselves. Every event carries the message id, so a browser
+reconnecting with Last-Event-ID (or a page passing ?since=) is first
+sent what it missed.
+
+Streams hold a thread each while open: run gunicorn with threaded or
+gevent workers (e.g. --worker-class gthread --threads 100). With sync
+workers a few open tabs would take every worker, so it's all off --
+no stream URL on the homepage, the endpoint 404s and nothing is
+published -- unless LIVE_TIMELINE_ENABLED is set. Streams end after
+LIVE_TIMELINE_MAX_SECONDS, and the browser reconnects.
+"""
+
+import logging
+import os
+import select
+import threading
+from queue import Empty, Full, Queue
+from time import monotonic, sleep
+
+from flask import render_template
+from sqlalchemy import event, func
+from sqlalchemy.engine.url import make_url
+
+from models import db, Message, TimelineEntry, User
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'warbler_messages'
+
+# Events a slow client may fall behind by before we start dropping them.
+SUBSCRIBER_BACKLOG = 100
+
+# Most missed messages sent to a reconnecting client.
+MAX_REPLAY = 50
+
+RECONNECT_DELAY = 5
+
+
+def event_stream_message(msg):
+    """A server-sent event for a new timeline message."""
+
+    html = render_template('messages/timeline_item.html', msg=msg, likes=())
+    data = "".join(f"data: {line}\n" for line in html.splitlines())
+
+    return f"id: {msg.id}\nevent: message\n{data}\n"
+
+
+class LiveTimeline:
+    """Flask extension fanning new messages out to open event streams."""
+
+    def __init__(self, app=None):
+        self.subscribers = {}
+        self._incoming = Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+        # Set once this worker is LISTENing for new messages.
+        self.listening = threading.Event()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Only set this with threaded or gevent workers (see above).
+        app.config.setdefault('LIVE_TIMELINE_ENABLED', False)
+        # Seconds between keepalive comments, and before a stream ends.
+        app.config.setdefault('LIVE_TIMELINE_KEEPALIVE', 15)
+        app.config.setdefault('LIVE_TIMELINE_MAX_SECONDS', 300)
+        # LISTEN/NOTIFY across workers (None: if the database can).
+        app.config.setdefault('LIVE_TIMELINE_NOTIFY', None)
+        self.app = app
+
+        if not event.contains(db.session, 'after_commit', self._after_commit):
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def enabled(self):
+        return self.app.config['LIVE_TIMELINE_ENABLED']
+
+    def uses_notify(self):
+        config = self.app.config
+        if config['LIVE_TIMELINE_NOTIFY'] is not None:
+            return config['LIVE_TIMELINE_NOTIFY']
+
+        backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+        return backend == 'postgresql' and not config.get('DB_PGBOUNCER')
+
+    ##########################################################################
+    # Publishing
+
+    def publish(self, msg):
+        """Announce a (flushed) new message once its transaction commits."""
+
+        if not self.enabled():
+            return
+
+        if self.uses_notify():
+            db.session.execute(func.pg_notify(CHANNEL, str(msg.id)).select())
+        elif self.subscribers:
+            db.session.info.setdefault('live_messages', []).append(msg.id)
+
+    def _after_commit(self, session):
+        for message_id in session.info.pop('live_messages', ()):
+            self._incoming.put(message_id)
+
+    def _after_rollback(self, session):
+        session.info.pop('live_messages', None)
+
+    ##########################################################################
+    # Subscribing
+
+    def subscribe(self, user_id):
+        """A queue of events for `user_id`; unsubscribe() it when done."""
+
+        self._start_once()
+
+        queue = Queue(maxsize=SUBSCRIBER_BACKLOG)
+        with self._lock:
+            self.subscribers.setdefault(user_id, set()).add(queue)
+
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            queues = self.subscribers.get(user_id, set())
+            queues.discard(queue)
+            if not queues:
+                self.subscribers.pop(user_id, None)
+
+    def missed(self, user_id, since):
+        """Events for messages on `user_id`'s timeline newer than id `since`."""
+
+        messages = (TimelineEntry
+                    .feed(user_id)
+                    .filter(TimelineEntry.message_id > since)
+                    .order_by(TimelineEntry.message_id.desc())
+                    .limit(MAX_REPLAY)
+                    .all())
+
+        return [event_stream_message(msg) for msg in reversed(messages)]
+
+    def stream(self, user_id, queue, replay=()):
+        """The event stream body for a subscriber."""
+
+        config = self.app.config
+        ends_at = monotonic() + config['LIVE_TIMELINE_MAX_SECONDS']
+
+        try:
+            yield f"retry: {RECONNECT_DELAY * 1000}\n\n"
+            yield from replay
+
+            while monotonic() < ends_at:
+                try:
+                    stream_event = queue.get(timeout=config['LIVE_TIMELINE_KEEPALIVE'])
+                except Empty:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if stream_event is None:
+                    return
+                yield stream_event
+
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    ##########################################################################
+    # Dispatching
+
+    def dispatch(self, message_id):
+        """Send a new message to the subscribers with it on their timeline."""
+
+        with self._lock:
+            subscribed = list(self.subscribers)
+
+        if not subscribed:
+            return
+
+        with self.app.app_context():
+            recipients = [user_id for (user_id,) in (
+                db.session
+                .query(TimelineEntry.user_id)
+                .filter(TimelineEntry.message_id == message_id,
+                        TimelineEntry.user_id.in_(subscribed)))]
+
+            msg = (Message.query
+                   .join(Message.user)
+                   .filter(Message.id == message_id, User.deleted_at.is_(None))
+                   .options(db.contains_eager(Message.user))
+                   .first())
+
+            if not recipients or msg is None:
+                return
+
+            stream_event = event_stream_message(msg)
+
+        with self._lock:
+            queues = [queue
+                      for user_id in recipients
+                      for queue in self.subscribers.get(user_id, ())]
+
+        for queue in queues:
+            try:
+                queue.put_nowait(stream_event)
+            except Full:
+                # Too far behind: end their stream, and they'll catch up
+                # from the replay when the browser reconnects.
+                with queue.mutex:
+                    queue.queue.clear()
+                queue.put_nowait(None)
+
+    def _start_once(self):
+        # Threads don't survive a fork, so start one in each process.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        target = self._listen_forever if self.uses_notify() else self._dispatch_forever
+        threading.Thread(target=target, name='live-timeline', daemon=True).start()
+
+    def _dispatch_forever(self):
+        while True:
+            message_id = self._incoming.get()
+            try:
+                self.dispatch(message_id)
+            except Exception:
+                logger.exception("Couldn't dispatch message %s", message_id)
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Lost the live timeline connection")
+            sleep(RECONNECT_DELAY)
+
+    def _listen(self):
+        with self.app.app_context():
+            # Our own connection, outside the pool: it LISTENs for good.
+            connection = db.engine.raw_connection()
+            connection.detach()
+
+        dbapi_connection = connection.connection
+        try:
+            # End the transaction the pool's pre-ping began.
+            dbapi_connection.rollback()
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}")
+            self.listening.set()
+
+            while True:
+                select.select([dbapi_connection], [], [], 60)
+                dbapi_connection.poll()
+
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self.dispatch(int(notify.payload))
+        finally:
+            self.listening.clear()
+            connection.close()
+
+
+live_timeline = LiveTimeline()
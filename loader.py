@@ -0,0 +1,231 @@
+"""Streaming bulk loader for Warbler's CSV data.
+
+Loads `<directory>/<table>.csv` files (users, messages, follows, likes)
+in fixed-size chunks so memory use doesn't grow with the file size:
+
+- on PostgreSQL each chunk goes in with `COPY ... FROM STDIN`,
+- anywhere else with a batched executemany INSERT.
+
+Each chunk commits together with a row count in the load_checkpoints
+table, so an interrupted load can be resumed exactly where it stopped.
+Timelines and counters are then rebuilt a range of ids at a time, each
+range in its own transaction, so no transaction spans the whole data set.
+Secondary indexes can optionally be dropped during the load and rebuilt
+afterwards, and id sequences are reset to follow the loaded rows.
+"""
+
+import csv
+import os
+import sys
+from datetime import datetime
+from io import StringIO
+from itertools import islice
+from time import monotonic
+
+from sqlalchemy import (BigInteger, Column, DateTime, Integer, MetaData,
+                        Table, Text, func, inspect, text)
+
+from models import db, Message, TimelineEntry, User
+
+TABLE_ORDER = ['users', 'messages', 'follows', 'likes']
+DEFAULT_CHUNK_SIZE = 50000
+
+# Users whose timelines (up to TIMELINE_DEPTH entries each) are rebuilt
+# in one transaction.
+TIMELINE_BATCH = 1000
+
+checkpoints = Table(
+    'load_checkpoints', MetaData(),
+    Column('table_name', Text, primary_key=True),
+    Column('rows_loaded', BigInteger, nullable=False),
+)
+
+
+def load_csvs(directory='generator', chunk_size=DEFAULT_CHUNK_SIZE,
+              rebuild_indexes=False, resume=False, out=sys.stdout):
+    """Load every table's CSV from `directory`, then rebuild derived data.
+
+    With `resume`, rows already recorded in load_checkpoints are skipped;
+    otherwise the load starts from the top of each file.
+    """
+
+    engine = db.engine
+    checkpoints.create(engine, checkfirst=True)
+
+    if not resume:
+        engine.execute(checkpoints.delete())
+
+    for name in TABLE_ORDER:
+        path = os.path.join(directory, f"{name}.csv")
+        if not os.path.exists(path):
+            continue
+
+        table = db.metadata.tables[name]
+
+        if rebuild_indexes:
+            drop_indexes(engine, table)
+
+        load_table(engine, table, path, chunk_size, out)
+
+        if rebuild_indexes:
+            create_indexes(engine, table, out)
+
+        reset_sequence(engine, table)
+
+    rebuild_in_batches("timelines", User, TIMELINE_BATCH,
+                       lambda id_range: TimelineEntry.rebuild(id_range=id_range),
+                       out)
+    rebuild_in_batches("user counters", User, chunk_size,
+                       User.reconcile_counts, out)
+    rebuild_in_batches("message counters", Message, chunk_size,
+                       Message.reconcile_counts, out)
+
+    engine.execute(checkpoints.delete())
+
+
+def rebuild_in_batches(what, model, batch_size, rebuild, out):
+    """Call `rebuild((first, last))` over `model`'s ids, committing each batch."""
+
+    first, last = db.session.query(func.min(model.id), func.max(model.id)).one()
+    if first is None:
+        return
+
+    for start in range(first, last + 1, batch_size):
+        rebuild((start, start + batch_size - 1))
+        db.session.commit()
+        print(f"{what}: rebuilt through id {min(start + batch_size - 1, last):,}",
+              file=out, flush=True)
+
+
+def load_table(engine, table, path, chunk_size, out):
+    """Stream one CSV file into `table`, a chunk per transaction."""
+
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        columns = next(reader)
+
+        unknown = set(columns) - set(table.c.keys())
+        if unknown:
+            raise ValueError(f"{path}: no such columns in {table.name}: {unknown}")
+
+        done = rows_loaded(engine, table.name)
+        # Skip what an earlier, interrupted load already committed.
+        next(islice(reader, done, done), None)
+
+        if engine.dialect.name == 'postgresql':
+            write_chunk = copy_chunk
+        else:
+            write_chunk = insert_chunk
+
+        loaded = 0
+        started = monotonic()
+
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                break
+
+            with engine.begin() as connection:
+                write_chunk(connection, table, columns, chunk)
+                save_checkpoint(connection, table.name, done + loaded + len(chunk))
+
+            loaded += len(chunk)
+            rate = loaded / max(monotonic() - started, 1e-9)
+            print(f"{table.name}: {done + loaded:,} rows ({rate:,.0f} rows/sec)",
+                  file=out, flush=True)
+
+
+def copy_chunk(connection, table, columns, chunk):
+    """Write a chunk of CSV rows with PostgreSQL's COPY."""
+
+    buffer = StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+
+    quote = connection.dialect.identifier_preparer.quote
+    column_list = ', '.join(quote(column) for column in columns)
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {quote(table.name)} ({column_list}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def insert_chunk(connection, table, columns, chunk):
+    """Write a chunk of CSV rows with one executemany INSERT."""
+
+    converters = [converter_for(table.c[column].type) for column in columns]
+
+    connection.execute(table.insert(), [
+        {column: convert(value)
+         for column, convert, value in zip(columns, converters, row)}
+        for row in chunk
+    ])
+
+
+def converter_for(column_type):
+    """Function turning a CSV string into a value for `column_type`.
+
+    Empty strings become NULL, as they do with COPY.
+    """
+
+    if isinstance(column_type, DateTime):
+        parse = datetime.fromisoformat
+    elif isinstance(column_type, Integer):
+        parse = int
+    else:
+        parse = str
+
+    return lambda value: parse(value) if value != '' else None
+
+
+def rows_loaded(engine, table_name):
+    """How many rows of `table_name` an earlier load committed."""
+
+    loaded = engine.execute(
+        checkpoints.select().where(checkpoints.c.table_name == table_name)
+    ).first()
+
+    return loaded.rows_loaded if loaded else 0
+
+
+def save_checkpoint(connection, table_name, count):
+    """Record `count` rows loaded, in the caller's transaction."""
+
+    connection.execute(
+        checkpoints.delete().where(checkpoints.c.table_name == table_name))
+    connection.execute(
+        checkpoints.insert().values(table_name=table_name, rows_loaded=count))
+
+
+def drop_indexes(engine, table):
+    """Drop `table`'s secondary indexes (if present) before a load."""
+
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+
+    for index in table.indexes:
+        if index.name in existing:
+            index.drop(engine)
+
+
+def create_indexes(engine, table, out):
+    """Rebuild `table`'s secondary indexes after a load."""
+
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+
+    for index in table.indexes:
+        if index.name not in existing:
+            print(f"{table.name}: building {index.name}", file=out, flush=True)
+            index.create(engine)
+
+
+def reset_sequence(engine, table):
+    """Point `table`'s id sequence past the largest loaded id (PostgreSQL)."""
+
+    if engine.dialect.name != 'postgresql' or 'id' not in table.c:
+        return
+
+    engine.execute(text(
+        f"SELECT setval(pg_get_serial_sequence(:table_name, 'id'), "
+        f"COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"
+    ), table_name=table.name)
@@ -2,11 +2,72 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
+from blinker import signal
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exists, func, literal, orm, tuple_
+from sqlalchemy.dialects import postgresql
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import request_cache
+from passwords import hasher
+from pooling import configure_pool, init_pooling
+from replicas import RoutingSession, init_replicas
+
+
+class WarblerSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with read replicas and tuned connection pools."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        result = super().apply_driver_hacks(app, sa_url, options)
+        configure_pool(app.config, sa_url, options)
+        return result
+
+
+db = WarblerSQLAlchemy()
+
+# How many messages we keep materialized in each user's home timeline.
+TIMELINE_DEPTH = 800
+
+# Sent with message_id and change (1 or -1) when a like is added or
+# removed and committed.
+like_changed = signal('like-changed')
+
+# Timestamps adjust_counts sets when users' follows change.
+FOLLOWS_TOUCHED = ('follows_changed_at',)
+
+# Sent by CounterMixin.adjust_counts (the model class is the sender)
+# with the list of ids whose counters changed.
+counts_changed = signal('counts-changed')
+
+
+class CounterMixin:
+    """A model with denormalized counter columns (e.g. likes_count)."""
+
+    @classmethod
+    def adjust_counts(cls, ids, touch=(), **deltas):
+        """Atomically add `deltas` to the counters of some rows.
+
+        `ids` is an id, a list of ids or a query selecting ids; `touch`
+        names timestamp columns to set to now, too. Call this inside the
+        transaction that adds or removes the rows being counted, e.g.
+        User.adjust_counts(user.id, messages_count=1).
+        """
+
+        if isinstance(ids, int):
+            ids = [ids]
+
+        changes = {getattr(cls, name): getattr(cls, name) + delta
+                   for name, delta in deltas.items()}
+        changes.update({getattr(cls, name): func.now() for name in touch})
+
+        (cls.query
+         .filter(cls.id.in_(ids))
+         .update(changes, synchronize_session=False))
+
+        if isinstance(ids, list):
+            counts_changed.send(cls, ids=ids)
 
 
 class Follows(db.Model):
@@ -26,6 +87,138 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # The primary key leads with the followed user; this finds who a
+        # user follows without a scan.
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def followee_ids(cls, user_id):
+        """Set of ids that `user_id` follows.
+
+        Loaded with one query and cached for the rest of the request, so
+        membership checks against it are O(1).
+        """
+
+        def load():
+            followees = (db.session
+                         .query(cls.user_being_followed_id)
+                         .filter(cls.user_following_id == user_id))
+            return {followee_id for (followee_id,) in followees}
+
+        return request_cache.cached(('followee_ids', user_id), load)
+
+    @classmethod
+    def followees_among(cls, user_id, candidate_ids):
+        """Subset of `candidate_ids` that `user_id` follows.
+
+        Answered from the request's follow set if it is already loaded,
+        otherwise with a single IN query over just the candidates.
+        """
+
+        candidate_ids = set(candidate_ids)
+        if not candidate_ids:
+            return set()
+
+        if request_cache.is_cached(('followee_ids', user_id)):
+            return candidate_ids & cls.followee_ids(user_id)
+
+        followees = (db.session
+                     .query(cls.user_being_followed_id)
+                     .filter(cls.user_following_id == user_id,
+                             cls.user_being_followed_id.in_(candidate_ids)))
+        return {followee_id for (followee_id,) in followees}
+
+    @classmethod
+    def forget_followees(cls, user_id):
+        """Drop a cached follow set after `user_id` follows/unfollows."""
+
+        request_cache.forget(('followee_ids', user_id))
+
+    @classmethod
+    def follow(cls, user_id, followee_ids):
+        """Make `user_id` follow each of `followee_ids`; return those newly followed.
+
+        Rows are written directly, without loading anyone's follow list,
+        and ones that already exist are left alone, so repeated or
+        concurrent requests are harmless. Unknown ids (and the user
+        themself) are skipped. Counters and the home timeline are
+        updated too; call inside a transaction and commit after.
+        """
+
+        followee_ids = set(followee_ids) - {user_id}
+        if not followee_ids:
+            return set()
+
+        columns = ['user_being_followed_id', 'user_following_id']
+        rows = (db.session
+                .query(User.id, literal(user_id))
+                .filter(User.id.in_(followee_ids), User.deleted_at.is_(None)))
+
+        if db.engine.dialect.name == 'postgresql':
+            insert = (postgresql.insert(cls.__table__)
+                      .from_select(columns, rows.statement)
+                      .on_conflict_do_nothing()
+                      .returning(cls.user_being_followed_id))
+            added = {followee_id for (followee_id,) in db.session.execute(insert)}
+        else:
+            existing = cls._followees_in(user_id, followee_ids)
+            rows = rows.filter(~User.id.in_(existing)) if existing else rows
+            db.session.execute(cls.__table__.insert().from_select(columns, rows.statement))
+            added = cls._followees_in(user_id, followee_ids) - existing
+
+        if added:
+            User.adjust_counts(user_id, following_count=len(added),
+                               follows_version=1, touch=FOLLOWS_TOUCHED)
+            User.adjust_counts(list(added), followers_count=1,
+                               follows_version=1, touch=FOLLOWS_TOUCHED)
+            TimelineEntry.add_followees(user_id, added)
+
+        return added
+
+    @classmethod
+    def unfollow(cls, user_id, followee_ids):
+        """Make `user_id` stop following `followee_ids`; return those unfollowed.
+
+        Like follow(): direct, idempotent, and doesn't commit.
+        """
+
+        followee_ids = set(followee_ids)
+        if not followee_ids:
+            return set()
+
+        delete = (cls.__table__.delete()
+                  .where(db.and_(cls.user_following_id == user_id,
+                                 cls.user_being_followed_id.in_(followee_ids))))
+
+        if db.engine.dialect.name == 'postgresql':
+            removed = {followee_id for (followee_id,) in
+                       db.session.execute(delete.returning(cls.user_being_followed_id))}
+        else:
+            removed = cls._followees_in(user_id, followee_ids)
+            db.session.execute(delete)
+
+        if removed:
+            User.adjust_counts(user_id, following_count=-len(removed),
+                               follows_version=1, touch=FOLLOWS_TOUCHED)
+            User.adjust_counts(list(removed), followers_count=-1,
+                               follows_version=1, touch=FOLLOWS_TOUCHED)
+            TimelineEntry.remove_followees(user_id, removed)
+
+        return removed
+
+    @classmethod
+    def _followees_in(cls, user_id, followee_ids):
+        """Which of `followee_ids` `user_id` follows, straight from the DB."""
+
+        return {followee_id for (followee_id,) in (
+            db.session
+            .query(cls.user_being_followed_id)
+            .filter(cls.user_following_id == user_id,
+                    cls.user_being_followed_id.in_(followee_ids)))}
+
 
 class Likes(db.Model):
     """Mapping user "likes" to warbles."""
@@ -45,29 +238,105 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        # unique=True
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.now,
+        server_default=func.now(),
+    )
+
+    message = db.relationship('Message')
+
+    __table_args__ = (
+        db.Index('ix_likes_user_id_message_id', 'user_id', 'message_id', unique=True),
+        db.Index('ix_likes_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+        # for deleting a message's likes (and the FK cascade)
+        db.Index('ix_likes_message_id', 'message_id'),
     )
 
+    @classmethod
+    def liked_ids(cls, user_id, message_ids):
+        """Subset of `message_ids` that `user_id` has liked, as a set.
+
+        Only the given ids are looked up (one indexed IN query), and
+        answers are cached for the rest of the request, so a page of
+        messages never loads the user's whole like history.
+        """
+
+        known = request_cache.cached(('liked_ids', user_id), dict)
+        missing = set(message_ids) - known.keys()
+
+        if missing:
+            liked = {message_id for (message_id,) in (
+                db.session
+                .query(cls.message_id)
+                .filter(cls.user_id == user_id, cls.message_id.in_(missing)))}
+            known.update((message_id, message_id in liked) for message_id in missing)
+
+        return {message_id for message_id in message_ids if known[message_id]}
+
     @classmethod
     def add_like(cls, msg_id, user_id):
+        """Like a message, if not already liked; return its like count.
 
-        like = Likes(
-            user_id=user_id,
-            message_id=msg_id
-        )
-        db.session.add(like)
-        db.session.commit()
+        Idempotent: one INSERT decides, with no read first, so repeated
+        or concurrent requests can't double-count. Returns None if
+        there's no such message.
+        """
+
+        liked = (db.session
+                 .query(literal(user_id), Message.id, literal(datetime.now(), db.DateTime))
+                 .filter(Message.id == msg_id))
+
+        if db.engine.dialect.name == 'postgresql':
+            insert = (postgresql.insert(cls.__table__)
+                      .from_select(['user_id', 'message_id', 'timestamp'], liked.statement)
+                      .on_conflict_do_nothing(index_elements=['user_id', 'message_id']))
+        else:
+            liked = liked.filter(~exists().where(db.and_(cls.user_id == user_id,
+                                                         cls.message_id == msg_id)))
+            insert = (cls.__table__.insert()
+                      .from_select(['user_id', 'message_id', 'timestamp'], liked.statement))
+
+        return cls._finish_toggle(msg_id, user_id, db.session.execute(insert).rowcount)
 
     @classmethod
     def remove_like(cls, msg_id, user_id):
+        """Unlike a message, if liked; return its like count (or None)."""
+
+        removed = (db.session
+                   .execute(cls.__table__.delete()
+                            .where(db.and_(cls.user_id == user_id,
+                                           cls.message_id == msg_id)))
+                   .rowcount)
+
+        return cls._finish_toggle(msg_id, user_id, -removed)
+
+    @classmethod
+    def _finish_toggle(cls, msg_id, user_id, change):
+        """Update counters for a like added (1) or removed (-1), and commit."""
+
+        if change:
+            User.adjust_counts(user_id, likes_count=change)
+            Message.adjust_counts(msg_id, likes_count=change)
 
-        like = Likes.query.filter_by(message_id=msg_id, user_id=user_id).first()
+        count = (db.session
+                 .query(Message.likes_count)
+                 .filter(Message.id == msg_id)
+                 .scalar())
 
-        db.session.delete(like)
         db.session.commit()
+        request_cache.forget(('liked_ids', user_id))
 
+        if change:
+            like_changed.send(cls, message_id=msg_id, change=change)
 
-class User(db.Model):
+        return count
+
+
+class User(CounterMixin, db.Model):
     """User in the system."""
 
     __tablename__ = 'users'
@@ -112,20 +381,86 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized stats, kept in step by adjust_counts() in the same
+    # transaction as the rows they count; reconcile_counts() repairs drift.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped on every profile edit; part of the key for anything cached
+    # with the user's name or picture in it.
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever the user follows or unfollows someone, or gains or
+    # loses a follower, so pages listing either can tell they've changed.
+    follows_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # When follows_version was last bumped (or the user was deleted), so
+    # the follow graph (suggestions.py) can reload just what changed.
+    follows_changed_at = db.Column(
+        db.DateTime,
+        nullable=True,
+        index=True,
+    )
+
+    # Set when the user deletes their account. From then on they're
+    # hidden everywhere; a worker purges their rows later (deletion.py).
+    deleted_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=db.and_(Follows.user_following_id == id,
+                              deleted_at.is_(None))
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=db.and_(Follows.user_being_followed_id == id,
+                              deleted_at.is_(None))
     )
 
     likes = db.relationship(
@@ -136,17 +471,43 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @classmethod
+    def active(cls):
+        """Query for users who haven't deleted their accounts."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def get_active_or_404(cls, user_id):
+        """The user with `user_id`; 404 if there's none or they're deleted."""
+
+        return cls.active().filter(cls.id == user_id).first_or_404()
+
+    @classmethod
+    def mark_deleted(cls, user_id):
+        """Hide a user everywhere, at once; deletion.py purges their rows.
+
+        Bumps their profile version too, so cached pages and cards that
+        show them are refreshed, and marks their follows changed, so
+        they're no longer suggested.
+        """
+
+        (cls.query
+         .filter(cls.id == user_id, cls.deleted_at.is_(None))
+         .update({cls.deleted_at: datetime.now(),
+                  cls.profile_version: cls.profile_version + 1,
+                  cls.follows_changed_at: func.now()},
+                 synchronize_session=False))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in Follows.followee_ids(other_user.id)
 
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in Follows.followee_ids(self.id)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -155,7 +516,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.generate_password_hash(password)
 
         user = User(
             username=username,
@@ -171,15 +532,51 @@ class User(db.Model):
     def edit_profile(cls, user, username, email, image_url, header_image_url, bio, location):
         """Edits and updates user profile."""
 
-        user.username=username,
-        user.email=email,
-        user.image_url=image_url,
-        user.header_image_url=header_image_url,
-        user.bio=bio,
-        user.location=location
+        user.username = username
+        user.email = email
+        user.image_url = image_url
+        user.header_image_url = header_image_url
+        user.bio = bio
+        user.location = location
+        user.profile_version = User.profile_version + 1
 
         db.session.commit()
 
+    @classmethod
+    def reconcile_counts(cls, id_range=None):
+        """Recount every user's stats from the source tables.
+
+        Only users with ids in `id_range` (first, last) if it's given.
+        Returns the number of users whose counters had drifted.
+        """
+
+        actual = {
+            cls.messages_count: (db.session
+                                 .query(func.count(Message.id))
+                                 .filter(Message.user_id == cls.id)
+                                 .as_scalar()),
+            cls.following_count: (db.session
+                                  .query(func.count(Follows.user_following_id))
+                                  .filter(Follows.user_following_id == cls.id)
+                                  .as_scalar()),
+            cls.followers_count: (db.session
+                                  .query(func.count(Follows.user_following_id))
+                                  .filter(Follows.user_being_followed_id == cls.id)
+                                  .as_scalar()),
+            cls.likes_count: (db.session
+                              .query(func.count(Likes.id))
+                              .filter(Likes.user_id == cls.id)
+                              .as_scalar()),
+        }
+
+        drifted = db.or_(*[counter != count for counter, count in actual.items()])
+
+        users = cls.query.filter(drifted)
+        if id_range is not None:
+            users = users.filter(cls.id.between(*id_range))
+
+        return users.update(actual, synchronize_session=False)
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -191,17 +588,37 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            return user
 
         return False
 
+    def check_password(self, password):
+        """Does `password` match this user's password hash?
+
+        If the stored hash was made with an outdated work factor, it is
+        replaced with a fresh hash of the (now known good) password.
+        """
 
-class Message(db.Model):
+        if not hasher.check_password_hash(self.password, password):
+            return False
+
+        if hasher.needs_rehash(self.password):
+            # Saved on a connection of its own, so that whatever else
+            # the request has pending isn't committed with it.
+            pw_hash = hasher.generate_password_hash(password)
+            with db.engine.begin() as conn:
+                conn.execute(User.__table__.update()
+                             .where(User.__table__.c.id == self.id)
+                             .values(password=pw_hash))
+            orm.attributes.set_committed_value(self, 'password', pw_hash)
+
+        return True
+
+
+class Message(CounterMixin, db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
@@ -219,7 +636,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.now()
+        default=datetime.now
     )
 
     user_id = db.Column(
@@ -228,8 +645,266 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Kept in step by Likes.add_like/remove_like; see User for the pattern.
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def reconcile_counts(cls, id_range=None):
+        """Recount messages' likes; return how many had drifted.
+
+        Only messages with ids in `id_range` (first, last) if it's given.
+        """
+
+        actual = (db.session
+                  .query(func.count(Likes.id))
+                  .filter(Likes.message_id == cls.id)
+                  .as_scalar())
+
+        messages = cls.query.filter(cls.likes_count != actual)
+        if id_range is not None:
+            messages = messages.filter(cls.id.between(*id_range))
+
+        return messages.update({cls.likes_count: actual}, synchronize_session=False)
+
+    def serialize(self):
+        """Serialize message (and its author) to a dict for JSON."""
+
+        return {
+            "id": self.id,
+            "text": self.text,
+            "timestamp": self.timestamp.isoformat(),
+            "user": {
+                "id": self.user.id,
+                "username": self.user.username,
+                "image_url": self.user.image_url,
+            },
+        }
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a follower's home timeline.
+
+    Rows are written when a message is posted (fan-out-on-write), so
+    reading the home page is one bounded, indexed query no matter how
+    many users someone follows.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # for the FK cascade when a message is deleted
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+    COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+    @classmethod
+    def fan_out(cls, msg):
+        """Push a (flushed) message onto the timeline of every follower."""
+
+        followers = (db.session
+                     .query(Follows.user_following_id,
+                            literal(msg.id),
+                            literal(msg.user_id),
+                            literal(msg.timestamp, db.DateTime))
+                     .filter(Follows.user_being_followed_id == msg.user_id))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, followers.statement))
+
+        cls.trim(db.session
+                 .query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id == msg.user_id))
+
+    @classmethod
+    def add_followee(cls, user_id, followee_id):
+        """Copy the latest messages of a newly followed user into a timeline."""
+
+        cls.add_followees(user_id, [followee_id])
+
+    @classmethod
+    def add_followees(cls, user_id, followee_ids):
+        """Copy the latest messages of newly followed users into a timeline."""
+
+        for followee_id in followee_ids:
+            recent = (db.session
+                      .query(literal(user_id),
+                             Message.id,
+                             Message.user_id,
+                             Message.timestamp)
+                      .filter(Message.user_id == followee_id)
+                      .order_by(Message.timestamp.desc(), Message.id.desc())
+                      .limit(TIMELINE_DEPTH))
+
+            db.session.execute(
+                cls.__table__.insert().from_select(cls.COLUMNS, recent.statement))
+
+        cls.trim([user_id])
+
+    @classmethod
+    def remove_followee(cls, user_id, followee_id):
+        """Drop an unfollowed user's messages from a timeline."""
+
+        cls.remove_followees(user_id, [followee_id])
+
+    @classmethod
+    def remove_followees(cls, user_id, followee_ids):
+        """Drop unfollowed users' messages from a timeline."""
+
+        (cls.query
+         .filter(cls.user_id == user_id, cls.author_id.in_(followee_ids))
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def trim(cls, user_ids):
+        """Delete entries beyond TIMELINE_DEPTH for the given users.
+
+        `user_ids` may be a list or a query selecting user ids.
+        """
+
+        ranked = (db.session
+                  .query(cls.user_id,
+                         cls.message_id,
+                         func.row_number().over(
+                             partition_by=cls.user_id,
+                             order_by=(cls.timestamp.desc(),
+                                       cls.message_id.desc()),
+                         ).label('position'))
+                  .filter(cls.user_id.in_(user_ids))
+                  .subquery())
+
+        stale = (db.session
+                 .query(ranked.c.user_id, ranked.c.message_id)
+                 .filter(ranked.c.position > TIMELINE_DEPTH))
+
+        (cls.query
+         .filter(tuple_(cls.user_id, cls.message_id).in_(stale))
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls, user_id=None, id_range=None):
+        """Rebuild timelines from the follows table.
+
+        Rebuilds one user's timeline, those of the users with ids in
+        `id_range` (first, last), or every timeline if neither is given.
+        """
+
+        stale = cls.query
+        if user_id is not None:
+            stale = stale.filter_by(user_id=user_id)
+        if id_range is not None:
+            stale = stale.filter(cls.user_id.between(*id_range))
+        stale.delete(synchronize_session=False)
+
+        ranked = (db.session
+                  .query(Follows.user_following_id.label('user_id'),
+                         Message.id.label('message_id'),
+                         Message.user_id.label('author_id'),
+                         Message.timestamp.label('timestamp'),
+                         func.row_number().over(
+                             partition_by=Follows.user_following_id,
+                             order_by=(Message.timestamp.desc(),
+                                       Message.id.desc()),
+                         ).label('position'))
+                  .join(Message,
+                        Message.user_id == Follows.user_being_followed_id))
+        if user_id is not None:
+            ranked = ranked.filter(Follows.user_following_id == user_id)
+        if id_range is not None:
+            ranked = ranked.filter(Follows.user_following_id.between(*id_range))
+        ranked = ranked.subquery()
+
+        entries = (db.session
+                   .query(ranked.c.user_id,
+                          ranked.c.message_id,
+                          ranked.c.author_id,
+                          ranked.c.timestamp)
+                   .filter(ranked.c.position <= TIMELINE_DEPTH))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(cls.COLUMNS, entries.statement))
+
+    @classmethod
+    def feed(cls, user_id):
+        """Query for a user's timeline messages (authors joined in).
+
+        Paginate it on (TimelineEntry.timestamp, TimelineEntry.message_id).
+        """
+
+        return (Message
+                .query
+                .join(cls, cls.message_id == Message.id)
+                .join(Message.user)
+                .filter(cls.user_id == user_id, User.deleted_at.is_(None))
+                .options(db.contains_eager(Message.user)))
+
+
+class TrendingCount(db.Model):
+    """Likes (net of unlikes) a message got in one trending time bucket.
+
+    Every worker adds its likes here (see trending.py), so this is the
+    one shared count; rows older than the trending window are deleted.
+    There's no foreign key to messages: a message deleted meanwhile is
+    just skipped when shown, and its rows age out.
+    """
+
+    __tablename__ = 'trending_counts'
+
+    message_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    bucket = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    likes = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_trending_counts_bucket', 'bucket'),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -239,3 +914,5 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    init_replicas(app)
+    init_pooling(app)
@@ -0,0 +1,85 @@
+"""Keyset (cursor) pagination for Warbler message feeds.
+
+Feeds are ordered newest-first on a (timestamp, id) key. A cursor is the
+key of the last item on a page; the next page is everything strictly
+older than it. That turns "page 500" into an index seek instead of an
+ever-growing OFFSET scan.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(timestamp, id):
+    """Turn a (timestamp, id) key into an opaque cursor string."""
+
+    raw = f"{timestamp.isoformat()}|{id}"
+    return urlsafe_b64encode(raw.encode('UTF-8')).decode('UTF-8')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (timestamp, id) key.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        raw = urlsafe_b64decode(cursor.encode('UTF-8')).decode('UTF-8')
+        timestamp, id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (TypeError, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+
+
+def page_args():
+    """Read `cursor` and `limit` from the querystring.
+
+    The page size is clamped to MAX_PAGE_SIZE; a bad cursor is a 400.
+    """
+
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if cursor:
+        try:
+            cursor = decode_cursor(cursor)
+        except ValueError:
+            abort(400)
+
+    return cursor or None, limit
+
+
+def paginate(query, timestamp_col, id_col, cursor=None, limit=DEFAULT_PAGE_SIZE,
+             key=None):
+    """Return one Page of `query`, newest first, after `cursor`.
+
+    `timestamp_col`/`id_col` are the columns the feed is keyed on (they
+    should be covered by an index). `key` maps an item to its
+    (timestamp, id) key; by default items are assumed to be Messages.
+    """
+
+    if cursor is not None:
+        query = query.filter(tuple_(timestamp_col, id_col) < tuple_(*cursor))
+
+    items = (query
+             .order_by(timestamp_col.desc(), id_col.desc())
+             .limit(limit + 1)
+             .all())
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        key = key or (lambda msg: (msg.timestamp, msg.id))
+        next_cursor = encode_cursor(*key(items[-1]))
+
+    return Page(items, next_cursor)
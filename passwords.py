@@ -0,0 +1,120 @@
+"""Password hashing service for Warbler.
+
+bcrypt is deliberately slow, so hashing runs in a small, bounded pool
+of worker processes instead of the request thread: a burst of logins
+queues on the pool rather than pinning every web worker's CPU at once.
+PASSWORD_HASH_WORKERS is the budget for the whole server, shared out
+between the WEB_WORKERS web worker processes, each of which has its own
+pool.
+
+The work factor comes from BCRYPT_LOG_ROUNDS; hashes made with an older
+factor are transparently upgraded the next time their owner logs in
+(see User.check_password).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+import bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('UTF-8'), pw_hash.encode('UTF-8'))
+    except ValueError:
+        # Not a bcrypt hash at all: it can't match anything.
+        return False
+
+
+def hash_rounds(pw_hash):
+    """Work factor a bcrypt hash was made with (None if unparseable)."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def pool_size(total, web_workers):
+    """Each web worker's share of `total` hashing processes (at least 1)."""
+
+    if not total:
+        return 0
+
+    return max(1, total // max(1, web_workers))
+
+
+class PasswordHasher:
+    """Hash and check passwords on a bounded process pool.
+
+    Configure with init_app(app), which reads:
+
+    - BCRYPT_LOG_ROUNDS: bcrypt work factor for new hashes
+    - PASSWORD_HASH_WORKERS: hashing processes across all web workers;
+      0 hashes inline in the caller
+    - WEB_WORKERS: how many web worker processes share that budget
+    """
+
+    def __init__(self, rounds=DEFAULT_LOG_ROUNDS, workers=DEFAULT_WORKERS):
+        self.rounds = rounds
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', self.rounds)
+        total = app.config.setdefault('PASSWORD_HASH_WORKERS', self.workers)
+        web_workers = app.config.setdefault('WEB_WORKERS', 1)
+        self.workers = pool_size(total, web_workers)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        return self._get_pool().submit(fn, *args).result()
+
+    def _get_pool(self):
+        # Pools don't survive a fork (e.g. gunicorn's pre-fork), so each
+        # process lazily builds its own.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+
+            return self._pool
+
+    def generate_password_hash(self, password):
+        """Hash `password` with the configured work factor."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        """Does `password` match `pw_hash`? Malformed hashes never match."""
+
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different work factor than configured?"""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self):
+        """Stop the worker pool (it will be rebuilt on next use)."""
+
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+hasher = PasswordHasher()
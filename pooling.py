@@ -0,0 +1,224 @@
+"""Database connection pools for Warbler.
+
+Every engine (the primary, and any replicas) gets an explicitly sized
+pool, configured from app.config:
+
+- DB_POOL_SIZE: connections each worker keeps open (5)
+- DB_MAX_OVERFLOW: extra connections a worker may open under load (5)
+- DB_POOL_TIMEOUT: seconds to wait for a connection before failing (10)
+- DB_POOL_RECYCLE: seconds before a connection is replaced (1800), so
+  idle connections aren't dropped under us by the server or a firewall
+- DB_POOL_PRE_PING: check a connection is alive before using it (True)
+- DB_PGBOUNCER: connect through PgBouncer in transaction pooling mode
+  (False). PgBouncer does the pooling then, so we keep no connections
+  open and open a fresh one per checkout. Session state (SET, advisory
+  locks, LISTEN) doesn't survive between transactions in that mode.
+  Pool sizes (from here or SQLALCHEMY_POOL_SIZE and friends) are
+  ignored; don't put them in SQLALCHEMY_ENGINE_OPTIONS either.
+
+Each gunicorn worker is a fork of the master, so a connection the
+master opened would be shared by every worker, and their queries would
+interleave on one socket. Pools note which process opened each
+connection, and a worker that finds one of its parent's connections in
+its pool leaves it alone and opens its own.
+
+Checkout waits and pool saturation are served as JSON from
+/metrics/pool, one worker at a time, if POOL_METRICS_ENDPOINT is set
+(False: like /metrics/sql, it's public). A worker can hold up to
+DB_POOL_SIZE + DB_MAX_OVERFLOW connections per engine, so size the
+number of workers to keep
+
+    workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+under Postgres's max_connections (`flask check-connection-budget`).
+"""
+
+import os
+from threading import Lock
+from time import perf_counter
+
+from flask import abort, current_app, jsonify
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 5
+
+# create_engine options only a QueuePool takes.
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+# Checkouts slower than this count as having waited for a connection.
+SLOW_CHECKOUT = 0.01
+
+# Connections inherited from a parent process. We keep them referenced
+# so they are never closed here: closing one would end it for the parent.
+_inherited = []
+
+
+def init_pooling(app):
+    """Set up pool configuration and metrics for `app`."""
+
+    app.config.setdefault('DB_POOL_SIZE', DEFAULT_POOL_SIZE)
+    app.config.setdefault('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10)
+    app.config.setdefault('DB_POOL_RECYCLE', 1800)
+    app.config.setdefault('DB_POOL_PRE_PING', True)
+    app.config.setdefault('DB_PGBOUNCER', False)
+    app.config.setdefault('POOL_METRICS_ENDPOINT', False)
+
+    if not event.contains(Pool, 'connect', note_owner):
+        event.listen(Pool, 'connect', note_owner)
+        event.listen(Pool, 'checkout', check_owner)
+
+    app.add_url_rule('/metrics/pool', 'pool_metrics', pool_metrics)
+
+
+def configure_pool(config, sa_url, options):
+    """Add the pool settings in `config` to an engine's `options`."""
+
+    if sa_url.drivername.startswith('sqlite'):
+        # Flask-SQLAlchemy picks the right pool for SQLite.
+        return
+
+    if config['DB_PGBOUNCER']:
+        # Flask-SQLAlchemy may have set these from SQLALCHEMY_POOL_SIZE
+        # etc., and NullPool refuses them.
+        for option in QUEUE_POOL_OPTIONS:
+            options.pop(option, None)
+
+        options['poolclass'] = TimedNullPool
+        return
+
+    options.update(poolclass=TimedQueuePool,
+                   pool_size=config['DB_POOL_SIZE'],
+                   max_overflow=config['DB_MAX_OVERFLOW'],
+                   pool_timeout=config['DB_POOL_TIMEOUT'],
+                   pool_recycle=config['DB_POOL_RECYCLE'],
+                   pool_pre_ping=config['DB_POOL_PRE_PING'])
+
+
+##############################################################################
+# Fork safety
+
+
+def note_owner(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def check_owner(dbapi_connection, connection_record, connection_proxy):
+    """Don't hand out a connection opened by the process we forked from."""
+
+    if connection_record.info.get('pid', os.getpid()) != os.getpid():
+        _inherited.append(dbapi_connection)
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection belongs to a parent process; opening a new one")
+
+
+##############################################################################
+# Metrics
+
+
+class PoolStats:
+    """Running totals of how long checkouts from one pool took."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.peak_in_use = 0
+        self._lock = Lock()
+
+    def add(self, wait, in_use):
+        with self._lock:
+            self.checkouts += 1
+            self.waited += wait > SLOW_CHECKOUT
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.peak_in_use = max(self.peak_in_use, in_use or 0)
+
+    def add_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def serialize(self):
+        return {
+            "checkouts": self.checkouts,
+            "waited": self.waited,
+            "timeouts": self.timeouts,
+            "wait_ms": 1000 * self.wait_time,
+            "avg_wait_ms": 1000 * self.wait_time / self.checkouts if self.checkouts else 0,
+            "max_wait_ms": 1000 * self.max_wait,
+            "peak_in_use": self.peak_in_use,
+        }
+
+
+class TimedPool:
+    """Pool mixin timing each checkout.
+
+    The time includes waiting for a free connection, opening a new one
+    and the pre-ping.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = perf_counter()
+
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.add_timeout()
+            raise
+
+        self.stats.add(perf_counter() - started, self.in_use())
+        return connection
+
+    def in_use(self):
+        return None
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    def in_use(self):
+        return self.checkedout()
+
+
+class TimedNullPool(TimedPool, NullPool):
+    pass
+
+
+def pool_status(engine, config):
+    """Checkout stats and current usage of `engine`'s pool."""
+
+    pool = engine.pool
+    status = pool.stats.serialize() if isinstance(pool, TimedPool) else {}
+    status["pool"] = type(pool).__name__
+
+    if isinstance(pool, QueuePool):
+        capacity = config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW']
+        status.update(size=pool.size(),
+                      in_use=pool.checkedout(),
+                      overflow=max(0, pool.overflow()),
+                      capacity=capacity,
+                      saturation=pool.checkedout() / capacity if capacity > 0 else None)
+
+    return status
+
+
+def pool_metrics():
+    """JSON of this worker's pool stats, per database."""
+
+    if not current_app.config['POOL_METRICS_ENDPOINT']:
+        abort(404)
+
+    db = current_app.extensions['sqlalchemy'].db
+    binds = [None] + sorted(current_app.config['SQLALCHEMY_BINDS'] or ())
+
+    return jsonify(pid=os.getpid(),
+                   pools={bind or 'primary': pool_status(db.get_engine(current_app, bind),
+                                                         current_app.config)
+                          for bind in binds})
@@ -0,0 +1,90 @@
+"""Cache of profile pages.
+
+Popular profiles are viewed far more often than they change, yet every
+view loaded the user and their latest page of messages. Now the first
+page of a profile -- the user's header fields and counters, and their
+latest messages -- is kept, keyed by user id, as plain values, so a
+cached view runs no queries at all (bar what the viewer's Follow button
+needs).
+
+Writes that change a profile page drop it from the cache, in the worker
+that made them: posting or deleting a message, editing the profile,
+following or unfollowing (either side's counters), liking (the likes
+counter) and deleting the account. Other workers' copies expire after
+PROFILE_CACHE_TTL seconds -- set PROFILE_CACHE_SHARED (see
+cache.TieredCache) for one copy shared by every worker -- and a user
+viewing their own profile always gets it fresh.
+"""
+
+from types import SimpleNamespace
+
+from cache import LRUCache, TieredCache
+from models import Message, User
+from pagination import DEFAULT_PAGE_SIZE, paginate
+
+PROFILE_CACHE_SIZE = 10000
+DEFAULT_TTL = 30
+
+# What users/detail.html and messages/card.html show of a user.
+PROFILE_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio',
+                  'location', 'profile_version', 'messages_count',
+                  'following_count', 'followers_count', 'likes_count')
+
+profiles = TieredCache(LRUCache(maxsize=PROFILE_CACHE_SIZE, ttl=DEFAULT_TTL))
+
+
+def init_profile_cache(app):
+    """Set the local TTL and hook up any shared cache."""
+
+    profiles.local.ttl = app.config.setdefault('PROFILE_CACHE_TTL', DEFAULT_TTL)
+    profiles.shared = app.config.setdefault('PROFILE_CACHE_SHARED', None)
+
+
+def load_profile(user_id, fresh=False):
+    """The first page of a user's profile, or None if there's no such user.
+
+    Returns a namespace with `user` and `messages`, which templates can
+    use like the ORM objects, plus `next_cursor`, `version` (as
+    conditional.user_version gives it) and `latest` (newest message's
+    (id, time)). `fresh` skips the cache, refilling it.
+    """
+
+    profile = None if fresh else profiles.get(user_id)
+
+    if profile is None:
+        profile = build_profile(user_id)
+        if profile is None:
+            return None
+
+        profiles.set(user_id, profile)
+
+    return profile
+
+
+def build_profile(user_id):
+    user = User.active().filter(User.id == user_id).first()
+    if user is None:
+        return None
+
+    page = paginate(Message.query.filter(Message.user_id == user_id),
+                    Message.timestamp, Message.id, None, DEFAULT_PAGE_SIZE)
+
+    header = SimpleNamespace(**{field: getattr(user, field) for field in PROFILE_FIELDS})
+    messages = [SimpleNamespace(id=msg.id, text=msg.text, timestamp=msg.timestamp,
+                                user_id=user_id, user=header)
+                for msg in page.items]
+
+    return SimpleNamespace(
+        user=header,
+        messages=messages,
+        next_cursor=page.next_cursor,
+        version=(user.profile_version, user.messages_count, user.following_count,
+                 user.followers_count, user.likes_count),
+        latest=(messages[0].id, messages[0].timestamp) if messages else (None, None))
+
+
+def forget_profile(*user_ids):
+    """Drop users' cached profiles (call after changing them)."""
+
+    for user_id in user_ids:
+        profiles.delete(user_id)
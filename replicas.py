@@ -0,0 +1,126 @@
+"""Sending reads to database replicas.
+
+Pages that only read -- the homepage, profiles, user lists and the like,
+marked with @reads_from_replica -- run their queries on one of the
+SQLALCHEMY_REPLICA_URIS (a streaming replica of the primary database),
+picked at random for each request. Everything else, and any write even
+in a marked view, goes to the primary, SQLALCHEMY_DATABASE_URI.
+
+Replicas lag the primary a little, so someone who has just posted a
+message would otherwise not see it on the page they're redirected to.
+To give them read-your-writes, a request that writes leaves a token --
+when it wrote -- in the user's session, and that user's reads stay on
+the primary until REPLICA_PIN_SECONDS later, by which time the replicas
+have caught up. Other users keep reading from the replicas.
+
+With no replicas configured, everything goes to the primary as before.
+"""
+
+from random import randrange
+from time import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.sql.dml import UpdateBase
+
+# Session key for the time of the user's last write.
+WROTE_AT_KEY = 'db_wrote_at'
+
+DEFAULT_PIN_SECONDS = 5
+
+
+def reads_from_replica(view):
+    """Mark a view as safe to serve from a replica (GET and HEAD only)."""
+
+    view.reads_from_replica = True
+    return view
+
+
+def init_replicas(app):
+    """Set up replica routing for `app` (call after db.init_app)."""
+
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+    if app.config.get('SQLALCHEMY_BINDS') is None:
+        app.config['SQLALCHEMY_BINDS'] = {}
+
+    app.after_request(leave_token)
+
+
+def replica_bind():
+    """Bind key of the replica this request reads from, or None for the primary.
+
+    Decided once per request, the first time it runs a query.
+    """
+
+    if not has_request_context():
+        return None
+
+    if 'replica_bind' not in g:
+        g.replica_bind = choose_replica()
+
+    return g.replica_bind
+
+
+def choose_replica():
+    uris = current_app.config['SQLALCHEMY_REPLICA_URIS']
+    view = current_app.view_functions.get(request.endpoint)
+
+    if (not uris or
+            request.method not in ('GET', 'HEAD') or
+            not getattr(view, 'reads_from_replica', False) or
+            pinned_to_primary()):
+        return None
+
+    index = randrange(len(uris))
+    key = f"replica-{index}"
+
+    # Flask-SQLAlchemy makes (and caches) an engine per bind.
+    current_app.config['SQLALCHEMY_BINDS'][key] = uris[index]
+    return key
+
+
+def pinned_to_primary():
+    """Has this user written recently enough that replicas may not have it?"""
+
+    wrote_at = session.get(WROTE_AT_KEY)
+
+    return (wrote_at is not None and
+            time() - wrote_at < current_app.config['REPLICA_PIN_SECONDS'])
+
+
+def note_write():
+    """Record that this request wrote to the primary."""
+
+    if has_request_context():
+        g.replica_bind = None
+        g.db_wrote = True
+
+
+def leave_token(response):
+    """After a write, keep this user's reads on the primary for a while."""
+
+    if g.get('db_wrote') and current_app.config['SQLALCHEMY_REPLICA_URIS']:
+        session[WROTE_AT_KEY] = time()
+
+    return response
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends a replica-safe request's reads to its replica."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            note_write()
+
+        else:
+            key = replica_bind()
+            if key is not None:
+                return self.db.get_engine(self.app, bind=key)
+
+        return super().get_bind(mapper, clause)
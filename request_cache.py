@@ -0,0 +1,35 @@
+"""Per-request memoization for Warbler.
+
+Values are kept on `flask.g`, so they live for exactly one request (or
+app context) and are thrown away afterwards. Outside an app context
+nothing is cached and the loader simply runs every time.
+"""
+
+from flask import g, has_app_context
+
+
+def cached(key, loader):
+    """Return the value cached under `key`, calling `loader()` on a miss."""
+
+    if not has_app_context():
+        return loader()
+
+    store = g.setdefault('_request_cache', {})
+
+    if key not in store:
+        store[key] = loader()
+
+    return store[key]
+
+
+def is_cached(key):
+    """Has `key` already been loaded during this request?"""
+
+    return has_app_context() and key in g.get('_request_cache', {})
+
+
+def forget(key):
+    """Drop `key` from the request cache, e.g. after a write changes it."""
+
+    if has_app_context():
+        g.get('_request_cache', {}).pop(key, None)
@@ -0,0 +1,102 @@
+"""User directory search for Warbler.
+
+Matching is case-insensitive on lower(username) and ranked exact match,
+then prefix match, then substring match. On PostgreSQL the lookups are
+backed by two expression indexes:
+
+- a text_pattern_ops b-tree, which serves prefix searches, and
+- a pg_trgm GIN index, which serves substring searches.
+
+Queries shorter than the trigram length only do prefix matching, since
+a substring search that short can't use the trigram index.
+"""
+
+import logging
+
+from sqlalchemy import case, event, func
+from sqlalchemy.exc import DBAPIError
+
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 100
+TYPEAHEAD_RESULTS = 10
+TRIGRAM_LENGTH = 3
+
+PREFIX_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS ix_users_username_lower_prefix
+    ON users (lower(username) text_pattern_ops)
+"""
+
+TRIGRAM_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS ix_users_username_lower_trgm
+    ON users USING gin (lower(username) gin_trgm_ops)
+"""
+
+
+def create_search_indexes(bind):
+    """Create the username search indexes (PostgreSQL only).
+
+    The trigram index needs the pg_trgm extension; if it isn't available
+    we log it and carry on with prefix search backed by the b-tree.
+    """
+
+    if bind.dialect.name != 'postgresql':
+        return
+
+    bind.execute(PREFIX_INDEX_DDL)
+
+    try:
+        with bind.begin_nested():
+            bind.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            bind.execute(TRIGRAM_INDEX_DDL)
+    except DBAPIError:
+        logger.warning("pg_trgm unavailable; substring user search is unindexed")
+
+
+@event.listens_for(User.__table__, 'after_create')
+def users_table_created(target, connection, **kw):
+    """Build the search indexes whenever the users table is created."""
+
+    create_search_indexes(connection)
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so `text` only matches itself."""
+
+    return (text
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def search_users(q, limit=MAX_RESULTS):
+    """Users whose username matches `q`, best matches first.
+
+    Returns at most `limit` users (never more than MAX_RESULTS).
+    """
+
+    q = (q or '').strip().lower()
+    if not q:
+        return []
+
+    limit = max(1, min(limit, MAX_RESULTS))
+    username = func.lower(User.username)
+    prefix = escape_like(q) + '%'
+
+    if len(q) < TRIGRAM_LENGTH:
+        matches = username.like(prefix, escape='\\')
+    else:
+        matches = username.like('%' + escape_like(q) + '%', escape='\\')
+
+    rank = case([(username == q, 0),
+                 (username.like(prefix, escape='\\'), 1)],
+                else_=2)
+
+    return (User
+            .active()
+            .filter(matches)
+            .order_by(rank, func.length(User.username), User.username)
+            .limit(limit)
+            .all())
@@ -0,0 +1,48 @@
+// Like/unlike messages in place through the JSON API, rather than
+// posting the form and reloading the whole timeline. The forms still
+// work without JavaScript.
+
+document.addEventListener('submit', async function (evt) {
+  const form = evt.target;
+  if (!form.dataset.likeUrl) return;
+
+  evt.preventDefault();
+
+  const button = form.querySelector('button');
+  if (button.disabled) return;
+
+  const liked = form.dataset.liked === 'true';
+  button.disabled = true;
+
+  let resp;
+  try {
+    resp = await fetch(form.dataset.likeUrl, {
+      method: liked ? 'DELETE' : 'PUT',
+      credentials: 'same-origin',
+      headers: {'Accept': 'application/json'},
+    });
+  } catch (err) {
+    resp = null;
+  }
+
+  if (!resp || !resp.ok) {
+    // The like wasn't changed: fall back to the plain form post.
+    button.disabled = false;
+    form.submit();
+    return;
+  }
+
+  try {
+    const data = await resp.json();
+    form.dataset.liked = data.liked ? 'true' : 'false';
+    button.classList.toggle('btn-primary', data.liked);
+    button.classList.toggle('btn-secondary', !data.liked);
+    form.querySelector('.like-count').textContent = data.likes;
+  } catch (err) {
+    // The like was changed but we can't tell how it stands now; posting
+    // the form would toggle it back, so just show the page afresh.
+    window.location.reload();
+  } finally {
+    button.disabled = false;
+  }
+});
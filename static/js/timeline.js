@@ -0,0 +1,18 @@
+// Put new messages at the top of the home timeline as they're posted,
+// from the server-sent event stream (see live.py). The browser
+// reconnects by itself, and the server replays anything missed.
+
+(function () {
+  const messages = document.getElementById('messages');
+  if (!messages || !messages.dataset.streamUrl || !window.EventSource) return;
+
+  const stream = new EventSource(messages.dataset.streamUrl);
+
+  stream.addEventListener('message', function (evt) {
+    if (messages.querySelector(`[data-message-id="${evt.lastEventId}"]`)) return;
+
+    const template = document.createElement('template');
+    template.innerHTML = evt.data.trim();
+    messages.prepend(template.content);
+  });
+})();
@@ -0,0 +1,401 @@
+"""Who-to-follow suggestions.
+
+Suggestions are friends of friends: people followed by the people you
+follow, scored by how many of your followees follow them (mutuals) and
+by how popular they are. Working that out with SQL joins on every page
+view is too slow for users who follow thousands of people, so each
+worker keeps the whole follow graph in memory in compressed sparse row
+(CSR) form: one flat array of followee ids, sorted into runs by
+follower, plus where each follower's run starts and ends. That is about
+4 bytes a follow, and a user's followees are a slice of it.
+
+The graph is loaded in the background -- degrees first, then the
+follows streamed in chunks straight into place. After that, every
+WHO_TO_FOLLOW_REFRESH seconds we read back only the users whose follows
+changed (users.follows_changed_at, which is indexed) and their current
+followees, which replace their runs in the array; the whole table is
+read again only once the replacements add up to a good part of the
+graph. Follows made through this worker in the meantime are layered on
+top, so your own suggestions update at once. Answering a request runs
+no SQL at all; looking up the suggested users to show them is one
+primary-key query.
+
+Deleted users are never suggested: they're marked in the graph (from
+their follows_changed_at), and only active users are shown anyway.
+"""
+
+import heapq
+import logging
+import os
+import threading
+from array import array
+from collections import Counter, defaultdict
+from datetime import timedelta
+from math import log1p
+from operator import add
+from random import Random
+from time import sleep, time
+
+from sqlalchemy import func, select
+
+from cache import LRUCache
+from models import db, Follows, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH = 300
+SIDEBAR_SUGGESTIONS = 5
+MAX_SUGGESTIONS = 50
+
+# Bounds on the work per request, however many people someone follows.
+SAMPLED_FOLLOWEES = 100
+EDGES_PER_FOLLOWEE = 100
+
+# How much a log-scale unit of followers is worth against one mutual.
+POPULARITY_WEIGHT = 0.5
+
+# Suggested to people who don't follow anyone yet.
+POPULAR_USERS = 100
+
+FETCH_SIZE = 10000
+SUGGESTION_CACHE_SIZE = 10000
+
+# Follows committed by transactions that started before a refresh may be
+# stamped up to this long before it; re-reading them is harmless.
+CHANGE_SLACK = timedelta(seconds=60)
+
+# Reload the whole graph once replaced runs hold this much of it.
+REBUILD_FRACTION = 0.25
+
+
+class FollowGraph:
+    """CSR snapshot of who follows whom, with some users' runs replaced.
+
+    `built_at` is our clock when it was last brought up to date (by
+    load_graph or apply), and `changed_since` the database's.
+    """
+
+    def __init__(self, starts, ends, targets, popularity, built_at, changed_since):
+        self.starts = starts
+        self.ends = ends
+        self.targets = memoryview(targets)
+        self.popularity = popularity
+        self.built_at = built_at
+        self.changed_since = changed_since
+
+        # Newer followees of users whose follows changed since the load
+        self.replaced = {}
+        self.replaced_size = 0
+
+        # What popularity adds to a candidate's score, precomputed.
+        self.bonus = array('d', (POPULARITY_WEIGHT * log1p(max(0, followers))
+                                 for followers in popularity))
+
+        self.popular = heapq.nlargest(
+            POPULAR_USERS,
+            (user_id for user_id, followers in enumerate(popularity) if followers >= 0),
+            key=popularity.__getitem__)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def followees(self, user_id):
+        """Ids `user_id` follows (a zero-copy slice)."""
+
+        replaced = self.replaced.get(user_id)
+        if replaced is not None:
+            return replaced
+
+        if user_id >= len(self.starts) - 1:
+            return self.targets[0:0]
+
+        return self.targets[self.starts[user_id]:self.ends[user_id]]
+
+    def followers_count(self, user_id):
+        if user_id >= len(self.popularity):
+            return 0
+
+        return max(0, self.popularity[user_id])
+
+    def is_user(self, user_id):
+        """Is `user_id` a user who hasn't deleted their account?"""
+
+        return user_id < len(self.popularity) and self.popularity[user_id] >= 0
+
+    def apply(self, users, followees, built_at, changed_since):
+        """Bring the graph up to date with load_changes()'s results.
+
+        Changes it in place: a request ranking meanwhile may see some of
+        the changes, and caches its results under the old `built_at`.
+        """
+
+        for user_id, followers, deleted_at in users:
+            if user_id >= len(self.popularity):
+                grow = user_id + 1 - len(self.popularity)
+                self.popularity.extend(array('i', [-1]) * grow)
+                self.bonus.extend(array('d', [0.0]) * grow)
+
+            self.popularity[user_id] = -1 if deleted_at is not None else followers
+            self.bonus[user_id] = POPULARITY_WEIGHT * log1p(max(0, followers))
+
+        for user_id, run in followees.items():
+            old = self.replaced.get(user_id)
+            self.replaced_size += len(run) - (len(old) if old is not None else 0)
+            self.replaced[user_id] = memoryview(run)
+
+        # Only the changed users can have moved into (or out of) the top.
+        self.popular = heapq.nlargest(
+            POPULAR_USERS,
+            filter(self.is_user, set(self.popular) | {user_id for user_id, *_ in users}),
+            key=self.popularity.__getitem__)
+
+        self.changed_since = changed_since
+        self.built_at = built_at
+
+    def needs_rebuild(self):
+        return self.replaced_size > REBUILD_FRACTION * len(self.targets)
+
+
+def load_graph(bind, fetch_size=FETCH_SIZE):
+    """Build a FollowGraph from the database.
+
+    Two passes, so we never hold the follows as Python objects: count
+    each user's followees to lay out the array, then stream the follows
+    (in any order) into their slots. Follows added between the passes
+    may be skipped; they'll be in the next load.
+    """
+
+    built_at = time()
+
+    with bind.connect() as connection:
+        changed_since = connection.execute(select([func.now()])).scalar()
+        size = (connection.execute(select([func.max(User.id)])).scalar() or 0) + 1
+
+        # -1 marks ids with no (active) user
+        popularity = array('i', [-1]) * size
+        for user_id, followers in connection.execute(
+                select([User.id, User.followers_count])
+                .where(User.deleted_at.is_(None))):
+            popularity[user_id] = followers
+
+        starts = array('q', bytes(8 * (size + 1)))
+        for follower, followees in connection.execute(
+                select([Follows.user_following_id, func.count()])
+                .group_by(Follows.user_following_id)):
+            if follower < size:
+                starts[follower + 1] = followees
+
+        for user_id in range(size):
+            starts[user_id + 1] += starts[user_id]
+
+        targets = array('i', bytes(4 * starts[size]))
+        ends = array('q', starts[:size])
+
+        follows = (connection
+                   .execution_options(stream_results=True)
+                   .execute(select([Follows.user_following_id,
+                                    Follows.user_being_followed_id])))
+
+        while True:
+            rows = follows.fetchmany(fetch_size)
+            if not rows:
+                break
+
+            for follower, followee in rows:
+                if (follower < size and followee < size and
+                        ends[follower] < starts[follower + 1]):
+                    targets[ends[follower]] = followee
+                    ends[follower] += 1
+
+    return FollowGraph(starts, ends, targets, popularity, built_at, changed_since)
+
+
+def load_changes(bind, since, fetch_size=FETCH_SIZE):
+    """Users whose follows changed since `since`, for FollowGraph.apply.
+
+    Returns ([(id, followers, deleted_at)], {id: array of followee ids},
+    built_at, changed_since); only those users' rows are read.
+    """
+
+    built_at = time()
+
+    with bind.connect() as connection:
+        changed_since = connection.execute(select([func.now()])).scalar()
+
+        users = connection.execute(
+            select([User.id, User.followers_count, User.deleted_at])
+            .where(User.follows_changed_at >= since)).fetchall()
+
+        followees = defaultdict(lambda: array('i'))
+        user_ids = [user_id for user_id, _, deleted_at in users if deleted_at is None]
+
+        for start in range(0, len(user_ids), fetch_size):
+            for follower, followee in connection.execute(
+                    select([Follows.user_following_id, Follows.user_being_followed_id])
+                    .where(Follows.user_following_id.in_(user_ids[start:start + fetch_size]))):
+                followees[follower].append(followee)
+
+    return (users, {user_id: followees[user_id] for user_id in user_ids},
+            built_at, changed_since)
+
+
+def sample_followees(graph, user_id, limit, rng):
+    """Up to `limit` of `user_id`'s followees, spread across all of them.
+
+    Runs are in load order (roughly oldest follow first), so taking the
+    first `limit` would favour whoever was followed earliest; instead
+    take every n-th, from a random start.
+    """
+
+    followees = graph.followees(user_id)
+    if len(followees) <= limit:
+        return followees
+
+    step = len(followees) // limit
+    return followees[rng.randrange(step)::step][:limit]
+
+
+def rank_suggestions(graph, user_id, followees, limit):
+    """Best `limit` ids for `user_id` to follow, given who they follow."""
+
+    followees = set(followees)
+
+    rng = Random(user_id)
+
+    sampled = sorted(followees)
+    if len(sampled) > SAMPLED_FOLLOWEES:
+        sampled = rng.sample(sampled, SAMPLED_FOLLOWEES)
+
+    mutuals = Counter()
+    for followee in sampled:
+        mutuals.update(sample_followees(graph, followee, EDGES_PER_FOLLOWEE, rng))
+
+    # There can be tens of thousands of candidates, so score and sort
+    # them with builtins rather than a Python loop.
+    skip = followees | {user_id}
+    candidates = list(filter(graph.is_user, mutuals.keys() - skip))
+    scores = map(add, map(mutuals.__getitem__, candidates),
+                 map(graph.bonus.__getitem__, candidates))
+    best = [candidate for _, candidate in heapq.nlargest(limit, zip(scores, candidates))]
+
+    # Not enough friends of friends (e.g. a new user): pad with popular users.
+    for candidate in graph.popular:
+        if len(best) >= limit:
+            break
+        if candidate not in skip and candidate not in best:
+            best.append(candidate)
+
+    return best
+
+
+class WhoToFollow:
+    """Flask extension keeping a per-worker follow graph for suggestions."""
+
+    def __init__(self, app=None):
+        self.graph = None
+        self.results = LRUCache(maxsize=SUGGESTION_CACHE_SIZE)
+        self._changes = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Seconds between reloads of the graph; 0 loads it on first use
+        # and then only when refresh() is called.
+        app.config.setdefault('WHO_TO_FOLLOW_REFRESH', DEFAULT_REFRESH)
+        self.app = app
+
+    def refresh(self, full=False):
+        """Bring the graph up to date now: reload what changed, or all if `full`."""
+
+        graph = self.graph
+
+        with self.app.app_context():
+            if full or graph is None or graph.needs_rebuild():
+                graph = load_graph(db.engine)
+            else:
+                graph.apply(*load_changes(db.engine, graph.changed_since - CHANGE_SLACK))
+
+        with self._lock:
+            self.graph = graph
+            # Changes made before the load started are in the new graph.
+            self._changes = {user_id: change
+                             for user_id, change in self._changes.items()
+                             if change[0] >= graph.built_at}
+
+        logger.info("Follow graph: %d follows loaded, %d users' since replaced",
+                    len(graph), len(graph.replaced))
+
+    def current_graph(self):
+        """The graph, or None while it's first loading in the background."""
+
+        # Threads don't survive a fork, so start loading on first use in
+        # each process (gunicorn forks its workers after import).
+        with self._lock:
+            first_use = self._pid != os.getpid()
+            self._pid = os.getpid()
+
+        if first_use:
+            self._start()
+
+        return self.graph
+
+    def _start(self):
+        interval = self.app.config['WHO_TO_FOLLOW_REFRESH']
+
+        if not interval:
+            self.refresh()
+            return
+
+        def refresh_forever():
+            while True:
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Couldn't load the follow graph")
+                sleep(interval)
+
+        threading.Thread(target=refresh_forever, name='who-to-follow',
+                         daemon=True).start()
+
+    def note_follows(self, user_id, followed=(), unfollowed=()):
+        """Record follows made in this worker until the next reload."""
+
+        with self._lock:
+            _, added, removed = self._changes.get(user_id, (None, set(), set()))
+            added = (added - set(unfollowed)) | set(followed)
+            removed = (removed - set(followed)) | set(unfollowed)
+            self._changes[user_id] = (time(), added, removed)
+
+    def suggest(self, user_id, limit=SIDEBAR_SUGGESTIONS):
+        """Ids of up to `limit` users for `user_id` to follow, best first."""
+
+        graph = self.current_graph()
+        if graph is None:
+            return []
+
+        change = self._changes.get(user_id)
+        key = (user_id, graph.built_at, change and change[0])
+
+        ranked = self.results.get(key)
+        if ranked is None:
+            followees = set(graph.followees(user_id))
+            if change:
+                followees = (followees | change[1]) - change[2]
+
+            ranked = rank_suggestions(graph, user_id, followees, MAX_SUGGESTIONS)
+            self.results.set(key, ranked)
+
+        return ranked[:limit]
+
+
+def suggested_users(user_ids):
+    """Users for the given ids, in that order (skipping any now gone)."""
+
+    users = {user.id: user for user in User.active().filter(User.id.in_(user_ids))}
+    return [users[user_id] for user_id in user_ids if user_id in users]
+
+
+who_to_follow = WhoToFollow()
@@ -0,0 +1,118 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask, render_template_string
+
+from assets import Assets, IMMUTABLE, build_assets
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        """Make a small static folder and build it."""
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.static = self.tmpdir.name
+
+        os.makedirs(os.path.join(self.static, 'images'))
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+
+        with open(os.path.join(self.static, 'images', 'logo.png'), 'wb') as out:
+            out.write(b"\x89PNG not really")
+        with open(os.path.join(self.static, 'stylesheets', 'style.css'), 'w') as out:
+            out.write('body { background: url("/static/images/logo.png"); }\n' * 50)
+
+        with open(os.devnull, 'w') as devnull:
+            self.manifest = build_assets(self.static, out=devnull)
+
+        self.app = Flask(__name__, static_folder=self.static,
+                         static_url_path='/static')
+        self.assets = Assets(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def built(self, name, suffix=''):
+        path = os.path.join(self.static, 'build', self.manifest[name] + suffix)
+        with open(path, 'rb') as built:
+            return built.read()
+
+    def test_build(self):
+        """Are files hashed, compressed and listed in the manifest?"""
+
+        css = self.manifest['stylesheets/style.css']
+        logo = self.manifest['images/logo.png']
+
+        self.assertRegex(css, r"^stylesheets/style\.[0-9a-f]{12}\.css$")
+        self.assertRegex(logo, r"^images/logo\.[0-9a-f]{12}\.png$")
+
+        # the stylesheet points at the hashed image
+        self.assertIn(f"/static/build/{logo}".encode(), self.built('stylesheets/style.css'))
+
+        # text is gzipped, images aren't
+        self.assertEqual(gzip.decompress(self.built('stylesheets/style.css', '.gz')),
+                         self.built('stylesheets/style.css'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.static, 'build', logo + '.gz')))
+
+        with open(os.path.join(self.static, 'build', 'manifest.json')) as manifest:
+            self.assertEqual(json.load(manifest), self.manifest)
+
+    def test_rebuild_is_stable(self):
+        """Does building unchanged files give the same names?"""
+
+        with open(os.devnull, 'w') as devnull:
+            self.assertEqual(build_assets(self.static, out=devnull), self.manifest)
+
+    def test_urls(self):
+        """Do templates link to the hashed files?"""
+
+        with self.app.test_request_context():
+            html = render_template_string(
+                "{{ asset_url('images/logo.png') }} "
+                "{{ '/static/images/logo.png'|asset }} "
+                "{{ 'http://example.com/me.jpg'|asset }} "
+                "{{ asset_url('images/unbuilt.png') }}")
+
+        logo = self.manifest['images/logo.png']
+        self.assertEqual(html.split(), [f"/static/build/{logo}",
+                                        f"/static/build/{logo}",
+                                        "http://example.com/me.jpg",
+                                        "/static/images/unbuilt.png"])
+
+    def test_serve_compressed(self):
+        """Are built files served precompressed and cached for good?"""
+
+        url = f"/static/build/{self.manifest['stylesheets/style.css']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Cache-Control'], IMMUTABLE)
+        self.assertIn('text/css', resp.headers['Content-Type'])
+        self.assertEqual(gzip.decompress(resp.get_data()),
+                         self.built('stylesheets/style.css'))
+        resp.close()
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(), self.built('stylesheets/style.css'))
+        resp.close()
+
+    def test_unknown_file(self):
+        """Are files outside the manifest not served?"""
+
+        resp = self.client.get("/static/build/manifest.json")
+        self.assertEqual(resp.status_code, 404)
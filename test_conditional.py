@@ -0,0 +1,221 @@
+"""Conditional GET tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_conditional.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETags and 304 responses."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        self.author = User.signup(username="author",
+                                  email="author@test.com",
+                                  password="author",
+                                  image_url=None)
+        self.reader = User.signup(username="reader",
+                                  email="reader@test.com",
+                                  password="reader",
+                                  image_url=None)
+        db.session.commit()
+
+        self.author_id = self.author.id
+        self.reader_id = self.reader.id
+
+    def get(self, client, url, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return client.get(url, headers=headers)
+
+    def test_unchanged_profile(self):
+        """Is an unchanged profile answered with a 304?"""
+
+        with self.client as c:
+            resp = self.get(c, f"/users/{self.author_id}")
+            etag = resp.headers['ETag']
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+            resp = self.get(c, f"/users/{self.author_id}", etag)
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+            self.assertEqual(resp.headers['ETag'], etag)
+
+    def test_new_message_changes_profile(self):
+        """Does posting a message change the profile's ETag?"""
+
+        with self.client as c:
+            etag = self.get(c, f"/users/{self.author_id}").headers['ETag']
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            c.post("/messages/new", data={"text": "Something new"})
+
+            with c.session_transaction() as sess:
+                sess.pop(CURR_USER_KEY)
+                sess.pop('_flashes', None)
+
+            resp = self.get(c, f"/users/{self.author_id}", etag)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Something new", resp.get_data(as_text=True))
+
+    def test_home_revalidates_likes(self):
+        """Does liking a message on the home page change its ETag?"""
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            c.post("/messages/new", data={"text": "Like me"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+                sess.pop('_flashes', None)
+
+            etag = self.get(c, "/").headers['ETag']
+            self.assertEqual(self.get(c, "/", etag).status_code, 304)
+
+            Likes.add_like(Message.query.one().id, self.reader_id)
+
+            self.assertEqual(self.get(c, "/", etag).status_code, 200)
+
+    def test_home_revalidates_page(self):
+        """Do others' likes and deletions of messages shown change the ETag?"""
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            c.post("/messages/new", data={"text": "Like me"})
+            msg_id = Message.query.one().id
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+                sess.pop('_flashes', None)
+
+            etag = self.get(c, "/").headers['ETag']
+            Likes.add_like(msg_id, self.author_id)
+
+            resp = self.get(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            self.assertEqual(self.get(c, "/", etag).status_code, 304)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            c.post(f"/messages/{msg_id}/delete")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+
+            resp = self.get(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("Like me", resp.get_data(as_text=True))
+
+    def test_flashes_not_cached(self):
+        """Is a page with a pending flash message always rendered?"""
+
+        with self.client as c:
+            etag = self.get(c, f"/users/{self.author_id}").headers['ETag']
+
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', "Hello!")]
+
+            resp = self.get(c, f"/users/{self.author_id}", etag)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Hello!", resp.get_data(as_text=True))
+
+    def test_follow_lists_revalidate(self):
+        """Do follow lists and Follow buttons change when follows do?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+
+            followers = f"/users/{self.author_id}/followers"
+            etag = self.get(c, followers).headers['ETag']
+            self.assertEqual(self.get(c, followers, etag).status_code, 304)
+
+            profile_etag = self.get(c, f"/users/{self.author_id}").headers['ETag']
+
+            c.post(f"/users/follow/{self.author_id}")
+
+            with c.session_transaction() as sess:
+                sess.pop('_flashes', None)
+
+            resp = self.get(c, followers, etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@reader", resp.get_data(as_text=True))
+
+            resp = self.get(c, f"/users/{self.author_id}", profile_etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Unfollow", resp.get_data(as_text=True))
+
+
+class StaticCachingTestCase(TestCase):
+    """Test caching of plain /static files."""
+
+    def test_static_revalidates(self):
+        """Are static files cached briefly, then revalidated with a 304?"""
+
+        client = app.test_client()
+
+        resp = client.get("/static/stylesheets/style.css")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("max-age=300", resp.headers['Cache-Control'])
+        self.assertNotIn('no-store', resp.headers['Cache-Control'])
+        last_modified = resp.headers['Last-Modified']
+        resp.close()
+
+        resp = client.get("/static/stylesheets/style.css",
+                          headers={'If-Modified-Since': last_modified})
+        self.assertEqual(resp.status_code, 304)
+        resp.close()
@@ -0,0 +1,167 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_deletion.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from deletion import purge_deleted_users, purge_likes_received
+from search import search_users
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class DeletionTestCase(TestCase):
+    """Test marking accounts deleted and purging them."""
+
+    def setUp(self):
+        """A leaving user who follows, is followed by, posts and likes."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        leaver, friend, fan = [User(email=f"{name}@test.com",
+                                    username=name,
+                                    password="HASHED_PASSWORD")
+                               for name in ('leaver', 'friend', 'fan')]
+        db.session.add_all([leaver, friend, fan])
+        db.session.commit()
+
+        self.leaver_id, self.friend_id, self.fan_id = leaver.id, friend.id, fan.id
+
+        Follows.follow(self.leaver_id, [self.friend_id])
+        Follows.follow(self.fan_id, [self.leaver_id, self.friend_id])
+        Follows.follow(self.friend_id, [self.leaver_id])
+        db.session.commit()
+
+        for n in range(3):
+            for author_id in (self.leaver_id, self.friend_id):
+                msg = Message(text=f"warble {n}", user_id=author_id)
+                db.session.add(msg)
+                db.session.flush()
+                TimelineEntry.fan_out(msg)
+                User.adjust_counts(author_id, messages_count=1)
+        db.session.commit()
+
+        for msg in Message.query.all():
+            Likes.add_like(msg.id, self.fan_id)
+            if msg.user_id == self.friend_id:
+                Likes.add_like(msg.id, self.leaver_id)
+
+    def delete_leaver(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.leaver_id
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+    def test_hidden_at_once(self):
+        """Is a deleted user hidden before their data is purged?"""
+
+        self.delete_leaver()
+
+        self.assertIsNotNone(User.query.get(self.leaver_id).deleted_at)
+        self.assertEqual(Message.query.filter_by(user_id=self.leaver_id).count(), 3)
+
+        self.assertEqual(self.client.get(f"/users/{self.leaver_id}").status_code, 404)
+        self.assertEqual(search_users("leaver"), [])
+        self.assertFalse(User.authenticate("leaver", "anything"))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("@friend", html)
+            self.assertNotIn("@leaver", html)
+
+            resp = c.get(f"/api/users/{self.fan_id}/liked")
+            self.assertEqual({msg['user']['username'] for msg in resp.json['messages']},
+                             {"friend"})
+
+            html = c.get(f"/users/{self.fan_id}/following").get_data(as_text=True)
+            self.assertNotIn("@leaver", html)
+
+    def test_purge(self):
+        """Does the purge remove everything and keep others' counts right?"""
+
+        self.delete_leaver()
+
+        with open(os.devnull, 'w') as devnull:
+            self.assertEqual(purge_deleted_users(batch_size=1, out=devnull), 1)
+
+        self.assertIsNone(User.query.get(self.leaver_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.leaver_id).count(), 0)
+        self.assertEqual(TimelineEntry.query.filter_by(author_id=self.leaver_id).count(), 0)
+        self.assertEqual(Likes.query.filter_by(user_id=self.leaver_id).count(), 0)
+
+        fan = User.query.get(self.fan_id)
+        friend = User.query.get(self.friend_id)
+        self.assertEqual((fan.following_count, fan.likes_count), (1, 3))
+        self.assertEqual((friend.following_count, friend.followers_count), (0, 1))
+        self.assertEqual({msg.likes_count for msg in Message.query}, {1})
+
+        # Nothing left for a recount to fix
+        self.assertEqual(User.reconcile_counts(), 0)
+        self.assertEqual(Message.reconcile_counts(), 0)
+
+    def test_purge_popular_message(self):
+        """Are a popular message's likes removed a bounded batch at a time?"""
+
+        fans = [User(email=f"fan{n}@test.com", username=f"fan{n}",
+                     password="HASHED_PASSWORD")
+                for n in range(5)]
+        db.session.add_all(fans)
+        db.session.commit()
+        fan_ids = [fan.id for fan in fans]
+
+        popular = Message.query.filter_by(user_id=self.leaver_id).first()
+        for fan_id in fan_ids:
+            Likes.add_like(popular.id, fan_id)
+
+        self.delete_leaver()
+
+        batches = []
+        while True:
+            removed = purge_likes_received(self.leaver_id, batch_size=2)
+            db.session.commit()
+            if not removed:
+                break
+            batches.append(removed)
+
+        with open(os.devnull, 'w') as devnull:
+            purge_deleted_users(batch_size=2, out=devnull)
+
+        # 5 new likes, plus the fan's 3 of the leaver's messages
+        self.assertEqual(sum(batches), 8)
+        self.assertEqual(max(batches), 2)
+
+        self.assertEqual({fan.likes_count
+                          for fan in User.query.filter(User.id.in_(fan_ids))}, {0})
+        self.assertEqual(User.query.get(self.fan_id).likes_count, 3)
+        self.assertEqual(User.reconcile_counts(), 0)
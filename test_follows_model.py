@@ -73,3 +73,46 @@ class FollowsModelTestCase(TestCase):
         # Follows classmethods:
         self.assertEqual(self.testuser1.is_followed_by(self.testuser3), 1)
         self.assertEqual(self.testuser3.is_following(self.testuser1), 1)
+
+
+    def test_follow_sets(self):
+        """Do the follow-set lookups answer membership by id?"""
+
+        db.session.add(Follows(user_being_followed_id=self.testuser3.id,
+                               user_following_id=self.testuser1.id))
+        db.session.commit()
+
+        self.assertEqual(Follows.followee_ids(self.testuser1.id),
+                         {self.testuser3.id})
+        self.assertEqual(Follows.followee_ids(self.testuser3.id), set())
+
+        candidates = [self.testuser1.id, self.testuser3.id]
+        self.assertEqual(Follows.followees_among(self.testuser1.id, candidates),
+                         {self.testuser3.id})
+        self.assertEqual(Follows.followees_among(self.testuser1.id, []), set())
+
+        self.assertTrue(self.testuser1.is_following(self.testuser3))
+        self.assertTrue(self.testuser3.is_followed_by(self.testuser1))
+        self.assertFalse(self.testuser3.is_following(self.testuser1))
+
+
+    def test_follow_unfollow(self):
+        """Are follow/unfollow idempotent and do they keep counts right?"""
+
+        u1, u3 = self.testuser1.id, self.testuser3.id
+
+        self.assertEqual(Follows.follow(u1, [u3, u1, u3 + 1000]), {u3})
+        self.assertEqual(Follows.follow(u1, [u3]), set())
+        db.session.commit()
+
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(User.query.get(u1).following_count, 1)
+        self.assertEqual(User.query.get(u3).followers_count, 1)
+
+        self.assertEqual(Follows.unfollow(u1, [u3]), {u3})
+        self.assertEqual(Follows.unfollow(u1, [u3]), set())
+        db.session.commit()
+
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(User.query.get(u1).following_count, 0)
+        self.assertEqual(User.query.get(u3).followers_count, 0)
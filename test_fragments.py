@@ -0,0 +1,84 @@
+"""Message card fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from fragments import card_key, fragments, message_card
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test cached message cards."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Message.query.delete()
+        User.query.delete()
+        fragments.clear()
+
+        self.client = app.test_client()
+
+        self.user = User(email="card@test.com",
+                         username="carduser",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.msg = Message(text="Cache me", user_id=self.user.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+    def test_card_cached(self):
+        """Is a card rendered once and then served from the cache?"""
+
+        with app.test_request_context():
+            html = message_card(self.msg)
+
+            self.assertIn("Cache me", html)
+            self.assertIn("@carduser", html)
+            self.assertEqual(fragments.get(card_key(self.msg)), html)
+
+            fragments.set(card_key(self.msg), "<p>from cache</p>")
+            self.assertEqual(message_card(self.msg), "<p>from cache</p>")
+
+    def test_profile_edit_changes_key(self):
+        """Does editing the author's profile stop old cards being used?"""
+
+        with app.test_request_context():
+            message_card(self.msg)
+            old_key = card_key(self.msg)
+
+            User.edit_profile(self.user,
+                              username="renamed",
+                              email="card@test.com",
+                              image_url=None,
+                              header_image_url=None,
+                              bio=None,
+                              location=None)
+
+            self.assertNotEqual(card_key(self.msg), old_key)
+            self.assertIn("@renamed", message_card(self.msg))
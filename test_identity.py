@@ -0,0 +1,93 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from identity import identities, load_identity
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class IdentityTestCase(TestCase):
+    """Test the cached current-user identity."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        identities.clear()
+
+        self.client = app.test_client()
+
+        self.user = User(email="who@test.com",
+                         username="whoami",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def test_load_identity(self):
+        """Does the identity carry the cached fields and lazy-load the rest?"""
+
+        identity = load_identity(self.user.id)
+
+        self.assertEqual(identity.id, self.user.id)
+        self.assertEqual(identity.username, "whoami")
+        self.assertEqual(identity.email, "who@test.com")
+        self.assertEqual(identity.load(), self.user)
+        self.assertEqual(len(identities), 1)
+
+        self.assertIsNone(load_identity(-1))
+
+    def test_edit_profile_invalidates(self):
+        """Does editing the profile drop the cached identity?"""
+
+        load_identity(self.user.id)
+
+        User.edit_profile(self.user,
+                          username="renamed",
+                          email="who@test.com",
+                          image_url=None,
+                          header_image_url=None,
+                          bio=None,
+                          location=None)
+
+        self.assertEqual(len(identities), 0)
+        self.assertEqual(load_identity(self.user.id).username, "renamed")
+
+    def test_counters_cached(self):
+        """Are the homepage counters cached, and dropped when they change?"""
+
+        identity = load_identity(self.user.id)
+        self.assertEqual(identity.messages_count, 0)
+        self.assertIsNone(identity._user)
+
+        User.adjust_counts(self.user.id, messages_count=1)
+
+        # Not until it's committed, or it'd be cached again meanwhile.
+        self.assertEqual(len(identities), 1)
+
+        db.session.commit()
+        self.assertEqual(len(identities), 0)
+        self.assertEqual(load_identity(self.user.id).messages_count, 1)
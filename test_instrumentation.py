@@ -0,0 +1,102 @@
+"""SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from instrumentation import fingerprint, sql_instrumentation
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-request SQL stats."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        sql_instrumentation.reset()
+
+        self.client = app.test_client()
+
+        self.testuser = User(email="sql@test.com",
+                             username="sqluser",
+                             password="HASHED_PASSWORD")
+        db.session.add(self.testuser)
+        db.session.commit()
+
+        app.config['SQL_METRICS_HEADERS'] = app.config['SQL_METRICS_ENDPOINT'] = True
+
+    def tearDown(self):
+        app.config['SQL_METRICS_HEADERS'] = app.config['SQL_METRICS_ENDPOINT'] = False
+        db.session.rollback()
+
+    def test_fingerprint(self):
+        """Do statements differing only in values share a fingerprint?"""
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM users WHERE id IN (%(id_1)s, %(id_2)s)"),
+            fingerprint("SELECT *  FROM users\nWHERE id IN (%(id_1)s)"))
+        self.assertEqual(fingerprint("SELECT 'a', 42 FROM anon_1"),
+                         "SELECT ?, ? FROM anon_1")
+
+    def test_request_stats(self):
+        """Are query counts reported in headers and per-route metrics?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/users/{self.testuser.id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertGreater(int(resp.headers['X-DB-Query-Count']), 0)
+            self.assertIn('X-DB-Time-Ms', resp.headers)
+
+            metrics = c.get("/metrics/sql").get_json()["routes"]
+            self.assertEqual(metrics["users_show"]["requests"], 1)
+            self.assertEqual(metrics["users_show"]["queries"],
+                             int(resp.headers['X-DB-Query-Count']))
+
+    def test_private_by_default(self):
+        """Are the headers and metrics hidden unless turned on?"""
+
+        app.config['SQL_METRICS_HEADERS'] = app.config['SQL_METRICS_ENDPOINT'] = False
+
+        resp = self.client.get(f"/users/{self.testuser.id}")
+        self.assertNotIn('X-DB-Query-Count', resp.headers)
+        self.assertEqual(self.client.get("/metrics/sql").status_code, 404)
+
+    def test_failed_statement(self):
+        """Does a statement that raises leave no timing behind?"""
+
+        conn = db.session.connection()
+        with self.assertRaises(Exception):
+            conn.execute("SELECT * FROM no_such_table")
+        db.session.rollback()
+
+        conn = db.session.connection()
+        conn.execute("SELECT 1")
+        self.assertNotIn('query_started', conn.connection.info)
@@ -105,3 +105,58 @@ class LikesModelTestCase(TestCase):
 
         # Message "m" should now have one like.
         self.assertEqual(len(Likes.query.get(m.id)), 2)
+
+
+    def test_liked_ids(self):
+        """Does liked_ids only report likes among the given messages?"""
+
+        u = User(
+            email="liker@test.com",
+            username="liker",
+            password="HASHED_PASSWORD"
+        )
+        db.session.add(u)
+        db.session.commit()
+
+        m1 = Message(text="liked", user_id=u.id)
+        m2 = Message(text="not liked", user_id=u.id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        Likes.add_like(m1.id, u.id)
+
+        self.assertEqual(Likes.liked_ids(u.id, [m1.id, m2.id]), {m1.id})
+        self.assertEqual(Likes.liked_ids(u.id, [m2.id]), set())
+        self.assertEqual(Likes.liked_ids(u.id, []), set())
+
+        Likes.remove_like(m1.id, u.id)
+
+        self.assertEqual(Likes.liked_ids(u.id, [m1.id, m2.id]), set())
+
+
+    def test_like_idempotent(self):
+        """Do repeated likes/unlikes count once, and report the count?"""
+
+        u = User(
+            email="again@test.com",
+            username="again",
+            password="HASHED_PASSWORD"
+        )
+        db.session.add(u)
+        db.session.commit()
+
+        m = Message(text="like me twice", user_id=u.id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertEqual(Likes.add_like(m.id, u.id), 1)
+        self.assertEqual(Likes.add_like(m.id, u.id), 1)
+        self.assertEqual(Likes.query.filter_by(message_id=m.id).count(), 1)
+        self.assertEqual(User.query.get(u.id).likes_count, 1)
+
+        self.assertEqual(Likes.remove_like(m.id, u.id), 0)
+        self.assertEqual(Likes.remove_like(m.id, u.id), 0)
+        self.assertEqual(User.query.get(u.id).likes_count, 0)
+
+        # No such message
+        self.assertIsNone(Likes.add_like(m.id + 1000, u.id))
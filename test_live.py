@@ -0,0 +1,148 @@
+"""Live timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_live.py
+
+
+import os
+from queue import Empty
+from unittest import TestCase
+
+from models import db, Follows, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from live import live_timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LiveTimelineTestCase(TestCase):
+    """Test pushing new messages to followers' event streams."""
+
+    def setUp(self):
+        """A reader following a writer, and a stranger who isn't."""
+
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD")
+                 for name in ('reader', 'writer', 'stranger')]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.reader_id, self.writer_id, self.stranger_id = [user.id for user in users]
+
+        Follows.follow(self.reader_id, [self.writer_id])
+        db.session.commit()
+
+        app.config['LIVE_TIMELINE_ENABLED'] = True
+
+    def tearDown(self):
+        app.config['LIVE_TIMELINE_ENABLED'] = False
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        return client
+
+    def post(self, text):
+        resp = self.client_for(self.writer_id).post("/messages/new", data={"text": text})
+        self.assertEqual(resp.status_code, 302)
+
+        return Message.query.filter_by(text=text).one().id
+
+    def test_notify(self):
+        """Does a new message reach its followers' streams, and only theirs?"""
+
+        reader = live_timeline.subscribe(self.reader_id)
+        stranger = live_timeline.subscribe(self.stranger_id)
+
+        try:
+            self.assertTrue(live_timeline.listening.wait(5))
+
+            message_id = self.post("Live warble")
+
+            stream_event = reader.get(timeout=5)
+            self.assertIn(f"id: {message_id}\n", stream_event)
+            self.assertIn("event: message\n", stream_event)
+            self.assertIn("data: ", stream_event)
+            self.assertIn("Live warble", stream_event)
+            self.assertIn("@writer", stream_event)
+
+            with self.assertRaises(Empty):
+                stranger.get(timeout=0.5)
+
+        finally:
+            live_timeline.unsubscribe(self.reader_id, reader)
+            live_timeline.unsubscribe(self.stranger_id, stranger)
+
+        self.assertNotIn(self.reader_id, live_timeline.subscribers)
+
+    def test_stream(self):
+        """Does the stream start by replaying what was missed?"""
+
+        first = self.post("First warble")
+        second = self.post("Second warble")
+
+        resp = self.client_for(self.reader_id).get(
+            f"/api/timeline/stream?since={first}", buffered=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/event-stream")
+
+        chunks = (chunk.decode('UTF-8') for chunk in resp.response)
+        self.assertTrue(next(chunks).startswith("retry: "))
+
+        replayed = next(chunks)
+        self.assertIn(f"id: {second}\n", replayed)
+        self.assertIn("Second warble", replayed)
+        self.assertIn(self.reader_id, live_timeline.subscribers)
+
+        resp.close()
+        self.assertNotIn(self.reader_id, live_timeline.subscribers)
+
+    def test_stream_unauthorized(self):
+        resp = app.test_client().get("/api/timeline/stream")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_homepage_stream_url(self):
+        """Does the first page of the homepage open a stream, and later ones not?"""
+
+        message_id = self.post("Warble")
+        client = self.client_for(self.reader_id)
+
+        html = client.get("/").get_data(as_text=True)
+        self.assertIn(f'data-stream-url="/api/timeline/stream?since={message_id}"', html)
+        self.assertIn(f'data-message-id="{message_id}"', html)
+
+        html = client.get("/?cursor=x").get_data(as_text=True)
+        self.assertNotIn("data-stream-url", html)
+
+    def test_disabled(self):
+        """Is there no stream unless it's turned on?"""
+
+        app.config['LIVE_TIMELINE_ENABLED'] = False
+        client = self.client_for(self.reader_id)
+
+        self.post("Warble")
+        self.assertNotIn("data-stream-url", client.get("/").get_data(as_text=True))
+        self.assertEqual(client.get("/api/timeline/stream").status_code, 404)
@@ -0,0 +1,112 @@
+"""CSV loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from loader import checkpoints, load_csvs, save_checkpoint
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class LoaderTestCase(TestCase):
+    """Test the streaming CSV loader."""
+
+    def setUp(self):
+        """Write sample CSVs to a scratch directory."""
+
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        self.tmp = TemporaryDirectory()
+        self.write('users.csv', ['id', 'email', 'username', 'password'], [
+            [1, 'one@test.com', 'one', 'HASHED_PASSWORD'],
+            [2, 'two@test.com', 'two', 'HASHED_PASSWORD'],
+            [3, 'three@test.com', 'three', 'HASHED_PASSWORD'],
+        ])
+        self.write('messages.csv', ['text', 'timestamp', 'user_id'], [
+            ['first', '2020-01-01 10:00:00', 1],
+            ['second', '2020-01-02 10:00:00', 2],
+        ])
+        self.write('follows.csv', ['user_being_followed_id', 'user_following_id'], [
+            [1, 2],
+            [2, 3],
+        ])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, header, rows):
+        with open(os.path.join(self.tmp.name, name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def test_load_csvs(self):
+        """Does a chunked load bring in every row and derived data?"""
+
+        load_csvs(self.tmp.name, chunk_size=2, rebuild_indexes=True,
+                  out=StringIO())
+
+        self.assertEqual(User.query.count(), 3)
+        self.assertEqual(Message.query.count(), 2)
+        self.assertEqual(Follows.query.count(), 2)
+        self.assertEqual(User.query.get(1).followers_count, 1)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=2).count(), 1)
+
+        # Sequences continue after the loaded ids:
+        u = User(email="four@test.com", username="four", password="HASHED")
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.id, 4)
+
+    def test_resume(self):
+        """Does a resumed load skip rows an earlier load committed?"""
+
+        load_csvs(self.tmp.name, out=StringIO())
+        Follows.query.delete()
+        db.session.commit()
+
+        with db.engine.begin() as connection:
+            save_checkpoint(connection, 'users', 3)
+            save_checkpoint(connection, 'messages', 2)
+            save_checkpoint(connection, 'follows', 1)
+
+        load_csvs(self.tmp.name, resume=True, out=StringIO())
+
+        # Only the second follow was (re)loaded:
+        self.assertEqual(User.query.count(), 3)
+        self.assertEqual(Message.query.count(), 2)
+        self.assertEqual([(f.user_being_followed_id, f.user_following_id)
+                          for f in Follows.query.all()], [(2, 3)])
+        self.assertEqual(db.engine.execute(checkpoints.count()).scalar(), 0)
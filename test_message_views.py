@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Follows, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -101,3 +101,86 @@ class MessageViewTestCase(TestCase):
 
             # Is the message deleted?
             self.assertEqual(Message.query.all(), [])
+
+
+    def test_home_timeline(self):
+        """Does a new message show up on a follower's home page?"""
+
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=self.testuser.id,
+                               user_following_id=follower.id))
+        db.session.commit()
+        follower_id = follower.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Fresh warble"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Fresh warble", html)
+
+
+    def test_liked_messages(self):
+        """Are liked messages listed most recently liked first?"""
+
+        older = Message(text="Posted first", user_id=self.testuser.id)
+        newer = Message(text="Posted second", user_id=self.testuser.id)
+        db.session.add_all([older, newer])
+        db.session.commit()
+
+        # Like the newer message first, then the older one:
+        Likes.add_like(newer.id, self.testuser.id)
+        Likes.add_like(older.id, self.testuser.id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/api/users/{self.testuser.id}/liked")
+            texts = [msg["text"] for msg in resp.get_json()["messages"]]
+            self.assertEqual(texts, ["Posted first", "Posted second"])
+
+            resp = c.get(f"/messages/{self.testuser.id}/liked")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(html.index("Posted first"), html.index("Posted second"))
+
+
+    def test_like_api(self):
+        """Does the JSON like endpoint like, unlike and report counts?"""
+
+        msg = Message(text="Like via API", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+        user_id = self.testuser.id
+        url = f"/api/messages/{msg_id}/like"
+
+        with self.client as c:
+            self.assertEqual(c.put(url).status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            for _ in range(2):
+                resp = c.put(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.json, {"message_id": msg_id, "liked": True, "likes": 1})
+
+            resp = c.delete(url)
+            self.assertEqual(resp.json, {"message_id": msg_id, "liked": False, "likes": 0})
+
+            self.assertEqual(c.put(f"/api/messages/{msg_id + 1000}/like").status_code, 404)
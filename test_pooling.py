@@ -0,0 +1,123 @@
+"""Connection pool tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_pooling.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from pooling import TimedNullPool, TimedQueuePool, configure_pool
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+def backend_pid():
+    return db.engine.execute("SELECT pg_backend_pid()").scalar()
+
+
+class PoolingTestCase(TestCase):
+    """Test pool configuration, fork safety and metrics."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def test_configure_pool(self):
+        """Are the configured pool settings passed to the engine?"""
+
+        config = dict(app.config, DB_POOL_SIZE=3, DB_MAX_OVERFLOW=2)
+        url = make_url("postgresql:///warbler")
+
+        options = {}
+        configure_pool(config, url, options)
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual((options['pool_size'], options['max_overflow']), (3, 2))
+        self.assertTrue(options['pool_pre_ping'])
+
+        options = {}
+        configure_pool(dict(config, DB_PGBOUNCER=True), url, options)
+        self.assertEqual(options, {'poolclass': TimedNullPool})
+
+        # Pool sizes Flask-SQLAlchemy set from its own config are dropped.
+        options = {'pool_size': 10, 'max_overflow': 5, 'pool_timeout': 30,
+                   'pool_recycle': 600}
+        configure_pool(dict(config, DB_PGBOUNCER=True), url, options)
+        self.assertEqual(options, {'poolclass': TimedNullPool, 'pool_recycle': 600})
+        create_engine(url, **options).dispose()
+
+        options = {}
+        configure_pool(config, make_url("sqlite://"), options)
+        self.assertEqual(options, {})
+
+        self.assertIsInstance(db.engine.pool, TimedQueuePool)
+
+    def test_fork(self):
+        """Does a forked child open its own connection, leaving ours alone?"""
+
+        # Just one connection in the pool, which the child inherits.
+        db.session.remove()
+        db.engine.dispose()
+
+        parent_backend = backend_pid()
+        read, write = os.pipe()
+
+        child = os.fork()
+        if child == 0:
+            try:
+                os.write(write, str(backend_pid()).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write)
+        os.waitpid(child, 0)
+        with os.fdopen(read) as pipe:
+            child_backend = int(pipe.read())
+
+        self.assertNotEqual(child_backend, parent_backend)
+        self.assertEqual(backend_pid(), parent_backend)
+
+    def test_metrics(self):
+        """Are checkouts and saturation reported at /metrics/pool, when on?"""
+
+        self.assertEqual(self.client.get("/metrics/pool").status_code, 404)
+
+        self.client.get("/users")
+
+        app.config['POOL_METRICS_ENDPOINT'] = True
+        try:
+            metrics = self.client.get("/metrics/pool").get_json()
+        finally:
+            app.config['POOL_METRICS_ENDPOINT'] = False
+
+        self.assertEqual(metrics["pid"], os.getpid())
+
+        primary = metrics["pools"]["primary"]
+        self.assertGreater(primary["checkouts"], 0)
+        self.assertEqual(primary["capacity"],
+                         app.config['DB_POOL_SIZE'] + app.config['DB_MAX_OVERFLOW'])
+        self.assertEqual(primary["in_use"], 0)
+        self.assertEqual(primary["saturation"], 0)
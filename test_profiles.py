@@ -0,0 +1,136 @@
+"""Profile cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_profiles.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from profiles import profiles
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ProfileCacheTestCase(TestCase):
+    """Test serving profiles from the cache, and dropping them on writes."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        profiles.clear()
+
+        celebrity = User.signup(username="celebrity",
+                                email="celebrity@test.com",
+                                password="password",
+                                image_url=None)
+        fan = User(email="fan@test.com", username="fan", password="HASHED_PASSWORD")
+        db.session.add(fan)
+        db.session.commit()
+
+        self.celebrity_id, self.fan_id = celebrity.id, fan.id
+
+        self.client = app.test_client()
+        app.config['SQL_METRICS_HEADERS'] = True
+
+    def tearDown(self):
+        app.config['SQL_METRICS_HEADERS'] = False
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        return client
+
+    def profile(self):
+        """(queries run, HTML) of an anonymous view of the celebrity's profile."""
+
+        resp = self.client.get(f"/users/{self.celebrity_id}")
+        self.assertEqual(resp.status_code, 200)
+
+        return int(resp.headers['X-DB-Query-Count']), resp.get_data(as_text=True)
+
+    def test_cached_view(self):
+        """Does a repeat view come from the cache, without the database?"""
+
+        queries, html = self.profile()
+        self.assertGreater(queries, 0)
+
+        queries, cached_html = self.profile()
+        self.assertEqual(queries, 0)
+        self.assertEqual(cached_html, html)
+
+        self.assertEqual(self.client.get("/users/0").status_code, 404)
+
+    def test_invalidation(self):
+        """Do the celebrity's and fans' writes show up at once?"""
+
+        self.profile()
+        celebrity = self.client_for(self.celebrity_id)
+        fan = self.client_for(self.fan_id)
+
+        celebrity.post("/messages/new", data={"text": "Hello fans"})
+        queries, html = self.profile()
+        self.assertGreater(queries, 0)
+        self.assertIn("Hello fans", html)
+
+        fan.post(f"/users/follow/{self.celebrity_id}")
+        _, html = self.profile()
+        self.assertIn(f'<a href="/users/{self.celebrity_id}/followers">1</a>', html)
+
+        resp = celebrity.post("/users/profile", data={"username": "superstar",
+                                                      "email": "star@test.com",
+                                                      "bio": "Famous",
+                                                      "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+        _, html = self.profile()
+        self.assertIn("@superstar", html)
+
+        msg_id = Message.query.one().id
+        celebrity.put(f"/api/messages/{msg_id}/like")
+        _, html = self.profile()
+        self.assertIn(f'<a href="/messages/{self.celebrity_id}/liked">1</a>', html)
+
+        celebrity.post(f"/messages/{msg_id}/delete")
+        _, html = self.profile()
+        self.assertNotIn("Hello fans", html)
+
+        celebrity.post("/users/delete")
+        self.assertEqual(self.client.get(f"/users/{self.celebrity_id}").status_code, 404)
+
+    def test_own_profile_fresh(self):
+        """Do users always see their own profile as it is now?"""
+
+        self.profile()
+
+        # Changed behind the cache's back
+        User.query.filter_by(id=self.celebrity_id).update({'bio': "Fresh bio"})
+        db.session.commit()
+
+        _, html = self.profile()
+        self.assertNotIn("Fresh bio", html)
+
+        html = self.client_for(self.celebrity_id).get(
+            f"/users/{self.celebrity_id}").get_data(as_text=True)
+        self.assertIn("Fresh bio", html)
@@ -0,0 +1,122 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_replicas.py
+#
+# They need a second database to stand in for a replica:
+#
+#    createdb warbler-test-replica
+#
+# It isn't really replicating, which lets us tell which database a page
+# was read from.
+
+
+import os
+from time import time
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+REPLICA_URL = os.environ.get('REPLICA_DATABASE_URL',
+                             "postgresql:///warbler-test-replica")
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from replicas import WROTE_AT_KEY
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+replica = create_engine(REPLICA_URL)
+db.metadata.create_all(replica)
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaTestCase(TestCase):
+    """Test which database pages read from and write to."""
+
+    def setUp(self):
+        """The same user on both, with a different name on the replica."""
+
+        Message.query.delete()
+        User.query.delete()
+
+        for model in (Likes, Follows, TimelineEntry, Message, User):
+            replica.execute(model.__table__.delete())
+
+        user = User.signup(username="primary",
+                           email="primary@test.com",
+                           password="password",
+                           image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+
+        replica.execute(User.__table__.insert(),
+                        id=self.user_id,
+                        username="replica",
+                        email="replica@test.com",
+                        password=user.password)
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [REPLICA_URL]
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        db.session.rollback()
+
+    def username_shown(self, client, url):
+        html = client.get(url).get_data(as_text=True)
+        return "primary" if "@primary" in html else "replica" if "@replica" in html else None
+
+    def test_reads_from_replica(self):
+        """Do read-only pages come from the replica, and others not?"""
+
+        self.assertEqual(self.username_shown(self.client, f"/users/{self.user_id}"),
+                         "replica")
+        self.assertEqual(self.username_shown(self.client, "/users"), "replica")
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        self.assertEqual(self.username_shown(self.client, "/users"), "primary")
+
+    def test_read_your_writes(self):
+        """After writing, does a user read from the primary for a while?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.post("/messages/new", data={"text": "Fresh warble"})
+            self.assertEqual(resp.status_code, 302)
+
+            self.assertEqual(Message.query.filter_by(user_id=self.user_id).count(), 1)
+            self.assertEqual(replica.execute(Message.__table__.select()).fetchall(), [])
+
+            html = c.get(f"/users/{self.user_id}").get_data(as_text=True)
+            self.assertIn("@primary", html)
+            self.assertIn("Fresh warble", html)
+
+            # Everyone else still reads from the replica.
+            self.assertEqual(self.username_shown(app.test_client(), "/users"),
+                             "replica")
+
+            # Once the replicas have had time to catch up, so does the writer.
+            with c.session_transaction() as sess:
+                sess[WROTE_AT_KEY] = time() - 60
+
+            self.assertEqual(self.username_shown(c, "/users"), "replica")
@@ -0,0 +1,151 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_suggestions.py
+
+
+import os
+from array import array
+from random import Random
+from unittest import TestCase
+
+from models import db, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from suggestions import load_graph, rank_suggestions, sample_followees, who_to_follow
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Load the follow graph when asked, not in the background
+
+app.config['WHO_TO_FOLLOW_REFRESH'] = 0
+
+
+class SuggestionsTestCase(TestCase):
+    """Test the follow graph and suggestions."""
+
+    def setUp(self):
+        """Make some users: me -> alice, bob; alice, bob -> carol; bob -> dave."""
+
+        User.query.delete()
+        Follows.query.delete()
+
+        users = {name: User(email=f"{name}@test.com",
+                            username=name,
+                            password="HASHED_PASSWORD")
+                 for name in ('me', 'alice', 'bob', 'carol', 'dave', 'erin')}
+        db.session.add_all(users.values())
+        db.session.commit()
+
+        self.ids = {name: user.id for name, user in users.items()}
+
+        for follower, followee in [('me', 'alice'), ('me', 'bob'),
+                                   ('alice', 'carol'), ('bob', 'carol'),
+                                   ('bob', 'dave'), ('erin', 'dave'),
+                                   ('carol', 'dave')]:
+            Follows.follow(self.ids[follower], [self.ids[followee]])
+        db.session.commit()
+
+        who_to_follow.refresh(full=True)
+
+    def test_graph(self):
+        """Does the CSR graph hold everyone's followees?"""
+
+        graph = load_graph(db.engine)
+        ids = self.ids
+
+        self.assertEqual(len(graph), 7)
+        self.assertEqual(set(graph.followees(ids['me'])), {ids['alice'], ids['bob']})
+        self.assertEqual(set(graph.followees(ids['dave'])), set())
+        self.assertEqual(set(graph.followees(ids['erin'] + 1000)), set())
+        self.assertEqual(graph.followers_count(ids['dave']), 3)
+
+    def test_ranking(self):
+        """Are friends of friends ranked by mutuals, then padded with popular users?"""
+
+        graph = who_to_follow.graph
+        ids = self.ids
+        ranked = rank_suggestions(graph, ids['me'], [ids['alice'], ids['bob']], 3)
+
+        # carol: 2 mutuals; dave: 1 mutual but more popular; then erin
+        self.assertEqual(ranked, [ids['carol'], ids['dave'], ids['erin']])
+
+    def test_follows_update_suggestions(self):
+        """Do this worker's own follows show up before the next reload?"""
+
+        ids = self.ids
+        self.assertIn(ids['carol'], who_to_follow.suggest(ids['me']))
+
+        who_to_follow.note_follows(ids['me'], followed=[ids['carol']])
+
+        self.assertNotIn(ids['carol'], who_to_follow.suggest(ids['me']))
+
+    def test_incremental_refresh(self):
+        """Does a refresh pick up follows, unfollows and deletions from anywhere?"""
+
+        ids = self.ids
+        graph = who_to_follow.graph
+
+        Follows.follow(ids['erin'], [ids['me']])
+        Follows.unfollow(ids['bob'], [ids['dave']])
+        User.mark_deleted(ids['carol'])
+        db.session.commit()
+
+        who_to_follow.refresh()
+
+        self.assertIs(who_to_follow.graph, graph)
+        self.assertEqual(set(graph.followees(ids['erin'])), {ids['dave'], ids['me']})
+        self.assertEqual(set(graph.followees(ids['bob'])), {ids['carol']})
+        self.assertEqual(graph.followers_count(ids['me']), 1)
+        self.assertFalse(graph.is_user(ids['carol']))
+
+        # Deleted users aren't suggested, even by friends of friends.
+        self.assertNotIn(ids['carol'], who_to_follow.suggest(ids['me']))
+        self.assertNotIn(ids['carol'], graph.popular)
+
+    def test_sample_spread(self):
+        """Are a long run's sampled followees spread across all of it?"""
+
+        ids = self.ids
+        graph = who_to_follow.graph
+        graph.replaced[ids['me']] = memoryview(array('i', range(1000)))
+
+        sample = list(sample_followees(graph, ids['me'], 100, Random(1)))
+
+        self.assertEqual(len(sample), 100)
+        self.assertLess(sample[0], 10)
+        self.assertGreaterEqual(sample[-1], 990)
+
+    def test_suggestions_endpoint(self):
+        """Does the API list suggested users?"""
+
+        with self.client_as(self.ids['me']) as c:
+            resp = c.get("/api/users/suggestions?limit=2")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([user['username'] for user in resp.json['users']],
+                             ['carol', 'dave'])
+
+            resp = c.get("/")
+            self.assertIn("Who to follow", resp.get_data(as_text=True))
+
+    def client_as(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
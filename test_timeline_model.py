@@ -0,0 +1,112 @@
+"""Timeline model tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline_model.py
+
+
+import os
+from unittest import TestCase
+
+import models
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class TimelineModelTestCase(TestCase):
+    """Test materialized home timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        self.author = User(email="author@test.com",
+                           username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="reader@test.com",
+                           username="reader",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=self.author.id,
+                               user_following_id=self.reader.id))
+        db.session.commit()
+
+    def timeline(self, user_id):
+        return (TimelineEntry
+                .feed(user_id)
+                .order_by(TimelineEntry.timestamp.desc())
+                .all())
+
+    def post(self, text):
+        msg = Message(text=text, user_id=self.author.id)
+        db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.fan_out(msg)
+        db.session.commit()
+        return msg
+
+    def test_fan_out(self):
+        """Does posting a message land it in each follower's timeline?"""
+
+        msg = self.post("Hello followers")
+
+        self.assertEqual(self.timeline(self.reader.id), [msg])
+        self.assertEqual(self.timeline(self.author.id), [])
+
+    def test_trim(self):
+        """Are timelines kept to TIMELINE_DEPTH entries?"""
+
+        old_depth = models.TIMELINE_DEPTH
+        models.TIMELINE_DEPTH = 2
+
+        try:
+            first = self.post("one")
+            self.post("two")
+            self.post("three")
+        finally:
+            models.TIMELINE_DEPTH = old_depth
+
+        timeline = self.timeline(self.reader.id)
+        self.assertEqual(len(timeline), 2)
+        self.assertNotIn(first, timeline)
+
+    def test_follow_and_unfollow(self):
+        """Do follow changes rebuild the affected timeline?"""
+
+        msg = self.post("Hello")
+        TimelineEntry.remove_followee(self.reader.id, self.author.id)
+        db.session.commit()
+        self.assertEqual(self.timeline(self.reader.id), [])
+
+        TimelineEntry.add_followee(self.reader.id, self.author.id)
+        db.session.commit()
+        self.assertEqual(self.timeline(self.reader.id), [msg])
+
+        TimelineEntry.rebuild()
+        db.session.commit()
+        self.assertEqual(self.timeline(self.reader.id), [msg])
@@ -0,0 +1,180 @@
+"""Trending tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_trending.py
+
+
+import os
+from time import time
+from unittest import TestCase
+
+from models import db, like_changed, Message, TrendingCount, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from trending import CountMinSketch, SlidingCounts, TopK, Trending, trending
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['TRENDING_SYNC_INTERVAL'] = 0
+
+
+class TrendingCountersTestCase(TestCase):
+    """Test the in-memory counters."""
+
+    def test_sketch(self):
+        """Does the sketch never undercount, and count exactly when sparse?"""
+
+        sketch = CountMinSketch(width=64, depth=3)
+        for key in range(500):
+            sketch.add(key, key % 7)
+
+        self.assertTrue(all(sketch.estimate(key) >= key % 7 for key in range(500)))
+
+        sparse = CountMinSketch()
+        sparse.add(1, 5)
+        sparse.add(2, 3)
+        sparse.add(1, -1)
+        self.assertEqual((sparse.estimate(1), sparse.estimate(2), sparse.estimate(3)),
+                         (4, 3, 0))
+
+    def test_top_k(self):
+        """Are only the k highest counts kept?"""
+
+        top = TopK(3)
+        for key, count in [(1, 5), (2, 1), (3, 3), (4, 4), (2, 2), (5, 1)]:
+            top.update(key, count)
+
+        self.assertEqual(top.items(), [(1, 5), (4, 4), (3, 3)])
+
+        top.update(1, 0)
+        top.update(6, 2)
+        self.assertEqual(top.items(), [(4, 4), (3, 3), (6, 2)])
+
+    def test_window(self):
+        """Do counts fall out of the window as it slides?"""
+
+        counts = SlidingCounts(window=60, buckets=6, top=10)
+        counts.add(1, 1, now=1000)
+        counts.add(1, 1, now=1025)
+        counts.add(2, 1, now=1025)
+        counts.add(2, 1, now=1035)
+
+        self.assertEqual(counts.top_items(now=1035, limit=10), [(1, 2), (2, 2)])
+        self.assertEqual(counts.top_items(now=1061, limit=10), [(2, 2), (1, 1)])
+        self.assertEqual(counts.top_items(now=1089, limit=10), [(2, 1)])
+        self.assertEqual(counts.top_items(now=5000, limit=10), [])
+
+        # Unliking something we never counted leaves everything alone.
+        counts.add(3, -1, now=5000)
+        self.assertEqual(counts.total.estimate(3), 0)
+
+
+class TrendingViewTestCase(TestCase):
+    """Test counting likes as they happen and the /trending page."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        TrendingCount.query.delete()
+        db.session.commit()
+        trending.reset()
+
+        self.users = [User(email=f"user{n}@test.com", username=f"user{n}",
+                           password="HASHED_PASSWORD")
+                      for n in range(3)]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+        self.messages = [Message(text=f"Warble {n}", user_id=self.users[0].id)
+                         for n in range(3)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+
+        self.user_ids = [user.id for user in self.users]
+        self.message_ids = [msg.id for msg in self.messages]
+
+    def like(self, user_id, message_id, method="PUT"):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        resp = client.open(f"/api/messages/{message_id}/like", method=method)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_trending(self):
+        """Are the most liked messages shown, most liked first?"""
+
+        first, second, third = self.message_ids
+
+        for user_id in self.user_ids:
+            self.like(user_id, second)
+        self.like(self.user_ids[0], first)
+        self.like(self.user_ids[1], first)
+        self.like(self.user_ids[1], first)          # again: no change
+        self.like(self.user_ids[1], first, "DELETE")
+
+        self.assertEqual(trending.top(), [(second, 3), (first, 1)])
+
+        html = app.test_client().get("/trending").get_data(as_text=True)
+        self.assertLess(html.index("Warble 1"), html.index("Warble 0"))
+        self.assertNotIn("Warble 2", html)
+
+    def test_sync(self):
+        """Do workers share their counts, each like counted once?"""
+
+        first, second, _ = self.message_ids
+        self.like(self.user_ids[0], first)
+        self.like(self.user_ids[1], first)
+
+        # Another worker, which hears about likes only through note_like
+        other = Trending(app)
+        like_changed.disconnect(other.on_like_changed)
+        other.note_like(first)
+        other.note_like(second)
+
+        now = time()
+        for worker in (trending, other, trending):
+            worker.sync(now=now)
+
+        self.assertEqual(trending.top(now=now), [(first, 3), (second, 1)])
+        self.assertEqual(other.top(now=now), [(first, 3), (second, 1)])
+
+        # New likes count at once where they happen, elsewhere after a sync.
+        other.note_like(second, now=now)
+        other.note_like(second, now=now)
+        self.assertEqual(other.top(now=now), [(first, 3), (second, 3)])
+        self.assertEqual(trending.top(now=now), [(first, 3), (second, 1)])
+        other.sync(now=now)
+        trending.sync(now=now)
+        self.assertEqual(trending.top(now=now), [(first, 3), (second, 3)])
+        other.note_like(second, -1, now=now)
+        other.note_like(second, -1, now=now)
+        other.sync(now=now)
+
+        # Syncing again, or starting afresh, doesn't count anything twice.
+        other.sync(now=now)
+        restarted = Trending(app)
+        like_changed.disconnect(restarted.on_like_changed)
+        restarted.sync(now=now)
+        self.assertEqual(restarted.top(now=now), [(first, 3), (second, 1)])
+
+        # Too old to count any more
+        later = now + 2 * app.config['TRENDING_WINDOW']
+        restarted.sync(now=later)
+        self.assertEqual(restarted.top(now=later), [])
+        self.assertEqual(TrendingCount.query.count(), 0)
@@ -9,6 +9,7 @@ import os
 from unittest import TestCase
 from flask_bcrypt import Bcrypt
 from models import db, User, Message, Follows
+from passwords import hasher, hash_rounds, pool_size
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -92,3 +93,82 @@ class UserModelTestCase(TestCase):
         db.session.commit()
 
         self.assertFalse(User.authenticate("usertest1", "hashedPassword"))
+
+
+    def test_user_counters(self):
+        """Do adjust_counts and reconcile_counts keep stats right?"""
+
+        u = User(
+            username="countme",
+            password="HASHED_PASSWORD",
+            email="countme@test.com"
+        )
+        db.session.add(u)
+        db.session.commit()
+
+        self.assertEqual(u.messages_count, 0)
+
+        User.adjust_counts(u.id, messages_count=1)
+        db.session.commit()
+        self.assertEqual(u.messages_count, 1)
+
+        # Counter drifted: there is no message row behind it.
+        self.assertEqual(User.reconcile_counts(), 1)
+        db.session.commit()
+        self.assertEqual(u.messages_count, 0)
+
+        db.session.add(Message(text="counted", user_id=u.id))
+        db.session.commit()
+        self.assertEqual(User.reconcile_counts(), 1)
+        db.session.commit()
+        self.assertEqual(u.messages_count, 1)
+        self.assertEqual(User.reconcile_counts(), 0)
+
+
+    def test_user_rehash_on_login(self):
+        """Is a hash with an outdated work factor upgraded on login?"""
+
+        old_rounds = hasher.rounds
+        hasher.rounds = 4
+
+        try:
+            User.signup("rehashme", "rehash@test.com", "password", None)
+            db.session.commit()
+
+            hasher.rounds = 5
+            user = User.authenticate("rehashme", "password")
+        finally:
+            hasher.rounds = old_rounds
+
+        self.assertTrue(user)
+        self.assertEqual(hash_rounds(user.password), 5)
+        self.assertFalse(User.authenticate("rehashme", "wrong password"))
+
+    def test_rehash_keeps_pending_changes(self):
+        """Is the rehash saved without committing the rest of the session?"""
+
+        old_rounds = hasher.rounds
+        hasher.rounds = 4
+
+        try:
+            User.signup("rehashme", "rehash@test.com", "password", None)
+            db.session.commit()
+
+            hasher.rounds = 5
+            user = User.query.filter_by(username="rehashme").one()
+            user.bio = "not saved"
+            self.assertTrue(user.check_password("password"))
+        finally:
+            hasher.rounds = old_rounds
+
+        db.session.rollback()
+        user = User.query.filter_by(username="rehashme").one()
+        self.assertEqual(hash_rounds(user.password), 5)
+        self.assertIsNone(user.bio)
+
+    def test_hash_pool_size(self):
+        """Is the hashing budget shared out between web workers?"""
+
+        self.assertEqual(pool_size(8, 4), 2)
+        self.assertEqual(pool_size(4, 8), 1)
+        self.assertEqual(pool_size(0, 4), 0)
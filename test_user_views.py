@@ -116,4 +116,100 @@ class UserViewTestCase(TestCase):
 
         # Is the request/response making OK connection?
         self.assertEqual(resp.status_code, 302)
-        self.assertEqual(resp.location, "http://localhost/signup")
\ No newline at end of file
+        self.assertEqual(resp.location, "http://localhost/signup")
+
+    def test_user_messages_pagination(self):
+        """Does the messages API page through a user's messages by cursor?"""
+
+        for i in range(3):
+            db.session.add(Message(text=f"Warble {i}", user_id=self.testuser1.id))
+            db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f"/api/users/{self.testuser1.id}/messages?limit=2")
+            page = resp.get_json()
+
+            # First page holds the two newest messages and a cursor:
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([m["text"] for m in page["messages"]],
+                             ["Warble 2", "Warble 1"])
+            self.assertIsNotNone(page["next_cursor"])
+
+            resp = c.get(f"/api/users/{self.testuser1.id}/messages"
+                         f"?limit=2&cursor={page['next_cursor']}")
+            page = resp.get_json()
+
+            # Last page holds the rest and no cursor:
+            self.assertEqual([m["text"] for m in page["messages"]],
+                             ["Warble 0"])
+            self.assertIsNone(page["next_cursor"])
+
+            # A garbled cursor is a bad request:
+            resp = c.get(f"/api/users/{self.testuser1.id}/messages?cursor=nope")
+            self.assertEqual(resp.status_code, 400)
+
+
+    def test_search_users(self):
+        """Is user search case-insensitive and ranked best match first?"""
+
+        User.signup(username="TestUser", email="test3@test.com",
+                    password="testuser3", image_url=None)
+        User.signup(username="mytestuser", email="test4@test.com",
+                    password="testuser4", image_url=None)
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get("/api/users/search?q=TESTUSER")
+            usernames = [user["username"] for user in resp.get_json()["users"]]
+
+            # Exact match, then prefix matches, then substring matches:
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(usernames,
+                             ["TestUser", "testuser1", "testuser2", "mytestuser"])
+
+            resp = c.get("/api/users/search?q=testuser&limit=1")
+            self.assertEqual(len(resp.get_json()["users"]), 1)
+
+            # Wildcards are matched literally:
+            resp = c.get("/api/users/search?q=%25")
+            self.assertEqual(resp.get_json()["users"], [])
+
+            html = c.get("/users?q=MYTEST").get_data(as_text=True)
+            self.assertIn('<p>@mytestuser</p>', html)
+            self.assertNotIn('<p>@testuser1</p>', html)
+
+
+    def test_bulk_follow(self):
+        """Does /api/follows follow and unfollow many users at once?"""
+
+        user1_id, user2_id = self.testuser1.id, self.testuser2.id
+        others = [User.signup(username=f"bulk{n}",
+                              email=f"bulk{n}@test.com",
+                              password="password",
+                              image_url=None) for n in range(3)]
+        db.session.commit()
+        other_ids = [user.id for user in others]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user1_id
+
+            resp = c.post("/api/follows", json={"follow": other_ids + [user2_id]})
+            self.assertEqual(resp.json, {"followed": sorted(other_ids + [user2_id]),
+                                         "unfollowed": [],
+                                         "following_count": 4})
+
+            resp = c.post("/api/follows", json={"follow": [user2_id],
+                                                "unfollow": other_ids[:2]})
+            self.assertEqual(resp.json, {"followed": [],
+                                         "unfollowed": sorted(other_ids[:2]),
+                                         "following_count": 2})
+
+            resp = c.post("/api/follows", json={"follow": list(range(101))})
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.delete(f"/api/users/{user2_id}/follow")
+            self.assertEqual(resp.json, {"user_id": user2_id,
+                                         "following": False,
+                                         "followers_count": 0,
+                                         "following_count": 1})
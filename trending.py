@@ -0,0 +1,387 @@
+"""Trending messages: the most liked over the last hour.
+
+Counting likes per message with GROUP BY over the likes table on every
+view would be slow, so likes are counted as they happen (Likes.add_like
+and remove_like send `like_changed`), and each worker keeps the current
+counts in memory, in fixed space however many messages get liked:
+
+- Likes go into a count-min sketch -- a few rows of counters, each
+  message hashed to one counter per row -- which never undercounts, and
+  overcounts only by collisions. There is one sketch per time bucket
+  (TRENDING_BUCKETS of them across TRENDING_WINDOW seconds), and a
+  running total of the window; when a bucket ages out it's subtracted
+  from the total, so the window slides.
+- The TRENDING_TOP messages with the highest counts are kept in a
+  min-heap, so a new like only has to beat the least of them.
+
+Showing /trending reads the top list -- O(K) -- and loads those
+messages by id.
+
+Each worker only sees the likes it handles, so the counts are shared
+through the trending_counts table, one row per message and bucket.
+Every TRENDING_SYNC_INTERVAL seconds a worker adds the likes it has
+seen since its last sync to those rows (an upsert of the deltas, so
+workers never overwrite each other), deletes rows that have left the
+window, and reads back just the shared top TRENDING_TOP -- everyone's
+likes, each counted once -- with one GROUP BY ... ORDER BY ... LIMIT.
+Its sketch then starts afresh, counting only its likes since, which
+are added to the shared counts when showing the top list. A worker
+starting up (or restarting) syncs too, so it begins with the shared
+counts rather than nothing. Likes handled by other workers show up
+within one interval.
+
+On PostgreSQL the upsert is one atomic INSERT ... ON CONFLICT. Elsewhere
+(SQLite, in development) it's an UPDATE, then an INSERT if there was no
+row: if two workers insert the same row at once, the loser's sync fails
+and rolls back, and its likes go out with its next sync.
+"""
+
+import heapq
+import logging
+import os
+import threading
+from array import array
+from collections import Counter
+from time import sleep, time
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+
+from models import db, like_changed, TrendingCount
+
+logger = logging.getLogger(__name__)
+
+SKETCH_WIDTH = 4096
+SKETCH_DEPTH = 4
+
+DEFAULT_WINDOW = 3600
+DEFAULT_BUCKETS = 12
+DEFAULT_TOP = 100
+DEFAULT_SYNC_INTERVAL = 15
+
+
+class CountMinSketch:
+    """Approximate counts of many keys in fixed memory."""
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.rows = [array('l', bytes(array('l').itemsize * width)) for _ in range(depth)]
+
+    def _slots(self, key):
+        # Tuples of ints hash the same in every process.
+        return [hash((row, key)) % self.width for row in range(len(self.rows))]
+
+    def add(self, key, count=1):
+        for row, slot in zip(self.rows, self._slots(key)):
+            row[slot] += count
+
+    def estimate(self, key):
+        """At least `key`'s true count (if no count went negative)."""
+
+        return min(row[slot] for row, slot in zip(self.rows, self._slots(key)))
+
+    def subtract(self, other):
+        for row, other_row in zip(self.rows, other.rows):
+            for slot, count in enumerate(other_row):
+                if count:
+                    row[slot] -= count
+
+    def clear(self):
+        for row in self.rows:
+            row[:] = array(row.typecode, bytes(row.itemsize * self.width))
+
+
+class TopK:
+    """The `k` keys with the highest counts, in a lazily updated min-heap.
+
+    `counts` is authoritative; the heap may hold stale (count, key)
+    entries, which are skipped when they reach the top.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self._heap = []
+
+    def update(self, key, count):
+        """Record `key`'s new count, admitting it if it now makes the top k."""
+
+        if key in self.counts:
+            if count <= 0:
+                del self.counts[key]
+            else:
+                self.counts[key] = count
+                heapq.heappush(self._heap, (count, key))
+
+        elif count > 0:
+            if len(self.counts) >= self.k:
+                least, least_key = self._least()
+                if count <= least:
+                    return
+                del self.counts[least_key]
+                heapq.heappop(self._heap)
+
+            self.counts[key] = count
+            heapq.heappush(self._heap, (count, key))
+
+        if len(self._heap) > 4 * self.k:
+            self._rebuild()
+
+    def _least(self):
+        while self._heap:
+            count, key = self._heap[0]
+            if self.counts.get(key) == count:
+                return count, key
+            heapq.heappop(self._heap)
+
+        return 0, None
+
+    def _rebuild(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def rescore(self, estimate):
+        """Re-read every key's count (e.g. after old likes expire)."""
+
+        self.counts = {key: count for key, count in
+                       ((key, estimate(key)) for key in self.counts)
+                       if count > 0}
+        self._rebuild()
+
+    def items(self):
+        """(key, count) pairs, highest count first."""
+
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+class SlidingCounts:
+    """Per-key counts over the last `window` seconds, in `buckets` steps."""
+
+    def __init__(self, window, buckets, top):
+        self.bucket_seconds = window / buckets
+        self.buckets = [CountMinSketch() for _ in range(buckets)]
+        self.total = CountMinSketch()
+        self.top = TopK(top)
+        self.current = None
+
+    def bucket_number(self, when):
+        return int(when // self.bucket_seconds)
+
+    def advance(self, now):
+        """Expire buckets older than the window."""
+
+        number = self.bucket_number(now)
+
+        if self.current is None:
+            self.current = number
+            return
+
+        if number <= self.current:
+            return
+
+        expired = min(number - self.current, len(self.buckets))
+        for step in range(1, expired + 1):
+            bucket = self.buckets[(self.current + step) % len(self.buckets)]
+            self.total.subtract(bucket)
+            bucket.clear()
+
+        self.current = number
+        self.top.rescore(self.total.estimate)
+
+    def add(self, key, count, now, bucket=None):
+        """Count `count` for `key`, in bucket number `bucket` (default: now's)."""
+
+        self.advance(now)
+
+        number = bucket if bucket is not None else self.current
+        if not self.current - len(self.buckets) < number <= self.current:
+            return
+
+        # An unlike of a like from before the window (or before we
+        # started counting) has nothing to take away from.
+        if count < 0 and self.total.estimate(key) <= 0:
+            return
+
+        self.buckets[number % len(self.buckets)].add(key, count)
+        self.total.add(key, count)
+        self.top.update(key, self.total.estimate(key))
+
+    def top_items(self, now, limit):
+        self.advance(now)
+        return self.top.items()[:limit]
+
+    def estimate(self, key, now):
+        self.advance(now)
+        return self.total.estimate(key)
+
+
+class Trending:
+    """Flask extension keeping trending counts, shared through the database."""
+
+    def __init__(self, app=None):
+        self.counts = None
+        self.shared = []
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRENDING_WINDOW', DEFAULT_WINDOW)
+        app.config.setdefault('TRENDING_BUCKETS', DEFAULT_BUCKETS)
+        app.config.setdefault('TRENDING_TOP', DEFAULT_TOP)
+        # 0 syncs only when sync() is called.
+        app.config.setdefault('TRENDING_SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)
+        self.app = app
+
+        self.reset()
+        like_changed.connect(self.on_like_changed, weak=False)
+
+    def new_counts(self):
+        config = self.app.config
+        return SlidingCounts(config['TRENDING_WINDOW'],
+                             config['TRENDING_BUCKETS'],
+                             config['TRENDING_TOP'])
+
+    def reset(self):
+        """Forget all counts, and likes not yet synced."""
+
+        with self._lock:
+            self.counts = self.new_counts()
+            self.shared = []
+            self._pending.clear()
+
+    def on_like_changed(self, sender, message_id, change):
+        self.note_like(message_id, change)
+
+    def note_like(self, message_id, change=1, now=None):
+        """Count a like (1) or unlike (-1) of a message."""
+
+        self._start_once()
+        now = now or time()
+
+        with self._lock:
+            self.counts.add(message_id, change, now)
+            self._pending[message_id, self.counts.bucket_number(now)] += change
+
+    def top(self, limit=None, now=None):
+        """[(message id, likes in the window)], most liked first."""
+
+        self._start_once()
+        now = now or time()
+        limit = limit or self.app.config['TRENDING_TOP']
+
+        with self._lock:
+            # The shared counts, plus our likes since we last synced.
+            shared = dict(self.shared)
+            local = self.counts.top_items(now, limit)
+            totals = {message_id: shared.get(message_id, 0) +
+                                   self.counts.estimate(message_id, now)
+                      for message_id in shared.keys() | {key for key, _ in local}}
+
+        return sorted(((message_id, likes) for message_id, likes in totals.items()
+                       if likes > 0),
+                      key=lambda item: (-item[1], item[0]))[:limit]
+
+    ##########################################################################
+    # Sharing counts between workers
+
+    def sync(self, now=None):
+        """Save our new likes to the shared counts, and load the shared top."""
+
+        now = now or time()
+
+        with self._sync_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+                oldest = self.counts.bucket_number(now) - len(self.counts.buckets) + 1
+
+            try:
+                with self.app.app_context():
+                    shared = self._exchange(pending, oldest)
+            except Exception:
+                # Keep them for next time.
+                with self._lock:
+                    self._pending.update(pending)
+                raise
+
+            counts = self.new_counts()
+
+            with self._lock:
+                # Likes noted while we were syncing go out next time, but
+                # should count meanwhile.
+                for (message_id, bucket), change in self._pending.items():
+                    counts.add(message_id, change, now, bucket=bucket)
+                self.counts = counts
+                self.shared = shared
+
+    def _exchange(self, pending, oldest):
+        """Add `pending` to trending_counts; return the top of buckets from `oldest` on."""
+
+        config = self.app.config
+        table = TrendingCount.__table__
+
+        # In key order, so concurrent syncs lock rows in the same order.
+        deltas = [{'message_id': message_id, 'bucket': bucket, 'likes': change}
+                  for (message_id, bucket), change in sorted(pending.items())
+                  if change and bucket >= oldest]
+
+        if deltas and db.engine.dialect.name == 'postgresql':
+            insert = postgresql.insert(table)
+            db.session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=[table.c.message_id, table.c.bucket],
+                    set_={'likes': table.c.likes + insert.excluded.likes}),
+                deltas)
+        else:
+            for delta in deltas:
+                updated = db.session.execute(
+                    table.update()
+                    .where(db.and_(table.c.message_id == delta['message_id'],
+                                   table.c.bucket == delta['bucket']))
+                    .values(likes=table.c.likes + delta['likes']))
+                if not updated.rowcount:
+                    db.session.execute(table.insert(), delta)
+
+        db.session.execute(table.delete().where(table.c.bucket < oldest))
+        db.session.commit()
+
+        likes = func.sum(table.c.likes)
+        return [(message_id, int(total)) for message_id, total in db.session.execute(
+            select([table.c.message_id, likes])
+            .where(table.c.bucket >= oldest)
+            .group_by(table.c.message_id)
+            .having(likes > 0)
+            .order_by(likes.desc(), table.c.message_id)
+            .limit(config['TRENDING_TOP']))]
+
+    def _start_once(self):
+        # Threads don't survive a fork, so start one in each process.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        if not self.app.config['TRENDING_SYNC_INTERVAL']:
+            return
+
+        # In the background: we may be inside a request (or a like's
+        # transaction), and it needs the database.
+        threading.Thread(target=self._sync_forever, name='trending',
+                         daemon=True).start()
+
+    def _sync_forever(self):
+        interval = self.app.config['TRENDING_SYNC_INTERVAL']
+
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Couldn't sync trending counts")
+            sleep(interval)
+
+
+trending = Trending()